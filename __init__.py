@@ -1,7 +1,20 @@
 from .booking import Histogram
+from .booking import Cutflow
+from .booking import CompositeDataset
 from .booking import dataset_from_artusoutput
 from .booking import Unit
 from .booking import UnitManager
+from .booking import UnitProduct
 from .optimization import GraphManager
 from .run import RunManager
+from .serialization import optimized_graphs
+from .validation import SchemaCache
+from .skimming import SkimCache
+from .staging import StagingArea
+from .session import Session
+from .merging import merge_outputs
+from .columnar import ColumnarResults
+from .output import ResultsFile
+from .service import create_warm_pool
+from .service import connect_to_service
 from .variations import ReplaceCut
@@ -0,0 +1,105 @@
+from ..booking import dataset_from_artusoutput
+from ..booking import Unit
+from ..utils import Selection
+from ..utils import Histogram
+from ..utils import Weight
+from ..utils import Cut
+from ..variations import ChangeDataset
+from ..variations import ReplaceCut
+from ..variations import ReplaceWeight
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+VARIABLES = [
+    ('m_vis', [0., 50., 60., 70., 80., 90., 100., 110., 120., 130., 150., 200., 300.]),
+    ('m_sv', [0., 50., 75., 100., 125., 150., 175., 200., 250., 300., 400.]),
+    ('pt_1', [25. + 5. * i for i in range(20)]),
+    ('pt_2', [25. + 5. * i for i in range(20)]),
+    ('pt_sv', [0. + 10. * i for i in range(31)]),
+    ('eta_1', [-2.4 + 0.2 * i for i in range(25)]),
+    ('eta_2', [-2.3 + 0.2 * i for i in range(24)]),
+    ('mt_1', [0. + 5. * i for i in range(31)]),
+    ('njets', [-0.5 + i for i in range(7)]),
+    ('ME_q2v1', [0. + 100. * i for i in range(51)]),
+    ('ME_vbf_vs_Z', [-1. + 0.05 * i for i in range(41)]),
+    ]
+
+
+def channel_selection():
+    return Selection(name = 'mt',
+        cuts = [
+            ('pt_1 > 25 && abs(eta_1) < 2.1', 'muon_kinematics'),
+            ('iso_1 < 0.15', 'muon_iso'),
+            ('byTightDeepTau2017v2p1VSjet_2 > 0.5', 'tau_iso'),
+            ('q_1 * q_2 < 0', 'os'),
+            ('mt_1 < 50', 'mt')],
+        weights = [
+            ('generatorWeight', 'generator_weight'),
+            ('puweight', 'pu_weight'),
+            ('idWeight_1 * isoWeight_1', 'id_iso_weight'),
+            ('trigweight_1', 'trg_weight')])
+
+
+def category_selections(ncategories):
+    """Categories defined by the number of jets and by increasingly
+    tight requirements on the visible mass.
+    """
+    categories = list()
+    for i in range(ncategories):
+        categories.append(Selection(name = 'cat{}'.format(i),
+            cuts = [
+                ('njets {} {}'.format('==' if i % 3 < 2 else '>=', i % 3), 'njets'),
+                ('m_vis > {}'.format(40 + 5 * (i // 3)), 'm_vis_cut')]))
+    return categories
+
+
+def variations(nvariations):
+    """Mix of the variation types used in a real analysis: shifted
+    folders of the ntuples, replaced weights and replaced cuts.
+    """
+    result = [
+        ChangeDataset('tauEsUp', 'tauEsUp'),
+        ChangeDataset('tauEsDown', 'tauEsDown')]
+    i = 0
+    while len(result) < nvariations:
+        if i % 2 == 0:
+            result.append(ReplaceWeight('CMS_weight_{}'.format(i), 'pu_weight',
+                Weight('puweight * {:.4f}'.format(1. + 0.001 * i), 'pu_weight')))
+        else:
+            result.append(ReplaceCut('CMS_cut_{}'.format(i), 'muon_iso',
+                Cut('iso_1 < {:.4f}'.format(0.15 + 0.0005 * i), 'muon_iso')))
+        i += 1
+    return result[:nvariations]
+
+
+def book_analysis(
+        base_directory, friends_directories, file_names,
+        ncategories = 20, nvariables = 10, nvariations = 100):
+    """Book a realistic analysis on the ntuples produced by
+    generate_ntuples: one dataset per file, every dataset processed
+    with the channel selection in every category, filling nvariables
+    histograms; every unit is then varied nvariations times.
+
+    Returns:
+        units (list): List of nominal Unit objects
+        variations (list): List of Variation objects to apply
+    """
+    datasets = [dataset_from_artusoutput(file_name, [file_name], 'mt_nominal',
+        base_directory, friends_directories) for file_name in file_names]
+    channel = channel_selection()
+    categories = category_selections(ncategories)
+    actions = list()
+    for i in range(nvariables):
+        variable, edges = VARIABLES[i % len(VARIABLES)]
+        # Repeated variables get different action names
+        name = variable if i < len(VARIABLES) else '{}_{}'.format(
+            variable, i // len(VARIABLES))
+        actions.append(Histogram(name, variable, edges))
+    units = [Unit(dataset, [channel, category], actions) \
+            for dataset in datasets for category in categories]
+    logger.info('Booked {} nominal units with {} actions each, {} variations'.format(
+        len(units), len(actions), nvariations))
+    return units, variations(nvariations)
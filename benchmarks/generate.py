@@ -0,0 +1,129 @@
+from time import time
+import os
+import argparse
+
+from ROOT import gROOT
+gROOT.SetBatch(True)
+from ROOT import gRandom
+from ROOT import RDataFrame
+from ROOT import RDF
+from ROOT.std import vector
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+# Branches of the base ntuples and of the friends, with the expressions
+# used to generate them; the names follow the artus conventions
+BASE_BRANCHES = {
+    'pt_1': 'gRandom->Exp(40.) + 20.',
+    'pt_2': 'gRandom->Exp(30.) + 25.',
+    'eta_1': 'gRandom->Uniform(-2.4, 2.4)',
+    'eta_2': 'gRandom->Uniform(-2.3, 2.3)',
+    'phi_1': 'gRandom->Uniform(-3.14159, 3.14159)',
+    'phi_2': 'gRandom->Uniform(-3.14159, 3.14159)',
+    'm_vis': 'gRandom->Landau(70., 15.)',
+    'mt_1': 'gRandom->Exp(35.)',
+    'njets': '(int)gRandom->Poisson(1.2)',
+    'nbtag': '(int)gRandom->Poisson(0.3)',
+    'q_1': 'gRandom->Uniform() < 0.5 ? -1 : 1',
+    'q_2': 'gRandom->Uniform() < 0.5 ? -1 : 1',
+    'iso_1': 'gRandom->Exp(0.1)',
+    'byTightDeepTau2017v2p1VSjet_2': '(int)(gRandom->Uniform() < 0.6)',
+    'byMediumDeepTau2017v2p1VSjet_2': '(int)(gRandom->Uniform() < 0.7)',
+    'gen_match_2': '(int)gRandom->Integer(7)',
+    'generatorWeight': 'gRandom->Uniform() < 0.02 ? -1. : 1.',
+    'puweight': 'gRandom->Gaus(1., 0.1)',
+    'idWeight_1': 'gRandom->Gaus(1., 0.02)',
+    'isoWeight_1': 'gRandom->Gaus(1., 0.02)',
+    'trigweight_1': 'gRandom->Gaus(1., 0.03)',
+    }
+
+FRIEND_BRANCHES = {
+    'SVFit': {
+        'm_sv': 'gRandom->Landau(100., 20.)',
+        'pt_sv': 'gRandom->Exp(50.)',
+        },
+    'MELA': {
+        'ME_q2v1': 'gRandom->Exp(1000.)',
+        'ME_q2v2': 'gRandom->Exp(1000.)',
+        'ME_vbf_vs_Z': 'gRandom->Uniform(-1., 1.)',
+        },
+    }
+
+
+def _snapshot(path, folders, branches, nentries):
+    for i, folder in enumerate(folders):
+        frame = RDataFrame(nentries)
+        columns = vector['string']()
+        for name, expression in sorted(branches.items()):
+            frame = frame.Define(name, expression)
+            columns.push_back(name)
+        options = RDF.RSnapshotOptions()
+        # Every folder is a new directory of the same file
+        options.fMode = 'RECREATE' if i == 0 else 'UPDATE'
+        frame.Snapshot('{}/ntuple'.format(folder), path, columns, options)
+
+
+def generate_ntuples(
+        directory, file_names, folders, nentries,
+        friends = ('SVFit', 'MELA'), seed = 4357):
+    """Generate synthetic ntuples in the artus layout, readable
+    by dataset_from_artusoutput:
+        directory/ntuples/file_name/file_name.root/folder/ntuple
+        directory/friends/friend/file_name/file_name.root/folder/ntuple
+
+    Args:
+        directory (str): Base directory of the generated files
+        file_names (list): Names of the files, e.g. one per sample
+        folders (list): Names of the TDirectoryFiles in every file,
+            e.g. ['mt_nominal', 'mt_tauEsUp']
+        nentries (int): Number of entries of every tree
+        friends (tuple): Names of the friend trees to generate,
+            chosen among the keys of FRIEND_BRANCHES
+        seed (int): Seed of the random number generator
+
+    Returns:
+        base_directory (str): Base directory of the ntuples
+        friends_directories (list): Base directories of the friends
+    """
+    gRandom.SetSeed(seed)
+    base_directory = os.path.join(directory, 'ntuples')
+    friends_directories = [os.path.join(directory, 'friends', friend) \
+            for friend in friends]
+    start = time()
+    for file_name in file_names:
+        for base, branches in [(base_directory, BASE_BRANCHES)] + [
+                (friend_directory, FRIEND_BRANCHES[friend]) \
+                        for friend, friend_directory in zip(friends, friends_directories)]:
+            file_directory = os.path.join(base, file_name)
+            if not os.path.isdir(file_directory):
+                os.makedirs(file_directory)
+            path = os.path.join(file_directory, '{}.root'.format(file_name))
+            _snapshot(path, folders, branches, nentries)
+    logger.info('Generated {} files with {} entries in {} folders in {:.2f} seconds'.format(
+        len(file_names), nentries, len(folders), time() - start))
+    return base_directory, friends_directories
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Generate synthetic artus-style ntuples for the benchmarks.')
+    parser.add_argument('directory', help = 'output directory')
+    parser.add_argument('--nfiles', type = int, default = 10,
+        help = 'number of files (samples)')
+    parser.add_argument('--nentries', type = int, default = 100000,
+        help = 'number of entries of every tree')
+    parser.add_argument('--folders', nargs = '+',
+        default = ['mt_nominal', 'mt_tauEsUp', 'mt_tauEsDown'],
+        help = 'TDirectoryFiles written in every file')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO)
+    generate_ntuples(args.directory,
+        ['sample{}'.format(i) for i in range(args.nfiles)],
+        args.folders, args.nentries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+from time import time
+import os
+import sys
+import json
+import argparse
+import platform
+import resource
+import subprocess
+
+from .generate import generate_ntuples
+from .analysis import book_analysis
+from ..booking import UnitManager
+from ..optimization import GraphManager
+from ..run import RunManager
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def count_nodes(graphs):
+    def count(node):
+        return 1 + sum([count(child) for child in node.children])
+    return sum([count(graph) for graph in graphs])
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd = os.path.dirname(os.path.abspath(__file__)),
+            stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    """Generate (if needed) the synthetic ntuples, book the analysis,
+    time every step and return a dictionary with the results.
+    """
+    file_names = ['sample{}'.format(i) for i in range(args.nfiles)]
+    base_directory = os.path.join(args.directory, 'ntuples')
+    friends_directories = [os.path.join(args.directory, 'friends', friend) \
+            for friend in ('SVFit', 'MELA')]
+    if not all([os.path.exists(os.path.join(base_directory, f, '{}.root'.format(f))) \
+            for f in file_names]):
+        generate_ntuples(args.directory, file_names,
+            ['mt_nominal', 'mt_tauEsUp', 'mt_tauEsDown'], args.nentries)
+
+    timings = dict()
+    counters = dict()
+
+    start = time()
+    units, variations = book_analysis(base_directory, friends_directories,
+        file_names, args.ncategories, args.nvariables, args.nvariations)
+    manager = UnitManager()
+    manager.book(units, variations)
+    timings['booking'] = time() - start
+    counters['units'] = len(manager.booked_units)
+    counters['actions'] = sum([len(unit.actions) for unit in manager.booked_units])
+    logger.info('Booking: {:.2f} s for {} units and {} actions'.format(
+        timings['booking'], counters['units'], counters['actions']))
+
+    graphs = None
+    for level in args.levels:
+        start = time()
+        graph_manager = GraphManager(manager.booked_units)
+        timings['graphs_level{}'.format(level)] = time() - start
+        start = time()
+        graph_manager.optimize(level)
+        timings['optimize_level{}'.format(level)] = time() - start
+        counters['graphs_level{}'.format(level)] = len(graph_manager.graphs)
+        counters['nodes_level{}'.format(level)] = count_nodes(graph_manager.graphs)
+        logger.info('Optimization level {}: {:.2f} s, {} graphs with {} nodes'.format(
+            level, timings['optimize_level{}'.format(level)],
+            counters['graphs_level{}'.format(level)],
+            counters['nodes_level{}'.format(level)]))
+        if level == args.run_level:
+            graphs = graph_manager.graphs
+
+    if not args.skip_run and graphs is not None:
+        output = os.path.join(args.directory, 'benchmark_output.root')
+        profile = os.path.join(args.directory, 'benchmark_profile.json')
+        start = time()
+        RunManager(graphs).run_locally(output,
+            args.nworkers, args.nthreads, profile = profile)
+        timings['execution'] = time() - start
+        with open(profile) as profile_file:
+            run_profile = json.load(profile_file)
+        counters['entries'] = run_profile['entries']
+        counters['events_per_second'] = run_profile['events_per_second']
+        logger.info('Execution: {:.2f} s, {:.0f} events/s'.format(
+            timings['execution'], counters['events_per_second']))
+
+    counters['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'commit': git_commit(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'timestamp': time(),
+        'parameters': {
+            'nfiles': args.nfiles,
+            'nentries': args.nentries,
+            'ncategories': args.ncategories,
+            'nvariables': args.nvariables,
+            'nvariations': args.nvariations,
+            'nworkers': args.nworkers,
+            'nthreads': args.nthreads,
+            'run_level': args.run_level},
+        'timings': timings,
+        'counters': counters}
+
+
+def compare(results, reference, tolerance):
+    """Compare the timings with the ones of a reference run.
+
+    Returns:
+        regressions (list): Names of the timings slower than the
+            reference by more than the relative tolerance
+    """
+    if results['parameters'] != reference['parameters']:
+        logger.warning('Comparing runs with different parameters: {} vs {}'.format(
+            results['parameters'], reference['parameters']))
+    regressions = list()
+    for name, value in sorted(results['timings'].items()):
+        if name not in reference['timings']:
+            continue
+        reference_value = reference['timings'][name]
+        ratio = value / reference_value if reference_value > 0. else float('inf')
+        flag = ''
+        if value > reference_value * (1. + tolerance) and value - reference_value > 0.01:
+            regressions.append(name)
+            flag = ' <-- REGRESSION'
+        logger.info('{:<24} {:>10.3f} s  reference {:>10.3f} s  ratio {:.2f}{}'.format(
+            name, value, reference_value, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Benchmark booking, optimization and execution of ntuple_processor.')
+    parser.add_argument('directory',
+        help = 'directory of the synthetic ntuples, generated if missing')
+    parser.add_argument('--nfiles', type = int, default = 10)
+    parser.add_argument('--nentries', type = int, default = 100000)
+    parser.add_argument('--ncategories', type = int, default = 20)
+    parser.add_argument('--nvariables', type = int, default = 10)
+    parser.add_argument('--nvariations', type = int, default = 100)
+    parser.add_argument('--levels', type = int, nargs = '+', default = [0, 1, 2, 3],
+        help = 'optimization levels to time')
+    parser.add_argument('--run-level', type = int, default = 2,
+        help = 'optimization level of the graphs that are executed')
+    parser.add_argument('--nworkers', type = int, default = 1)
+    parser.add_argument('--nthreads', type = int, default = 1)
+    parser.add_argument('--skip-run', action = 'store_true',
+        help = 'do not execute the event loops')
+    parser.add_argument('--save', help = 'write the results to this .json file')
+    parser.add_argument('--reference', help = '.json file of a previous run to compare with')
+    parser.add_argument('--tolerance', type = float, default = 0.1,
+        help = 'relative slowdown above which a timing is a regression')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO)
+
+    results = run_benchmarks(args)
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent = 2)
+        logger.info('Results saved to {}'.format(args.save))
+    if args.reference:
+        with open(args.reference) as reference_file:
+            reference = json.load(reference_file)
+        regressions = compare(results, reference, args.tolerance)
+        if regressions:
+            logger.error('Regressions found in: {}'.format(', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
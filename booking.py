@@ -1,12 +1,15 @@
 from .utils import Dataset
+from .utils import CompositeDataset
 from .utils import Selection
 from .utils import Ntuple
 from .utils import Cut
 from .utils import Weight
 from .utils import Action
 from .utils import Count
+from .utils import Cutflow
 from .utils import Histogram
 from .utils import Variation
+from .merging import CompositeSums
 
 from ROOT import gROOT
 gROOT.SetBatch(True)
@@ -119,7 +122,7 @@ class Unit:
             analysis on
         selections (list): List of Selection-type objects
         actions (Action): Actions to perform on the processed
-            dataset, can be 'Histogram' or 'Count'
+            dataset, can be 'Histogram', 'Count' or 'Cutflow'
         variation (Variation): Variations applied, meaning
             that this selection is the result of a variation
             applied on other selections
@@ -129,7 +132,7 @@ class Unit:
             analysis on
         selections (list): List of Selection-type objects
         actions (Action): Actions to perform on the processed
-            dataset, can be 'Histogram' or 'Count'
+            dataset, can be 'Histogram', 'Count' or 'Cutflow'
         variation (Variation): Variations applied, meaning
             that this selection is the result of a variation
             applied on other selections
@@ -185,6 +188,8 @@ class Unit:
             return Histogram(name, action.variable, action.edges)
         elif isinstance(action, Count):
             return Count(name, action.variable)
+        elif isinstance(action, Cutflow):
+            return Cutflow(name)
 
     def __eq__(self, other):
         return self.dataset == other.dataset and \
@@ -203,29 +208,179 @@ class UnitManager:
     objects as arguments or with no arguments, with the above mentioned
     objects added in a second time with the function 'book'.
 
+    The units of composite datasets are replaced by the units of their
+    components, shared with the units booked for the components
+    themselves, so that no event loop is run twice; the variations
+    are applied to the units of the components.
+
     Attributes:
         booked_units (list): List of the booked units, updated during
             initialization or with the function 'book'
+        composites (CompositeSums): Sums of the results of the
+            components giving the results of the composite datasets,
+            to be passed to RunManager
     """
 
-    booked_units = []
+    def __init__(self):
+        self.booked_units = []
+        self.composites = CompositeSums()
+        # Names of the actions booked explicitly, not only for the
+        # composites, and units already created by the variations
+        self.__explicit_names = set()
+        self.__varied_units = dict()
+
+    def __expand_composites(self, units):
+        """Replace the units of composite datasets with the units of
+        their components, with the actions named after the components.
+
+        Returns:
+            units (list): List of units without duplicates
+            origins (dict): Dictionary {unit: [(composite, scale factor)]}
+                of the units of the components
+        """
+        expanded = dict()
+        origins = dict()
+        for unit in units:
+            if not isinstance(unit.dataset, CompositeDataset):
+                expanded.setdefault(unit, unit)
+                continue
+            for component, scale_factor in unit.dataset.leaves():
+                component_unit = Unit(component, unit.selections, [])
+                component_unit.actions = [_renamed_action(action,
+                        component.name + action.name[len(unit.dataset.name):]) \
+                        for action in unit.actions]
+                component_unit = expanded.setdefault(component_unit, component_unit)
+                origins.setdefault(component_unit, list()).append(
+                    (unit.dataset.name, scale_factor))
+        return list(expanded.values()), origins
 
     def book(self, units, variations = None):
+        explicit = set([unit for unit in units \
+                if not isinstance(unit.dataset, CompositeDataset)])
+        units, origins = self.__expand_composites(units)
+        booked = set(self.booked_units)
         for unit in units:
-            if unit not in self.booked_units:
+            if unit not in booked:
+                booked.add(unit)
                 self.booked_units.append(unit)
         if variations:
             for variation in variations:
                 logger.debug('Applying variation {}'.format(variation))
                 for unit in units:
-                    self.apply_variation(unit, variation)
-        for action1, action2 in itertools.combinations([j for i in [
-            unit.actions for unit in self.booked_units] for j in i], 2):
-            if action1.name == action2.name:
-                logger.fatal('Caught two actions with same name ({}, {})'.format(
-                    action1.name, action2.name))
-                raise NameError
+                    # Units shared with a previous call are varied once
+                    key = (unit, variation.name)
+                    if key not in self.__varied_units:
+                        self.__varied_units[key] = self.apply_variation(unit, variation)
+                    new_unit = self.__varied_units[key]
+                    if unit in origins:
+                        origins[new_unit] = origins[unit]
+                    if unit in explicit:
+                        explicit.add(new_unit)
+        for unit in explicit:
+            self.__explicit_names.update([action.name for action in unit.actions])
+        names = set()
+        for unit in self.booked_units:
+            for action in unit.actions:
+                if action.name in names:
+                    logger.fatal('Caught two actions with same name ({}, {})'.format(
+                        action.name, action.name))
+                    raise NameError
+                names.add(action.name)
+        for unit, composites in origins.items():
+            for action in unit.actions:
+                for composite_name, scale_factor in composites:
+                    self.composites.add(
+                        composite_name + action.name[len(unit.dataset.name):],
+                        action.name, scale_factor)
+                self.composites.auxiliary.add(action.name)
+        # Results booked only for the composites, in this call or
+        # in the previous ones
+        self.composites.auxiliary -= self.__explicit_names
 
     def apply_variation(self, unit, variation):
         new_unit = variation.create(unit)
         self.booked_units.append(new_unit)
+        return new_unit
+
+
+def _renamed_action(action, name):
+    if isinstance(action, Histogram):
+        return Histogram(name, action.variable, action.edges)
+    elif isinstance(action, Count):
+        return Count(name, action.variable)
+    elif isinstance(action, Cutflow):
+        return Cutflow(name)
+
+
+class UnitProduct:
+    """
+    Declarative description of the units obtained combining every
+    dataset with one selection from each group of selections and with
+    the same list of actions, together with their variations. The
+    units are created lazily by the generator 'units', so that they
+    can be merged one by one into the graphs (see GraphManager.add_units)
+    without keeping all of them in memory. The datasets cannot be
+    composite datasets, whose units have to be booked with UnitManager.
+
+        product = UnitProduct(
+            [ztt, zll, data],
+            [[channel], categories],
+            [Histogram('m_vis', 'm_vis', edges)],
+            variations = [tau_es_up, tau_es_down],
+            exclude = [lambda unit, variation: \
+                unit.dataset.name == 'data' and variation is not None])
+        graph_manager = GraphManager([])
+        graph_manager.add_units(product.units())
+
+    Args:
+        datasets (list): List of Dataset objects
+        selections (list): List of groups (lists) of Selection objects,
+            every unit has one selection of each group
+        actions (list): List of Action objects booked in every unit
+        variations (list): List of Variation objects applied to
+            every nominal unit
+        include (list): List of functions (unit, variation) -> bool,
+            a unit is created only if all of them return True;
+            variation is None for the nominal units
+        exclude (list): List of functions (unit, variation) -> bool,
+            a unit is not created if any of them returns True
+
+    Attributes:
+        Same as the arguments
+    """
+    def __init__(self,
+            datasets, selections, actions, variations = None,
+            include = None, exclude = None):
+        for group in selections:
+            if not isinstance(group, list):
+                raise TypeError('selections has to be a list of lists of Selection objects')
+        self.datasets = datasets
+        self.selections = selections
+        self.actions = actions
+        self.variations = variations if variations is not None else list()
+        self.include = include if include is not None else list()
+        self.exclude = exclude if exclude is not None else list()
+
+    def __len__(self):
+        """Number of combinations, before include and exclude rules."""
+        size = len(self.datasets) * (1 + len(self.variations))
+        for group in self.selections:
+            size *= len(group)
+        return size
+
+    def __accepted(self, unit, variation):
+        return all([rule(unit, variation) for rule in self.include]) and \
+            not any([rule(unit, variation) for rule in self.exclude])
+
+    def units(self):
+        """Generator of the nominal units, each one followed
+        by the units of its variations.
+        """
+        for dataset in self.datasets:
+            for selections in itertools.product(*self.selections):
+                unit = Unit(dataset, list(selections), self.actions)
+                if self.__accepted(unit, None):
+                    yield unit
+                for variation in self.variations:
+                    if self.__accepted(unit, variation):
+                        yield variation.create(unit)
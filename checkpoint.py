@@ -0,0 +1,129 @@
+import os
+import json
+
+from .output import write_results
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class Journal:
+    """Journal of the tasks completed during a run, used to persist
+    partial results on disk and to resume an interrupted run.
+
+    Every completed task is written to its own partial .root file,
+    in the subdirectory partial_directory, and then recorded as a line
+    of the journal file, so that a task appears in the journal only if
+    its results are safely on disk. Only the journal and the files of
+    this subdirectory are removed when starting from scratch, the other
+    content of the directory is left untouched.
+
+    Args:
+        directory (str): Directory where the journal and the partial
+            results are stored, created if it does not exist
+        resume (bool): If False, previous content of the directory
+            is discarded
+
+    Attributes:
+        directory (str): Directory where the journal and the partial
+            results are stored
+        path (str): Path to the journal file
+        completed (dict): Dictionary {task_id: partial_output} of the
+            tasks already completed
+    """
+    journal_name = 'journal.jsonl'
+    partial_directory = 'partial'
+
+    def __init__(self, directory, resume = False):
+        self.directory = directory
+        self.path = os.path.join(directory, self.journal_name)
+        self.completed = dict()
+        if not os.path.isdir(os.path.join(directory, self.partial_directory)):
+            os.makedirs(os.path.join(directory, self.partial_directory))
+        if resume:
+            self.__load()
+        else:
+            self.__clear()
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            logger.info('No journal found in {}, start from scratch'.format(
+                self.directory))
+            return
+        with open(self.path) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line can be truncated if the driver was killed
+                    logger.warning('Skip corrupted line in journal {}'.format(self.path))
+                    continue
+                partial_output = os.path.join(self.directory, entry['file'])
+                if os.path.exists(partial_output):
+                    self.completed[entry['id']] = partial_output
+        logger.info('Found {} completed tasks in journal {}'.format(
+            len(self.completed), self.path))
+
+    def __clear(self):
+        if os.path.exists(self.path):
+            with open(self.path) as journal:
+                for line in journal:
+                    try:
+                        partial_output = os.path.join(
+                            self.directory, json.loads(line)['file'])
+                    except (ValueError, KeyError):
+                        continue
+                    if os.path.exists(partial_output):
+                        os.remove(partial_output)
+            os.remove(self.path)
+        partial_directory = os.path.join(self.directory, self.partial_directory)
+        for file_name in os.listdir(partial_directory):
+            os.remove(os.path.join(partial_directory, file_name))
+
+    def is_completed(self, task_id):
+        return task_id in self.completed
+
+    def record(self, task_id, name, results):
+        """Persist the results of a task and mark it as completed.
+
+        Args:
+            task_id (str): Unique identifier of the task
+            name (str): Human readable name of the task
+            results (dict): Dictionary {name: result} produced by
+                the task
+        """
+        file_name = os.path.join(self.partial_directory, '{}.root'.format(task_id))
+        partial_output = os.path.join(self.directory, file_name)
+        temp_output = os.path.join(self.directory, self.partial_directory,
+            '.{}.root'.format(task_id))
+        write_results(results, temp_output)
+        os.replace(temp_output, partial_output)
+        with open(self.path, 'a') as journal:
+            journal.write(json.dumps({
+                'id': task_id, 'name': name, 'file': file_name}) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        self.completed[task_id] = partial_output
+        logger.debug('%%%%%%%%%% Task {} ({}) recorded in journal'.format(
+            name, task_id))
+
+    def partial_outputs(self, task_ids = None):
+        """Paths of the partial outputs of the completed tasks.
+
+        Args:
+            task_ids (iterable): Identifiers of the tasks of the current
+                plan, the outputs of the other tasks recorded in the
+                journal (e.g. by a run with a different sharding) are
+                skipped with a warning, since they can cover the same
+                events; all the outputs if None
+        """
+        if task_ids is None:
+            return list(self.completed.values())
+        task_ids = set(task_ids)
+        stale = [task_id for task_id in self.completed if task_id not in task_ids]
+        if stale:
+            logger.warning('Skip {} partial outputs in {} of tasks not in the current plan'.format(
+                len(stale), self.directory))
+        return [partial_output for task_id, partial_output in self.completed.items() \
+                if task_id in task_ids]
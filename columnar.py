@@ -0,0 +1,175 @@
+import zipfile
+
+import numpy
+from numpy.lib import format as npy_format
+
+from .utils import root_array
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+# Arrays stored in a columnar file
+#   names (N,): names of the histograms
+#   edge_offsets (N + 1,): histogram i has the bin edges
+#       edges[edge_offsets[i]:edge_offsets[i + 1]]
+#   cell_offsets (N + 1,): histogram i has the bin contents, including
+#       under- and overflow, contents[cell_offsets[i]:cell_offsets[i + 1]]
+#       and the sum of the squares of the weights in the same
+#       slice of sumw2 (equal to the contents if not stored)
+#   entries (N,): number of entries of the histograms
+#   count_names (M,), counts (M,): names and values of the Count actions
+ARRAYS = ('names', 'edge_offsets', 'edges', 'cell_offsets',
+        'contents', 'sumw2', 'entries', 'count_names', 'counts')
+
+
+def write_columnar(results, output, compress = False):
+    """Write the histograms and the counts of results to a NumPy
+    archive (.npz) with contiguous arrays for all the histograms.
+
+    Uncompressed archives are memory-mapped by ColumnarResults, so
+    that opening the file and looking up a histogram does not depend
+    on the number of histograms stored.
+
+    Args:
+        results (dict): Dictionary {name: result} of the objects to write
+        output (str): Name of the output .npz file
+        compress (bool): Compress the arrays, smaller files which
+            are read entirely when opened
+    """
+    histograms = list()
+    counts = list()
+    for name, result in results.items():
+        if isinstance(result, (int, float)):
+            counts.append((name, float(result)))
+        else:
+            histograms.append((name, result))
+    edge_offsets = numpy.zeros(len(histograms) + 1, dtype = numpy.int64)
+    cell_offsets = numpy.zeros(len(histograms) + 1, dtype = numpy.int64)
+    for i, (name, histogram) in enumerate(histograms):
+        edge_offsets[i + 1] = edge_offsets[i] + histogram.GetNbinsX() + 1
+        cell_offsets[i + 1] = cell_offsets[i] + histogram.GetNcells()
+    edges = numpy.empty(edge_offsets[-1], dtype = numpy.float64)
+    contents = numpy.empty(cell_offsets[-1], dtype = numpy.float64)
+    sumw2 = numpy.empty(cell_offsets[-1], dtype = numpy.float64)
+    entries = numpy.empty(len(histograms), dtype = numpy.float64)
+    for i, (name, histogram) in enumerate(histograms):
+        axis = histogram.GetXaxis()
+        nbins = axis.GetNbins()
+        bins = axis.GetXbins()
+        if bins.GetSize() == nbins + 1:
+            edges[edge_offsets[i]:edge_offsets[i + 1]] = root_array(bins.GetArray(), nbins + 1)
+        else:
+            edges[edge_offsets[i]:edge_offsets[i + 1]] = numpy.linspace(
+                axis.GetXmin(), axis.GetXmax(), nbins + 1)
+        first, last = cell_offsets[i], cell_offsets[i + 1]
+        contents[first:last] = root_array(histogram.GetArray(), last - first)
+        if histogram.GetSumw2N() > 0:
+            sumw2[first:last] = root_array(histogram.GetSumw2().GetArray(), last - first)
+        else:
+            sumw2[first:last] = contents[first:last]
+        entries[i] = histogram.GetEntries()
+    save = numpy.savez_compressed if compress else numpy.savez
+    save(output,
+        names = numpy.array([name for name, _ in histograms], dtype = str),
+        edge_offsets = edge_offsets,
+        edges = edges,
+        cell_offsets = cell_offsets,
+        contents = contents,
+        sumw2 = sumw2,
+        entries = entries,
+        count_names = numpy.array([name for name, _ in counts], dtype = str),
+        counts = numpy.array([value for _, value in counts], dtype = numpy.float64))
+    logger.info('Wrote {} histograms and {} counts to {}'.format(
+        len(histograms), len(counts), output))
+
+
+def _load_member(archive, path, info):
+    """Memory-map a member of an uncompressed .npz file, or
+    read it if it is compressed.
+    """
+    if info.compress_type != zipfile.ZIP_STORED:
+        with archive.open(info) as member:
+            return npy_format.read_array(member)
+    with open(path, 'rb') as raw:
+        # Local file header: fixed 30 bytes, then name and extra field
+        raw.seek(info.header_offset + 26)
+        name_length, extra_length = numpy.frombuffer(raw.read(4), dtype = '<u2')
+        data_offset = info.header_offset + 30 + int(name_length) + int(extra_length)
+        raw.seek(data_offset)
+        version = npy_format.read_magic(raw)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(raw)
+        else:
+            shape, fortran_order, dtype = npy_format.read_array_header_2_0(raw)
+        array_offset = raw.tell()
+    if dtype.hasobject or 0 in shape:
+        with archive.open(info) as member:
+            return npy_format.read_array(member)
+    return numpy.memmap(path, dtype = dtype, mode = 'r', offset = array_offset,
+        shape = shape, order = 'F' if fortran_order else 'C')
+
+
+class ColumnarResults:
+    """Read-only access to a file written by write_columnar, with a
+    name index for the lookup of the histograms.
+
+        results = ColumnarResults('shapes.npz')
+        edges, contents, sumw2 = results['dataset#selection#Nominal#histogram']
+
+    Args:
+        path (str): Path to the .npz file
+
+    Attributes:
+        index (dict): Dictionary {name: position} of the histograms
+        counts (dict): Dictionary {name: value} of the counts
+    """
+    def __init__(self, path):
+        self.path = path
+        arrays = dict()
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                name = info.filename[:-len('.npy')]
+                if name in ARRAYS:
+                    arrays[name] = _load_member(archive, path, info)
+        missing = [name for name in ARRAYS if name not in arrays]
+        if missing:
+            logger.fatal('File {} is not a columnar output, missing arrays {}'.format(
+                path, missing))
+            raise ValueError
+        self.edge_offsets = arrays['edge_offsets']
+        self.edges = arrays['edges']
+        self.cell_offsets = arrays['cell_offsets']
+        self.contents = arrays['contents']
+        self.sumw2 = arrays['sumw2']
+        self.entries = arrays['entries']
+        self.index = dict(zip(arrays['names'].tolist(), range(len(arrays['names']))))
+        self.counts = dict(zip(arrays['count_names'].tolist(), arrays['counts'].tolist()))
+
+    def __str__(self):
+        return 'ColumnarResults-{}'.format(self.path)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __len__(self):
+        return len(self.index) + len(self.counts)
+
+    def __contains__(self, name):
+        return name in self.index or name in self.counts
+
+    def __getitem__(self, name):
+        """Views (edges, contents, sumw2) of the histogram called
+        name, contents and sumw2 including under- and overflow, or
+        the value of the count called name.
+        """
+        if name in self.counts:
+            return self.counts[name]
+        i = self.index[name]
+        cells = slice(self.cell_offsets[i], self.cell_offsets[i + 1])
+        return (self.edges[self.edge_offsets[i]:self.edge_offsets[i + 1]],
+                self.contents[cells], self.sumw2[cells])
+
+    def names(self):
+        return list(self.index.keys()) + list(self.counts.keys())
@@ -0,0 +1,231 @@
+from multiprocessing import Pool
+from time import time
+import os
+import shutil
+import argparse
+import tempfile
+
+from .output import read_results
+from .output import write_results
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def check_binning(reference, other):
+    """Check that two histograms can be summed, i.e. that they
+    have the same dimension and the same bin edges on every axis.
+
+    Args:
+        reference (TH1): Histogram taken as reference
+        other (TH1): Histogram compared with the reference
+
+    Raises:
+        ValueError: if the binnings are not consistent
+    """
+    def edges(axis):
+        return [axis.GetBinLowEdge(i) for i in range(1, axis.GetNbins() + 2)]
+
+    if reference.GetDimension() != other.GetDimension():
+        logger.fatal('Histograms {} have different dimensions ({}, {})'.format(
+            reference.GetName(), reference.GetDimension(), other.GetDimension()))
+        raise ValueError
+    axes = [
+        (reference.GetXaxis(), other.GetXaxis()),
+        (reference.GetYaxis(), other.GetYaxis()),
+        (reference.GetZaxis(), other.GetZaxis())]
+    for ref_axis, other_axis in axes[:reference.GetDimension()]:
+        if edges(ref_axis) != edges(other_axis):
+            logger.fatal('Histograms {} have inconsistent binnings'.format(
+                reference.GetName()))
+            raise ValueError
+
+
+def add_results(results, new_results):
+    """Sum by name the results in new_results to the ones
+    in results, which is updated in place.
+
+    Args:
+        results (dict): Dictionary {name: result} updated in place
+        new_results (dict): Dictionary {name: result} to add
+
+    Returns:
+        results (dict): The updated dictionary
+    """
+    for name, new_result in new_results.items():
+        if name not in results:
+            results[name] = new_result
+        elif isinstance(new_result, (int, float)):
+            results[name] += new_result
+        else:
+            check_binning(results[name], new_result)
+            results[name].Add(new_result)
+    return results
+
+
+class CompositeSums:
+    """Results of the composite datasets, obtained as weighted sums
+    of the results of their components once these are available
+    (see CompositeDataset and UnitManager.book).
+
+    Attributes:
+        sums (dict): Dictionary {name: [(component name, scale factor)]}
+            of the results of the composite datasets
+        auxiliary (set): Names of the results of the components booked
+            only to compute the composites, dropped by apply
+    """
+    def __init__(self):
+        self.sums = dict()
+        self.auxiliary = set()
+
+    def __len__(self):
+        return len(self.sums)
+
+    def add(self, name, component_name, scale_factor = 1.):
+        self.sums.setdefault(name, list()).append((component_name, scale_factor))
+
+    def update(self, other):
+        for name, components in other.sums.items():
+            for component_name, scale_factor in components:
+                self.add(name, component_name, scale_factor)
+        self.auxiliary.update(other.auxiliary)
+
+    def apply(self, results, drop_auxiliary = True):
+        """Add to a copy of results the composites whose components
+        are all in results.
+
+        Args:
+            results (dict): Dictionary {name: result}
+            drop_auxiliary (bool): Remove the results of the components
+                booked only for the composites
+
+        Returns:
+            results (dict): Dictionary {name: result} with the composites
+        """
+        new_results = {name: result for name, result in results.items() \
+                if not (drop_auxiliary and name in self.auxiliary)}
+        for name, components in self.sums.items():
+            if all([component_name in results for component_name, _ in components]):
+                new_results[name] = self.combine(name, results)
+        return new_results
+
+    def combine(self, name, results):
+        """Result of the composite called name, from the results
+        of its components in the dictionary results.
+        """
+        composite = None
+        for component_name, scale_factor in self.sums[name]:
+            result = results[component_name]
+            if isinstance(result, (int, float)):
+                composite = (composite or 0.) + scale_factor * result
+            elif composite is None:
+                composite = result.Clone(name)
+                composite.SetDirectory(0)
+                composite.SetTitle(name)
+                composite.Scale(scale_factor)
+            else:
+                check_binning(composite, result)
+                composite.Add(result, scale_factor)
+        return composite
+
+
+def _merge_group(group_output, compression = None, hierarchical = False):
+    inputs, output = group_output
+    results = dict()
+    for path in inputs:
+        add_results(results, read_results(path))
+    write_results(results, output, compression, hierarchical)
+    return output
+
+
+def merge_outputs(inputs, output, nworkers = 1, fan_in = 4, compression = None,
+        hierarchical = False):
+    """Merge many partial outputs into a single ROOT file, summing
+    histograms and counts with the same name.
+
+    The inputs are grouped by fan_in and every group is merged by a
+    different worker into a temporary file; the procedure is repeated
+    on the temporary files (tree reduction) until only one group is
+    left, which is merged into the output.
+
+    Args:
+        inputs (list): Paths to the partial .root files
+        output (str): Name of the merged .root file
+        nworkers (int): Number of workers passed to the
+            multiprocessing.Pool() function
+        fan_in (int): Number of files merged by each worker
+            at every step of the reduction
+        compression (int): ROOT compression setting of the output,
+            see output.write_results; the temporary files use the
+            default one
+        hierarchical (bool): Write the output with the hierarchical
+            layout, see output.write_results
+    """
+    if not inputs:
+        raise ValueError('no inputs to merge')
+    if not isinstance(nworkers, int):
+        raise TypeError('wrong type for nworkers')
+    if nworkers < 1:
+        raise ValueError('nworkers has to be larger zero')
+    if not isinstance(fan_in, int):
+        raise TypeError('wrong type for fan_in')
+    if fan_in < 2:
+        raise ValueError('fan_in has to be larger one')
+    logger.info('Merge {} partial outputs into {} using {} workers'.format(
+        len(inputs), output, nworkers))
+    start = time()
+    level = list(inputs)
+    if len(level) > fan_in:
+        temp_directory = tempfile.mkdtemp(
+            prefix = '.merge_',
+            dir = os.path.dirname(os.path.abspath(output)))
+        pool = Pool(nworkers)
+        try:
+            depth = 0
+            while len(level) > fan_in:
+                groups = [level[i:i + fan_in] for i in range(0, len(level), fan_in)]
+                outputs = [os.path.join(temp_directory, 'level{}_{}.root'.format(depth, i)) \
+                        for i in range(len(groups))]
+                logger.debug('%%%%%%%%%% Reduction step {}: {} files into {}'.format(
+                    depth, len(level), len(groups)))
+                new_level = pool.map(_merge_group, zip(groups, outputs))
+                # Intermediate files of the previous step are not needed anymore
+                for path in level:
+                    if path.startswith(temp_directory):
+                        os.remove(path)
+                level = new_level
+                depth += 1
+            _merge_group((level, output), compression, hierarchical)
+        finally:
+            pool.close()
+            pool.join()
+            shutil.rmtree(temp_directory, ignore_errors = True)
+    else:
+        _merge_group((level, output), compression, hierarchical)
+    end = time()
+    logger.info('Merged {} partial outputs in {:.2f} seconds'.format(
+        len(inputs), end - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Merge partial outputs of ntuple_processor, summing objects by name.')
+    parser.add_argument('output', help = 'name of the merged .root file')
+    parser.add_argument('inputs', nargs = '+', help = 'partial .root files')
+    parser.add_argument('-j', '--nworkers', type = int, default = 1,
+        help = 'number of parallel workers')
+    parser.add_argument('--fan-in', type = int, default = 4,
+        help = 'number of files merged by each worker at every step')
+    parser.add_argument('--compression', type = int, default = None,
+        help = 'ROOT compression setting of the output, e.g. 505 for ZSTD at level 5')
+    parser.add_argument('--hierarchical', action = 'store_true',
+        help = 'place the results in directories dataset/selections/variation')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO)
+    merge_outputs(args.inputs, args.output, args.nworkers, args.fan_in,
+        args.compression, args.hierarchical)
+
+
+if __name__ == '__main__':
+    main()
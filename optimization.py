@@ -3,8 +3,16 @@ from collections import Counter
 
 from .booking import Unit
 from .utils import Node
+from .utils import Dataset
+from .utils import CompositeDataset
+from .utils import JoinedSelection
+from .utils import Histogram
+from .utils import FineHistogram
 from .utils import PrintedNode
 from .utils import drawTree2
+from .utils import render_text
+from .utils import render_dot
+from .utils import render_json
 
 import logging
 logger = logging.getLogger(__name__)
@@ -31,8 +39,14 @@ class Graph(Node):
             indicating if we want to split the selections
             into minimal units
     """
+    __slots__ = ('split_selections',)
+
     def __init__(self, unit, split_selections = False):
         logger.debug('%%%%%%%%%% Constructing graph from Unit')
+        if isinstance(unit.dataset, CompositeDataset):
+            logger.fatal('Unit of composite dataset {} has to be booked with UnitManager'.format(
+                unit.dataset.name))
+            raise TypeError
         self.split_selections = split_selections
         Node.__init__(self,
             unit.dataset.name,
@@ -89,14 +103,26 @@ class GraphManager:
     Args:
         units (list): List of Unit objects used to
             fill the 'graphs' attribute
+        split_selections (Bool, str): split the selections into
+            minimal units; with 'adaptive' the selections are split
+            and, after the optimization, the chains of selection
+            nodes not shared by different branches are collapsed
+            again, so that they are split only where the graphs
+            diverge, and the cuts of every collapsed chain are
+            applied by a single filter (see JoinedSelection)
 
     Attributes:
         graphs (list): List of Graph objects that at some point
             will be merged and optimized
     """
     def __init__(self, units, split_selections = False):
+        if split_selections not in (True, False, 'adaptive'):
+            logger.fatal('Invalid value {} for split_selections'.format(split_selections))
+            raise ValueError
+        self.split_selections = split_selections
         self.graphs = [
-            Graph(unit, split_selections) for unit in units]
+            Graph(unit, bool(split_selections)) for unit in units]
+        self.__children_index = dict()
 
     def add_graph(self, graph):
         self.graphs.append(graph)
@@ -104,21 +130,109 @@ class GraphManager:
     def add_graph_from_unit(self, unit):
         self.graphs.append(Graph(unit))
 
+    def add_units(self, units):
+        """Build the graph of every unit and merge it right away into
+        the graphs already present, as optimize(2) would do, so that
+        units can be a generator (e.g. UnitProduct.units) and only the
+        merged graphs are kept in memory. The other optimizations
+        (e.g. level 3) can be applied afterwards with optimize.
+        With split_selections = 'adaptive' the chains of selections
+        are not collapsed here, since the collapsed nodes could not be
+        merged with the units added later: call optimize (or
+        collapse_selections) once all the units are added. Units of
+        composite datasets are not supported and have to be booked
+        with UnitManager, which replaces them with the units of
+        their components.
+
+        Args:
+            units (iterable): Unit objects
+
+        Returns:
+            nunits (int): Number of units added
+        """
+        roots = {graph: graph for graph in self.graphs}
+        names = self.__action_names()
+        nunits = 0
+        for unit in units:
+            for action in unit.actions:
+                if action.name in names:
+                    logger.fatal('Caught two actions with same name ({}, {})'.format(
+                        action.name, action.name))
+                    raise NameError
+                names.add(action.name)
+            graph = Graph(unit, bool(self.split_selections))
+            if graph in roots:
+                self.__merge_into(roots[graph], graph)
+            else:
+                roots[graph] = graph
+                self.graphs.append(graph)
+            nunits += 1
+        self.__children_index = dict()
+        logger.debug('Added {} units, {} graphs'.format(nunits, len(self.graphs)))
+        return nunits
+
+    def __action_names(self):
+        # Names of the actions in the graphs, including the histograms
+        # derived from the fine histograms
+        def action_names(node):
+            if node.kind == 'action':
+                yield node.name
+                for histogram in getattr(node.unit_block, 'histograms', ()):
+                    yield histogram.name
+            for child in node.children:
+                for name in action_names(child):
+                    yield name
+
+        return set([name for graph in self.graphs for name in action_names(graph)])
+
+    def __merge_into(self, node, other):
+        # Index of the children of the nodes reached by the merges,
+        # built when a node is reached for the first time
+        index = self.__children_index.get(id(node))
+        if index is None:
+            index = {child: child for child in node.children}
+            self.__children_index[id(node)] = index
+        for child in other.children:
+            if child in index:
+                self.__merge_into(index[child], child)
+            else:
+                index[child] = child
+                node.children.append(child)
+
     def optimize(self, level = 2):
+        """Optimize the graphs:
+            level 0: no optimization
+            level 1: merge the graphs of the same dataset
+            level 2: merge also the equal selections
+            level 3: merge also the graphs of different datasets
+                reading the same ntuples, see merge_ntuples, and fill
+                once the histograms of the same variable with different
+                binnings, see merge_binnings
+        """
         if int(level) == 0:
             logger.debug('No optimization selected.')
         elif int(level) == 1:
             logger.debug('Level 1 optimization selected: merge datasets.')
             self.merge_datasets()
-        elif int(level) >= 2:
+        elif int(level) == 2:
             logger.debug('Level 2 optimization selected: merge datasets and selections.')
             self.merge_datasets()
             self.optimize_selections()
+        elif int(level) >= 3:
+            logger.debug('Level 3 optimization selected: merge datasets, ntuples and selections.')
+            self.merge_datasets()
+            self.merge_ntuples()
+            self.optimize_selections()
+            self.merge_binnings()
         else:
             logger.debug('Invalid level of optimization, default to FULL OPTIMIZED.')
             self.merge_datasets()
             self.optimize_selections()
-        logger.debug('Merged graphs:\n{}'.format(self.get_pretty_printed_merged_graphs()))
+        if self.split_selections == 'adaptive':
+            self.collapse_selections()
+        # Rendering large graphs is expensive, do it only if needed
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Merged graphs:\n{}'.format(self.get_summary()))
 
     def merge_datasets(self):
         logger.debug('%%%%%%%%%% Merging datasets:')
@@ -134,12 +248,134 @@ class GraphManager:
         self.graphs = merged_graphs
         logger.debug('%%%%%%%%%% Merging datasets: DONE')
 
+    def merge_ntuples(self):
+        """Merge the graphs of different datasets reading the same
+        ntuples with the same friends, e.g. a sample split into
+        processes by selections, so that the files are read in a
+        single event loop. The merged graph is named after all the
+        datasets, while the names of the actions are unchanged.
+        """
+        def ntuples_key(dataset):
+            return tuple([(ntuple.path, ntuple.directory,
+                tuple([(friend.path, friend.directory, friend.tag) \
+                        for friend in getattr(ntuple, 'friends', [])])) \
+                for ntuple in dataset.ntuples])
+
+        logger.debug('%%%%%%%%%% Merging datasets with the same ntuples:')
+        groups = dict()
+        for graph in self.graphs:
+            groups.setdefault(ntuples_key(graph.unit_block), list()).append(graph)
+        merged_graphs = list()
+        for group in groups.values():
+            if len(group) == 1:
+                merged_graphs.append(group[0])
+                continue
+            name = '+'.join([graph.name for graph in group])
+            logger.debug('Merge datasets {}'.format(name))
+            merged_graph = Node(name, 'dataset',
+                Dataset(name, group[0].unit_block.ntuples),
+                *[child for graph in group for child in graph.children])
+            merged_graphs.append(merged_graph)
+        self.graphs = merged_graphs
+        logger.debug('%%%%%%%%%% Merging datasets with the same ntuples: DONE')
+
     def optimize_selections(self):
         logger.debug('%%%%%%%%%% Optimizing selections:')
         for merged_graph in self.graphs:
             self._merge_children(merged_graph)
         logger.debug('%%%%%%%%%% Optimizing selections: DONE')
 
+    def merge_binnings(self):
+        """Replace the histograms of the same variable and range booked
+        below the same node, thus with the same selection and weight, by
+        a single histogram filled with the union of their bin edges, from
+        which they are derived by rebinning (see FineHistogram), if it
+        has at most as many bins as the histograms replaced together.
+        With the same range, the derived histograms have also the same
+        entries and statistics as if they were filled directly. The
+        fine histograms are named after the first histogram replaced,
+        with a suffix making the name unique among the actions.
+        """
+        logger.debug('%%%%%%%%%% Merging binnings:')
+        names = self.__action_names()
+        stack = list(self.graphs)
+        nmerged = 0
+        while stack:
+            node = stack.pop()
+            groups = dict()
+            for child in node.children:
+                if child.kind == 'action' and type(child.unit_block) is Histogram:
+                    edges = child.unit_block.edges
+                    groups.setdefault((child.unit_block.variable, edges[0], edges[-1]),
+                        list()).append(child)
+                else:
+                    stack.append(child)
+            for (variable, _, _), group in groups.items():
+                if len(group) < 2:
+                    continue
+                histograms = [child.unit_block for child in group]
+                edges = sorted(set([edge for histogram in histograms \
+                        for edge in histogram.edges]))
+                if len(edges) - 1 > sum([len(histogram.edges) - 1 \
+                        for histogram in histograms]):
+                    continue
+                name = '{}_fine'.format(histograms[0].name)
+                suffix = 1
+                while name in names:
+                    suffix += 1
+                    name = '{}_fine{}'.format(histograms[0].name, suffix)
+                names.add(name)
+                fine = FineHistogram(name, variable, edges, histograms)
+                position = node.children.index(group[0])
+                merged = set([id(child) for child in group])
+                node.children = [child for child in node.children \
+                        if id(child) not in merged]
+                node.children.insert(position, Node(fine.name, 'action', fine))
+                nmerged += len(group)
+        logger.debug('%%%%%%%%%% Merging binnings: DONE, {} histograms merged'.format(
+            nmerged))
+
+    def collapse_selections(self):
+        logger.debug('%%%%%%%%%% Collapsing chains of selections:')
+        for merged_graph in self.graphs:
+            self._collapse_children(merged_graph)
+        logger.debug('%%%%%%%%%% Collapsing chains of selections: DONE')
+
+    def _collapse_children(self, node):
+        '''Merge every selection node having a single child, which
+        is also a selection node, with its child: the cuts of the
+        chain are applied by a single node, in the same order, with
+        a single filter (see JoinedSelection).
+        '''
+        for i, child in enumerate(node.children):
+            while child.kind == 'selection' and len(child.children) == 1 \
+                    and child.children[0].kind == 'selection':
+                grandchild = child.children[0]
+                selection = JoinedSelection(
+                    '-'.join([child.name, grandchild.name]),
+                    child.unit_block.cuts + grandchild.unit_block.cuts,
+                    child.unit_block.weights + grandchild.unit_block.weights)
+                child = Node(selection.name, 'selection', selection,
+                    *grandchild.children)
+            node.children[i] = child
+            self._collapse_children(child)
+
+    def get_summary(self, max_children = 20):
+        """Text representation of the graphs, linear in the number of
+        nodes, with at most max_children children shown for every node.
+        """
+        return render_text(self.graphs, max_children)
+
+    def write_dot(self, path):
+        """Write the graphs to a Graphviz DOT file."""
+        with open(path, 'w') as dot_file:
+            dot_file.write(render_dot(self.graphs))
+
+    def write_json(self, path):
+        """Write the graphs to a JSON file as a flat list of nodes."""
+        with open(path, 'w') as json_file:
+            json_file.write(render_json(self.graphs))
+
     def get_pretty_printed_merged_graphs(self):
         def call_node_rec(nd):
             return PrintedNode(nd.__repr__())([call_node_rec(child) for child in nd.children])
@@ -152,14 +388,13 @@ class GraphManager:
         the children of the new spotted ones to the
         children of the first spotted.
         '''
-        merged_children = list()
+        merged_children = dict()
         for child in node.children:
             if child not in merged_children:
-                merged_children.append(child)
+                merged_children[child] = child
             else:
-                merged_children[merged_children.index(
-                    child)].children.extend(
-                        child.children)
-        node.children = merged_children
+                merged_children[child].children.extend(
+                    child.children)
+        node.children = list(merged_children.values())
         for child in node.children:
             self._merge_children(child)
@@ -0,0 +1,157 @@
+from ROOT import gROOT
+gROOT.SetBatch(True)
+from ROOT import TFile
+from ROOT import TParameter
+from ROOT import TObjString
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+# Name of the object listing the names of the results
+# of a file written with the hierarchical layout
+INDEX_NAME = '__index__'
+
+
+def result_path(name):
+    """Path of the result called name in the hierarchical layout:
+    the components of the name dataset#selections#variation#action
+    become directories, e.g. dataset/selections/variation/action.
+    Names with a different structure are placed in the top directory.
+    """
+    components = name.split('#')
+    if len(components) != 4 or '/' in name or '' in components:
+        return name
+    return '/'.join(components)
+
+
+def write_results(results, output, compression = None, hierarchical = False):
+    """Write to a ROOT file the results of the booked actions.
+
+    Histograms are written as they are, while the values
+    produced by Count actions are stored as TParameter<double>
+    objects, named after the corresponding action.
+
+    Args:
+        results (dict): Dictionary {name: result} of the
+            objects to write
+        output (str): Name of the output .root file
+        compression (int): ROOT compression setting of the file,
+            100 * algorithm + level (e.g. 404 for LZ4 at level 4 or
+            505 for ZSTD at level 5), ROOT default if None
+        hierarchical (bool): Place the results in directories built
+            from the components of their names (see result_path) and
+            write an index of the names, read by ResultsFile, instead
+            of writing all of them in the top directory
+    """
+    if compression is None:
+        root_file = TFile(output, 'RECREATE')
+    else:
+        root_file = TFile(output, 'RECREATE', '', compression)
+    directories = {'': root_file}
+    for name, result in results.items():
+        key = name
+        directory = root_file
+        if hierarchical:
+            path = result_path(name)
+            if '/' in path:
+                directory_path, key = path.rsplit('/', 1)
+                if directory_path not in directories:
+                    directories[directory_path] = root_file.mkdir(
+                        directory_path, '', True)
+                directory = directories[directory_path]
+        directory.cd()
+        if isinstance(result, (int, float)):
+            TParameter('double')(key, float(result)).Write()
+        else:
+            result.Write(key)
+    if hierarchical:
+        root_file.cd()
+        TObjString('\n'.join(results.keys())).Write(INDEX_NAME)
+    root_file.Close()
+
+
+class ResultsFile:
+    """Read the objects written by write_results, looking them up
+    by their original names in both the flat and the hierarchical
+    layout.
+
+        with ResultsFile('shapes.root') as results:
+            histogram = results.get('dataset#selection#Nominal#histogram')
+
+    Args:
+        path (str): Path to the .root file
+
+    Attributes:
+        hierarchical (bool): The file has the hierarchical layout
+    """
+    def __init__(self, path):
+        self.path = path
+        self.root_file = TFile(path, 'READ')
+        if self.root_file.IsZombie():
+            logger.fatal('File {} does not exist, abort'.format(path))
+            raise FileNotFoundError
+        index = self.root_file.Get(INDEX_NAME)
+        self.hierarchical = bool(index)
+        if self.hierarchical:
+            self.__names = str(index.GetString()).split('\n')
+        else:
+            self.__names = list(dict.fromkeys(
+                [key.GetName() for key in self.root_file.GetListOfKeys()]))
+
+    def __str__(self):
+        return 'ResultsFile-{}'.format(self.path)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.root_file.Close()
+
+    def names(self):
+        return list(self.__names)
+
+    def get(self, name):
+        """Result called name: a histogram detached from the file or,
+        for the counts, a float; None if the object is not supported.
+        """
+        path = result_path(name) if self.hierarchical else name
+        obj = self.root_file.Get(path)
+        if not obj:
+            logger.fatal('Result {} not found in {}'.format(name, self.path))
+            raise KeyError(name)
+        if obj.InheritsFrom('TH1'):
+            obj.SetDirectory(0)
+            return obj
+        elif obj.ClassName() == 'TParameter<double>':
+            return obj.GetVal()
+        logger.warning('Skip object {} of unsupported type {}'.format(
+            name, obj.ClassName()))
+        return None
+
+
+def read_results(path):
+    """Read back the objects written by write_results.
+
+    Args:
+        path (str): Path to the .root file
+
+    Returns:
+        results (dict): Dictionary {name: result}, where
+            histograms are detached from the file and counts
+            are converted back to float
+    """
+    results = dict()
+    with ResultsFile(path) as results_file:
+        for name in results_file.names():
+            result = results_file.get(name)
+            if result is not None:
+                results[name] = result
+    return results
@@ -1,16 +1,62 @@
 from multiprocessing import Pool
+from multiprocessing import SimpleQueue
+from multiprocessing.managers import SyncManager
 from time import time
+from time import sleep
+from threading import Thread
+from threading import Lock
+from concurrent.futures import Future
+from collections import Counter
+from collections import deque
+import os
+import resource
 
+from .merging import add_results
+from .merging import merge_outputs
+from .output import write_results
+from .output import read_results
+from .columnar import write_columnar
+from .checkpoint import Journal
+from .serialization import dump_graphs
+from .serialization import load_graphs
+from .serialization import graphs_key
+from .validation import validate_graphs
+from .transfer import SharedResults
+from .transfer import pack_results
+from .transfer import unpack_results
+from .transfer import new_block_name
+from .transfer import release_blocks
+from .utils import Dataset
+from .utils import Node
+from .utils import JoinedSelection
 from .utils import Count
 from .utils import Histogram
+from .utils import Cutflow
+from .utils import FineHistogram
+from .utils import CutflowResult
+from .utils import RebinnedResult
 from .utils import RDataFrameCutWeight
+from .utils import Task
+from .utils import GraphProfile
+from .utils import RunProfile
+from .utils import ProgressMonitor
+from .utils import ProgressReporter
+from .utils import estimate_cost
+from .utils import plan_workers_threads
+from .utils import share_threads
+from .utils import available_cores
 
+import ROOT
 from ROOT import gROOT
 gROOT.SetBatch(True)
+from ROOT import gInterpreter
 from ROOT import RDataFrame
-from ROOT import TFile
 from ROOT import TChain
+from ROOT import TH1D
 from ROOT import EnableImplicitMT
+from ROOT import DisableImplicitMT
+from ROOT import IsImplicitMTEnabled
+from ROOT import GetThreadPoolSize
 from ROOT.std import vector
 
 import logging
@@ -18,6 +64,86 @@ logger = logging.getLogger(__name__)
 
 
 
+# C++ helpers used to monitor the event loops from the workers without
+# calling back into Python from the RDataFrame threads
+HELPERS_DECLARATION = '''
+#ifndef NTUPLE_PROCESSOR_HELPERS
+#define NTUPLE_PROCESSOR_HELPERS
+#include <atomic>
+#include <chrono>
+#include <mutex>
+#include "ROOT/RDataFrame.hxx"
+
+namespace ntuple_processor {
+
+inline double Now()
+{
+    return std::chrono::duration<double>(
+        std::chrono::system_clock::now().time_since_epoch()).count();
+}
+
+class LoopMonitor {
+public:
+    void Monitor(ROOT::RDF::RResultPtr<ULong64_t> &count, ULong64_t every)
+    {
+        count.OnPartialResultSlot(0, [this](unsigned int, ULong64_t &) {
+            std::call_once(fStarted, [this]() { fFirstEntry = Now(); });
+        });
+        count.OnPartialResultSlot(every, [this, every](unsigned int, ULong64_t &) {
+            fEntries += every;
+        });
+    }
+    double GetFirstEntryTime() const { return fFirstEntry; }
+    ULong64_t GetEntries() const { return fEntries.load(); }
+
+private:
+    std::once_flag fStarted;
+    double fFirstEntry = 0.;
+    std::atomic<ULong64_t> fEntries{0};
+};
+
+// Run the event loop through a plain function, so that the GIL
+// can be released while the loop is running
+inline ULong64_t RunEventLoop(ROOT::RDF::RResultPtr<ULong64_t> &count)
+{
+    return count.GetValue();
+}
+
+}
+#endif
+'''
+
+
+def set_threads(nthreads):
+    """Enable the implicit multi-threading of ROOT with nthreads
+    threads, changing the size of the pool only if needed.
+    """
+    current = GetThreadPoolSize() if IsImplicitMTEnabled() else 1
+    if current == nthreads:
+        return
+    if IsImplicitMTEnabled():
+        DisableImplicitMT()
+    if nthreads > 1:
+        EnableImplicitMT(nthreads)
+
+
+# Queue of the start messages of the tasks, inherited by the workers
+# of the pools created by the runs
+_start_queue = None
+
+
+def _set_start_queue(start_queue):
+    global _start_queue
+    _start_queue = start_queue
+
+
+def declare_helpers():
+    if not hasattr(ROOT, 'ntuple_processor'):
+        if not gInterpreter.Declare(HELPERS_DECLARATION):
+            raise RuntimeError('failed to declare the C++ helpers')
+        ROOT.ntuple_processor.RunEventLoop.__release_gil__ = True
+
+
 class RunManager:
     """Convert the Graph-style language into PyROOT/RDataFrame
     language and schedule RDataFrame operations, like the
@@ -26,94 +152,886 @@ class RunManager:
         Selection()   -->   Filter()
         Count()       -->   Sum()
         Histogram()   -->   Histo1D()
+        Cutflow()     -->   Sum() and Count() after every Filter()
 
     Args:
         graphs (list): List of Graph objects that are converted
             node by node to RDataFrame operations
+        skim_cache (SkimCache): if given, the selections with complete
+            skims in the cache are redirected to them, and the skims
+            missing are written during the event loops, see
+            skimming.SkimCache; when resuming a run, the graphs with
+            tasks in the journal are not redirected
+        staging (StagingArea): if given, the input files are copied
+            to a local directory ahead of the tasks reading them, see
+            staging.StagingArea
+        composites (CompositeSums): results of the composite datasets
+            computed from the results of their components, see
+            UnitManager.composites
 
     Attributes:
         graphs (list): List of graphs to be processed
+        source_graphs (list): List of graphs given, before the
+            redirection to the skims
+        cut_report (bool): apply the cuts of the collapsed selections
+            (see JoinedSelection) with one named filter per cut, so
+            that all of them appear in the report of the profile
         tchains (list): List of TChains created, saved as attribute
             for the class in order to not let them go out of scope
         friend_tchains (list): List of friend TChains created,
             saved as attribute for the class in otder to not let
             them out of scope
     """
-    def __init__(self, graphs):
+    def __init__(self, graphs, skim_cache = None, staging = None,
+            composites = None):
+        self.skim_cache = skim_cache
+        self.staging = staging
+        self.composites = composites
+        # One named filter per cut also for the collapsed selections
+        # (see JoinedSelection), set when the profile is written
+        self.cut_report = False
+        # Graphs before the redirection to the skims
+        self.source_graphs = graphs
+        if skim_cache is not None:
+            graphs = skim_cache.redirect(graphs)
         self.graphs = graphs
+        self._reset()
+
+    def _reset(self):
+        """Drop the RDataFrame objects created by previous conversions."""
         self.tchains = list()
         self.friend_tchains = list()
         self.rcws = list()
+        self.filters = list()
+        self.actions = list()
+        # Frames, filters and weight columns already created, keyed
+        # by dataset and sequence of cuts, reused by equal nodes
+        self.frame_cache = dict()
+        self.filter_cache = dict()
+        self.weight_cache = dict()
 
-    def _run_multiprocess(self, graph):
+    # Entries processed by a thread between two progress updates
+    progress_every = 10000
+
+    def _run_multiprocess(self, graph, task_id = None, progress_queue = None,
+            nthreads = 1):
+        declare_helpers()
+        set_threads(nthreads)
+        self._reset()
+        profile = GraphProfile(graph.name)
+        profile.pid = os.getpid()
         start = time()
         ptrs = self.node_to_root(graph)
+        snapshots = list()
+        if self.skim_cache is not None:
+            snapshots = self.skim_cache.book(graph, self.filter_cache)
         logger.debug('%%%%%%%%%% Ready to produce a subset of {} shapes'.format(
             len(ptrs)))
-        results = list()
-        for ptr in ptrs:
-            th = ptr.GetValue()
-            results.append(th)
+        # Book the instrumentation, filled in the same event loop
+        monitors = list()
+        for rcw in self.rcws:
+            monitor = ROOT.ntuple_processor.LoopMonitor()
+            count = rcw.frame.Count()
+            monitor.Monitor(count, self.progress_every)
+            monitors.append((monitor, count, rcw.frame.Report()))
+        reporter = None
+        if progress_queue is not None:
+            total = sum([chain.GetEntries() for chain in self.tchains])
+            reporter = ProgressReporter(progress_queue, task_id, graph.name,
+                profile.pid, [monitor for monitor, _, _ in monitors], total)
+            reporter.start()
+        booked = time()
+        profile.booking_time = booked - start
+        for monitor, count, report in monitors:
+            loop_start = time()
+            profile.entries += ROOT.ntuple_processor.RunEventLoop(count)
+            loop_end = time()
+            first_entry = monitor.GetFirstEntryTime()
+            if first_entry < loop_start:
+                # No entries processed, everything is compilation
+                first_entry = loop_end
+            profile.jit_time += first_entry - loop_start
+            profile.loop_time += loop_end - first_entry
+            for cut_info in report.GetValue():
+                profile.filters.append({
+                    'name': cut_info.GetName(),
+                    'all': cut_info.GetAll(),
+                    'pass': cut_info.GetPass()})
+        if len(profile.filters) == len(self.filters):
+            for filter_profile, (path, name) in zip(profile.filters, self.filters):
+                filter_profile['path'] = list(path)
+            for path, last_filter in self.actions:
+                entries = profile.entries if last_filter is None \
+                        else profile.filters[last_filter]['pass']
+                profile.actions.append((path, entries))
+        else:
+            logger.warning('Can not match the report of graph {} to its filters'.format(
+                repr(graph)))
+        if reporter is not None:
+            reporter.stop()
+        results = dict()
+        for name, ptr in ptrs:
+            results[name] = ptr.GetValue()
+        if snapshots:
+            self.skim_cache.commit(snapshots)
         # Sanity check: event loop run only once for each RDataFrame
         for rcw in self.rcws:
             loops = rcw.frame.GetNRuns()
             if loops != 1:
                 logger.warning('Event loop run {} times'.format(loops))
         end = time()
-        logger.debug('Event loop for graph {:} run in {:.2f} seconds'.format(
-            repr(graph), end - start))
-        return results
+        profile.peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        profile.finished = end
+        logger.debug('Event loop for graph {:} run in {:.2f} seconds ({:.2f} s JIT, {:.0f} events/s)'.format(
+            repr(graph), end - start, profile.jit_time, profile.events_per_second))
+        return results, profile
+
+    def __getstate__(self):
+        # The workers receive the graph of their task with the task,
+        # not all the graphs of the manager
+        state = self.__dict__.copy()
+        state['graphs'] = list()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
 
-    def run_locally(self, output, nworkers = 1, nthreads = 1):
+    def _run_task(self, task):
+        start_queue = task.start_queue if task.start_queue is not None else _start_queue
+        if start_queue is not None:
+            # Sent before any work, the attempt tells apart the start
+            # messages of a task and of its retries
+            start_queue.put((task.task_id, task.attempt, os.getpid()))
+        graph = task.graph
+        if graph is None:
+            graph = load_graphs(task.payload)[0]
+        results, profile = self._run_multiprocess(
+            graph, task.task_id, task.progress_queue, task.nthreads)
+        if task.shared_memory:
+            try:
+                results = pack_results(results, task.block)
+            except OSError as error:
+                logger.warning('Can not use shared memory ({}), pickle the results of {}'.format(
+                    error, graph.name))
+        return task.task_id, results, profile
+
+    def _task_files(self, graph):
+        return [path for ntuple in graph.unit_block.ntuples \
+                for path in [ntuple.path] + [friend.path for friend in ntuple.friends]]
+
+    def _action_names(self, node):
+        if node.kind == 'action':
+            if isinstance(node.unit_block, FineHistogram):
+                return [histogram.name for histogram in node.unit_block.histograms]
+            return [node.name]
+        return [name for child in node.children \
+                for name in self._action_names(child)]
+
+    def _task_id(self, graph):
+        """Identifier of a task, stable across different runs of
+        the same configuration: the content hash of the graph, so
+        that a change of the ntuples, of the friends, of a cut, of
+        a weight or of a binning gives a new identifier and the
+        results of the previous configuration are not reused.
+        """
+        return graphs_key([graph])
+
+    def _shard_graph(self, graph, nshards):
+        """Split a graph in at most nshards graphs, each one
+        running on a contiguous subset of the ntuples of the dataset.
+        """
+        ntuples = graph.unit_block.ntuples
+        nshards = min(nshards, len(ntuples))
+        if nshards <= 1:
+            return [graph]
+        size = -(-len(ntuples) // nshards)
+        shards = list()
+        for i in range(nshards):
+            shard = Node('{}[{}/{}]'.format(graph.name, i + 1, nshards),
+                'dataset', Dataset(
+                    graph.unit_block.name, ntuples[i * size:(i + 1) * size]),
+                *graph.children)
+            shards.append(shard)
+        return shards
+
+    def _check_arguments(self, nworkers, nthreads, nshards):
+        if nthreads != 'auto':
+            if not isinstance(nthreads, int):
+                raise TypeError('wrong type for nthreads')
+            if nthreads < 1:
+                raise ValueError('nthreads has to be larger zero')
+        if nworkers != 'auto':
+            if not isinstance(nworkers, int):
+                raise TypeError('wrong type for nworkers')
+            if nworkers < 1:
+                raise ValueError('nworkers has to be larger zero')
+        if not isinstance(nshards, int):
+            raise TypeError('wrong type for nshards')
+        if nshards < 1:
+            raise ValueError('nshards has to be larger zero')
+
+    def validate(self, schema_cache = None, compile_expressions = True):
+        """Pre-flight check of the booked graphs, before any worker is
+        started: the columns used by the cuts, the weights and the
+        actions have to exist in the trees of the datasets or in their
+        friends, and the expressions have to compile.
+
+        Args:
+            schema_cache (SchemaCache): Cache of the branches of the
+                trees, see validation.SchemaCache
+            compile_expressions (bool): Compile the expressions
+
+        Raises:
+            ValueError: Listing all the problems found
+        """
+        errors = validate_graphs(self.graphs, schema_cache, compile_expressions)
+        if errors:
+            for error in errors:
+                logger.fatal(error)
+            raise ValueError('pre-flight validation failed with {} errors:\n{}'.format(
+                len(errors), '\n'.join(errors)))
+
+    def _restore_journaled_graphs(self, journal, nshards):
+        """Undo the redirection to the skims of the graphs with tasks
+        completed in the journal, which were recorded with the
+        identifiers of the original graphs, so that they are not
+        processed again under a different identifier.
+        """
+        journaled = list()
+        others = list()
+        for graph in self.source_graphs:
+            if any([journal.is_completed(self._task_id(shard)) \
+                    for shard in self._shard_graph(graph, nshards)]):
+                journaled.append(graph)
+            else:
+                others.append(graph)
+        if not journaled:
+            return
+        logger.info('Process {} graphs with tasks in the journal without skims'.format(
+            len(journaled)))
+        self.graphs = journaled + self.skim_cache.redirect(others)
+
+    def _make_tasks(self, nshards, shared_memory):
+        shards = [shard for graph in self.graphs \
+                for shard in self._shard_graph(graph, nshards)]
+        return [Task(self._task_id(shard), shard, shared_memory = shared_memory,
+                payload = dump_graphs([shard])) for shard in shards]
+
+    def _plan_tasks(self, tasks, nworkers, nthreads):
+        """Set the maximum number of threads of every task, reordering
+        them if needed, and return the number of workers with the cores
+        shared by the tasks at dispatch time (None if the number of
+        threads is fixed).
+        """
+        cores = None
+        if nworkers == 'auto' or nthreads == 'auto':
+            # Largest tasks first, so that they do not end up alone
+            # at the end of the run
+            costs = {task.task_id: estimate_cost(task.graph) for task in tasks}
+            tasks.sort(key = lambda task: costs[task.task_id], reverse = True)
+            cores = available_cores()
+            nworkers, tasks_nthreads = plan_workers_threads(
+                [costs[task.task_id] for task in tasks],
+                None if nworkers == 'auto' else nworkers,
+                None if nthreads == 'auto' else nthreads, cores = cores)
+            if nthreads != 'auto':
+                cores = None
+        else:
+            tasks_nthreads = [nthreads] * len(tasks)
+        for task, task_nthreads in zip(tasks, tasks_nthreads):
+            task.nthreads = task_nthreads
+        return nworkers, cores
+
+    def _dispatch_limits(self, pool, tasks, own_pool, nworkers, cores):
+        """Number of tasks in the pool and cores shared by them, passed
+        to _execute. For a pool not created by the run, the threads of a
+        worker share the cores equally, and the tasks are all sent to it
+        if its size is not known (e.g. a remote pool).
+        """
+        if own_pool:
+            return nworkers, cores
+        if cores is not None:
+            for task in tasks:
+                task.nthreads = max(1, cores // nworkers)
+        return getattr(pool, '_processes', None), None
+
+    def _start_pool(self, pool, nworkers, progress = False):
+        """Create the pool of the run if pool is None, with the queue
+        of the start messages of the tasks used to detect dead workers.
+        The workers of a new pool inherit a plain queue; a manager
+        process is started only for the queues sent with the tasks, for
+        the start messages of a local pool not created by the run and
+        for the progress reports.
+
+        Returns:
+            pool (Pool): Pool of the run
+            manager (SyncManager): Manager to shut down at the end, None
+                if not started
+            start_queue (Queue): Queue of the start messages, None if
+                dead workers can not be detected (remote pools)
+            inherited (bool): The workers inherited start_queue, which
+                is not sent with the tasks
+        """
+        manager = None
+        start_queue = None
+        inherited = pool is None
+        if pool is None:
+            start_queue = SimpleQueue()
+            pool = Pool(nworkers, initializer = _set_start_queue,
+                initargs = (start_queue,))
+        if progress or (start_queue is None and hasattr(pool, '_pool')):
+            # Workers of a remote pool authenticate with its key
+            manager = SyncManager(authkey = getattr(pool, '_authkey', None))
+            manager.start()
+            if start_queue is None and hasattr(pool, '_pool'):
+                start_queue = manager.Queue()
+        return pool, manager, start_queue, inherited
+
+    def submit(self, nworkers = 1, nthreads = 1, nshards = 1,
+            shared_memory = True, pool = None, preflight = False,
+            schema_cache = None, retries = 0):
+        """Start computing the booked actions in the background and
+        return immediately a future for every action, resolved with the
+        result (TH1D or number) as soon as its graph has been processed
+        (all its shards, if split).
+
+        The futures are concurrent.futures.Future objects: wait for them
+        with concurrent.futures.wait/as_completed or, in asyncio code,
+        with asyncio.wrap_future. Failed tasks, including the ones whose
+        worker died, are retried as in run_locally but never split, since
+        the futures wait for the planned shards; if a task still fails,
+        the exception is set on all the futures not resolved yet once
+        the other tasks are completed.
+
+        Args:
+            nworkers (int, str): see run_locally
+            nthreads (int, str): see run_locally
+            nshards (int): see run_locally
+            shared_memory (bool): see run_locally
+            pool (Pool): see run_locally
+            preflight (bool): see run_locally
+            schema_cache (SchemaCache): see run_locally
+            retries (int): see run_locally
+
+        Returns:
+            futures (dict): Dictionary {name: Future} of the actions
+        """
+        self._check_arguments(nworkers, nthreads, nshards)
+        if not isinstance(retries, int) or retries < 0:
+            raise ValueError('retries has to be a non-negative integer')
+        if preflight:
+            self.validate(schema_cache)
+        futures = dict()
+        graph_futures = list()
+        for graph in self.graphs:
+            graph_futures.append(dict())
+            for name in self._action_names(graph):
+                future = Future()
+                # Running futures can not be cancelled by the callers
+                future.set_running_or_notify_cancel()
+                futures[name] = future
+                graph_futures[-1][name] = future
+        if self.composites:
+            for name, components in self.composites.sums.items():
+                futures[name] = self._composite_future(name,
+                    {component_name: futures[component_name] \
+                        for component_name, _ in components})
+        tasks = list()
+        task_graphs = dict()
+        for index, graph in enumerate(self.graphs):
+            for shard in self._shard_graph(graph, nshards):
+                task = Task(self._task_id(shard), shard, shared_memory = shared_memory,
+                    payload = dump_graphs([shard]))
+                task_graphs[task.task_id] = index
+                tasks.append(task)
+        nworkers, cores = self._plan_tasks(tasks, nworkers, nthreads)
+        logger.info('Submit {} graphs ({} tasks) to {} workers'.format(
+            len(self.graphs), len(tasks), nworkers))
+        own_pool = pool is None
+        pool, manager, start_queue, inherited = self._start_pool(pool, nworkers)
+        if self.staging is not None:
+            self.staging.start([(task.task_id, self._task_files(task.graph)) \
+                    for task in tasks], skip = nworkers)
+
+        limits = self._dispatch_limits(pool, tasks, own_pool, nworkers, cores)
+
+        def collect():
+            remaining = Counter(task_graphs.values())
+            partial_results = [dict() for graph in self.graphs]
+            failures = list()
+            execution = self._execute(pool, tasks, retries, False, failures,
+                start_queue, *limits, inherited_queue = inherited)
+            try:
+                for task, results, _ in execution:
+                    task_id = task.task_id
+                    if isinstance(results, SharedResults):
+                        results = unpack_results(results)
+                    if self.staging is not None:
+                        self.staging.release(task_id)
+                    index = task_graphs[task_id]
+                    add_results(partial_results[index], results)
+                    remaining[index] -= 1
+                    if remaining[index] == 0:
+                        for name, future in graph_futures[index].items():
+                            future.set_result(partial_results[index].get(name))
+                        partial_results[index] = None
+                if failures:
+                    raise RuntimeError('{} tasks failed: {}'.format(len(failures),
+                        ', '.join(['{} ({})'.format(task.graph.name, reason) \
+                            for task, reason in failures])))
+            except Exception as error:
+                logger.fatal('Run failed: {}'.format(error))
+                if own_pool:
+                    pool.terminate()
+                for future in futures.values():
+                    if not future.done():
+                        future.set_exception(error)
+                return
+            finally:
+                # Releases the shared memory blocks not unpacked
+                execution.close()
+                if self.staging is not None:
+                    self.staging.stop()
+                if manager is not None:
+                    manager.shutdown()
+            if own_pool:
+                # All the results are collected, no task is pending
+                pool.terminate()
+                pool.join()
+
+        Thread(target = collect, daemon = True).start()
+        return futures
+
+    # Seconds between two checks of the tasks running
+    poll_interval = 0.5
+    # Seconds waited for the start message of a task sent to the pool
+    # before a worker died, before considering the task lost
+    start_timeout = 5.
+
+    def _retry_tasks(self, task, split):
+        """Tasks retrying a failed task with half of its threads,
+        and split in two shards if split is True.
+        """
+        graph = task.graph
+        shards = self._shard_graph(graph, 2) if split else [graph]
+        tasks = list()
+        for shard in shards:
+            retry = Task(self._task_id(shard), shard, task.progress_queue,
+                task.shared_memory, max(1, task.nthreads // 2),
+                dump_graphs([shard]), task.start_queue, task.attempt + 1)
+            tasks.append(retry)
+        return tasks
+
+    def _execute(self, pool, tasks, retries = 0, split = False, failures = None,
+            start_queue = None, nworkers = None, cores = None,
+            inherited_queue = False, on_failure = None):
+        """Run the tasks in the pool, each one isolated in its own
+        asynchronous call, and yield the results of the completed
+        tasks as soon as they are available.
+
+        The tasks raising an exception, or lost because their worker
+        died (e.g. segmentation fault or killed for lack of memory,
+        detected for local pools only through the pids sent to the
+        start queue), are retried at most retries times with half of
+        the threads, and split in two shards if split is True. The lost
+        tasks are removed from the cache of the pool, so that it can
+        still be closed and joined, and the results of failed tasks
+        arriving later are ignored.
+
+        The names of the shared memory blocks of the results are chosen
+        here for every attempt: the blocks of the failed tasks, and the
+        ones not unpacked by the caller when the generator is closed
+        (e.g. because the run failed, or results of lost tasks arrived
+        late), are released. Blocks created by workers still running
+        after the generator is closed, e.g. of an external pool, can
+        not be released.
+
+        A worker dying before sending the start message of its task can
+        not be attributed exactly: as a best-effort fallback, used only
+        when at most nworkers tasks are in the pool, so that none of
+        them waits for a free worker, a task without start message
+        start_timeout seconds after the death of a worker that happened
+        after the task was sent is considered lost.
+
+        If nworkers is given, at most nworkers tasks are in the pool at
+        the same time, the others waiting in order, so that the threads
+        of a task can be chosen when it starts: with cores given, the
+        threads planned for the task are limited to the cores left by
+        the tasks running.
+
+        Args:
+            pool (Pool): Pool of workers
+            tasks (list): List of Task objects
+            retries (int): Maximum number of retries of a task
+            split (bool): Split the retried tasks in smaller shards
+            failures (list): List where the tuples (task, reason) of
+                the tasks failed after all the retries are appended
+            start_queue (Queue): Queue of the start messages of the tasks,
+                set as their start_queue unless inherited_queue is True
+            nworkers (int): Maximum number of tasks in the pool, all the
+                tasks are sent to the pool at once if None
+            cores (int): Cores shared by the tasks running, the threads
+                of the tasks are not changed if None
+            inherited_queue (bool): The workers inherited start_queue
+                when they were created
+            on_failure (callable): Called with every failed task and the
+                list of the tasks retrying it, empty if it is not retried
+
+        Yields:
+            task (Task), results (dict or SharedResults), profile (GraphProfile)
+        """
+        if failures is None:
+            failures = list()
+        running = dict()
+        waiting = deque()
+        pids = dict()
+        processes = dict()
+        # Time at which the tasks were sent and the workers died, with
+        # the dead workers whose lost task is known
+        sent = dict()
+        deaths = dict()
+        attributed = set()
+        blocks = list()
+
+        def start(task):
+            if cores is not None:
+                task.nthreads = share_threads(task.nthreads, cores,
+                    sum([other.nthreads for other, _ in running.values()]),
+                    min(nworkers - len(running), len(waiting) + 1))
+            if task.shared_memory:
+                task.block = new_block_name()
+                blocks.append(task.block)
+            sent[task.task_id] = time()
+            running[task.task_id] = (task, pool.apply_async(self._run_task, (task,)))
+
+        def dispatch():
+            while waiting and (nworkers is None or len(running) < nworkers):
+                start(waiting.popleft())
+
+        def fail(task, reason, lost = False):
+            _, result = running.pop(task.task_id)
+            pids.pop(task.task_id, None)
+            cache = getattr(pool, '_cache', None)
+            if lost and cache is not None and result._job in cache:
+                # Never resolved, it would block the pool on join
+                del cache[result._job]
+            if task.block is not None:
+                release_blocks([task.block])
+            retried = list()
+            if task.attempt < retries:
+                logger.warning('Task {} failed ({}), retry {}/{}'.format(
+                    task.graph.name, reason, task.attempt + 1, retries))
+                retried = self._retry_tasks(task, split)
+                # Retries are dispatched before the tasks waiting
+                waiting.extendleft(reversed(retried))
+            else:
+                logger.fatal('Task {} failed ({})'.format(task.graph.name, reason))
+                failures.append((task, reason))
+            if on_failure is not None:
+                on_failure(task, retried)
+
+        for task in tasks:
+            task.start_queue = None if inherited_queue else start_queue
+            waiting.append(task)
+        try:
+            dispatch()
+            while running:
+                while start_queue is not None and not start_queue.empty():
+                    task_id, attempt, pid = start_queue.get()
+                    if task_id in running and running[task_id][0].attempt == attempt:
+                        pids[task_id] = pid
+                workers = getattr(pool, '_pool', None)
+                alive = None
+                if workers is not None:
+                    for process in list(workers):
+                        processes[process.pid] = process
+                    alive = set([process.pid for process in list(workers) \
+                            if process.exitcode is None])
+                    for pid, process in processes.items():
+                        # Workers retired by the pool exit with code 0
+                        if process.exitcode not in (None, 0) and pid not in deaths:
+                            deaths[pid] = time()
+                progressed = False
+                for task, result in list(running.values()):
+                    if result.ready():
+                        progressed = True
+                        try:
+                            task_id, results, profile = result.get()
+                        except Exception as error:
+                            fail(task, repr(error))
+                            continue
+                        del running[task.task_id]
+                        pids.pop(task.task_id, None)
+                        yield task, results, profile
+                    elif alive is not None and task.task_id in pids and \
+                            pids[task.task_id] not in alive:
+                        progressed = True
+                        pid = pids[task.task_id]
+                        attributed.add(pid)
+                        process = processes.get(pid)
+                        fail(task, 'worker {} died with exit code {}'.format(pid,
+                            process.exitcode if process is not None else 'unknown'), True)
+                if nworkers is not None:
+                    for pid, died in sorted(deaths.items(), key = lambda death: death[1]):
+                        if pid in attributed or pid in pids.values() or \
+                                time() - died < self.start_timeout:
+                            continue
+                        attributed.add(pid)
+                        unstarted = [task for task, _ in running.values() \
+                                if task.task_id not in pids and sent[task.task_id] <= died]
+                        if unstarted:
+                            progressed = True
+                            fail(unstarted[0], 'worker {} died with exit code {} before starting the task'.format(
+                                pid, processes[pid].exitcode), True)
+                dispatch()
+                if not progressed:
+                    sleep(self.poll_interval)
+        finally:
+            released = release_blocks(blocks)
+            if released:
+                logger.warning('Released {} shared memory blocks of results not collected'.format(
+                    released))
+
+    def _composite_future(self, name, component_futures):
+        """Future resolved with the sum of the results of the
+        components of a composite when all of them are available.
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+        lock = Lock()
+
+        def resolve(component_future):
+            with lock:
+                if future.done() or not all([component.done() \
+                        for component in component_futures.values()]):
+                    return
+                try:
+                    future.set_result(self.composites.combine(name,
+                        {component_name: component.result() \
+                            for component_name, component in component_futures.items()}))
+                except Exception as error:
+                    future.set_exception(error)
+
+        for component in component_futures.values():
+            component.add_done_callback(resolve)
+        return future
+
+    def run_locally(self, output, nworkers = 1, nthreads = 1, nshards = 1,
+            checkpoint_directory = None, resume = False,
+            profile = None, flame = False, progress = False,
+            shared_memory = True, pool = None, compression = None,
+            columnar = None, hierarchical = False, preflight = False,
+            schema_cache = None, retries = 0, retry_split = False):
         """Save to file the histograms booked.
 
+        Every task (graph or shard) runs in its own asynchronous call:
+        a task failing, or lost because its worker died, does not stop
+        the others; it is retried up to retries times, and if it still
+        fails, the results of all the other tasks are written before
+        raising a RuntimeError listing the failed tasks.
+
         Args:
             output (str): Name of the output .root file
-            nworkers (int): number of slaves passed to the
-                multiprocessing.Pool() function
-            nthreads (int): number of threads passed to the
-                EnableImplicitMT function
+            nworkers (int, str): number of slaves passed to the
+                multiprocessing.Pool() function, or 'auto' to choose it
+                from the available cores and memory
+            nthreads (int, str): number of threads passed to the
+                EnableImplicitMT function, or 'auto' to share the cores
+                among the workers, giving more threads to the last
+                tasks when the queue drains
+            nshards (int): maximum number of shards each graph is
+                split into, every shard running on a subset of the
+                ntuples; the results of the shards are summed by name
+            checkpoint_directory (str): if given, the results of every
+                completed graph (or shard) are persisted in this directory
+                and recorded in a journal as soon as they are available
+            resume (bool): skip the graphs (or shards) already recorded
+                as completed in the journal of checkpoint_directory
+            profile (str): if given, name of the .json file where
+                the profile of the run is written, with the efficiency
+                of every cut, also of the collapsed selections
+            flame (bool): write also a flame-style summary of the
+                optimized graphs next to the profile (.folded file)
+            progress (bool): display periodically the entries processed
+                by the workers, the throughput and the estimated time
+                to completion, and warn about stalled workers
+            shared_memory (bool): workers send back the bin contents
+                of the histograms through shared memory blocks instead
+                of pickling the histograms
+            pool (Pool): pool of workers to use instead of creating a
+                new one, e.g. a warm pool from service.create_warm_pool
+                or service.connect_to_service, left open at the end;
+                nworkers is then only used for the final merging
+            compression (int): ROOT compression setting of the output,
+                see output.write_results
+            columnar (str): if given, name of a .npz file where all
+                the results are written also as contiguous arrays with
+                a name index, see columnar.write_columnar
+            hierarchical (bool): place the results of the output in
+                directories dataset/selections/variation and write an
+                index of the names, see output.write_results
+            preflight (bool): check the columns and compile the
+                expressions of all the graphs before starting the
+                workers, raising ValueError with all the problems
+                found, see RunManager.validate
+            schema_cache (SchemaCache): cache of the branches of the
+                trees used by the pre-flight check, e.g. stored in a
+                JSON file to be reused across runs
+            retries (int): maximum number of retries of a failed task,
+                each one with half of the threads of the previous attempt
+            retry_split (bool): split also the retried tasks in two
+                shards, e.g. to reduce the memory needed; ignored with
+                a checkpoint_directory, since the journal records the
+                tasks of the original shards
         """
-        if not isinstance(nthreads, int):
-            raise TypeError('wrong type for nthreads')
-        if nthreads < 1:
-            raise ValueError('nthreads has to be larger zero')
-        self.nthreads = nthreads
-        if not isinstance(nworkers, int):
-            raise TypeError('wrong type for nworkers')
-        if nworkers < 1:
-            raise ValueError('nworkers has to be larger zero')
-        logger.info('Start computing locally results of {} graphs using {} workers with {} thread(s) each'.format(
-            len(self.graphs), nworkers, nthreads))
+        self._check_arguments(nworkers, nthreads, nshards)
+        if not isinstance(retries, int) or retries < 0:
+            raise ValueError('retries has to be a non-negative integer')
+        if resume and checkpoint_directory is None:
+            raise ValueError('resume requires a checkpoint_directory')
+        if flame and profile is None:
+            raise ValueError('flame requires a profile')
+        if preflight:
+            self.validate(schema_cache)
+        # The profile reports every cut, also of the collapsed selections
+        self.cut_report = profile is not None
+        journal = None
+        if checkpoint_directory is not None:
+            journal = Journal(checkpoint_directory, resume)
+            if self.skim_cache is not None and journal.completed:
+                self._restore_journaled_graphs(journal, nshards)
+        tasks = self._make_tasks(nshards, shared_memory)
+        if journal is not None:
+            planned_ids = [task.task_id for task in tasks]
+            tasks = [task for task in tasks if not journal.is_completed(task.task_id)]
+        nworkers, cores = self._plan_tasks(tasks, nworkers, nthreads)
+        logger.info('Start computing locally results of {} graphs ({} tasks) using {} workers with {} thread(s) each'.format(
+            len(self.graphs), len(tasks), nworkers, nthreads))
         start = time()
-        pool = Pool(nworkers)
-        final_results = list(pool.map(self._run_multiprocess, self.graphs))
-        final_results = [j for i in final_results for j in i]
+        monitor = None
+        own_pool = pool is None
+        pool, manager, start_queue, inherited = self._start_pool(pool, nworkers, progress)
+        if progress:
+            progress_queue = manager.Queue()
+            for task in tasks:
+                task.progress_queue = progress_queue
+            monitor = ProgressMonitor(progress_queue, len(tasks))
+            monitor.start()
+        if self.staging is not None:
+            # The first tasks start at once, reading the files in place
+            self.staging.start([(task.task_id, self._task_files(task.graph)) \
+                    for task in tasks], skip = nworkers)
+        final_results = dict()
+        run_profile = RunProfile()
+        failures = list()
+        on_failure = None
+        if monitor is not None:
+            on_failure = lambda task, retried: monitor.fail(task.task_id, len(retried))
+        execution = self._execute(pool, tasks, retries,
+            retry_split and journal is None, failures, start_queue,
+            *self._dispatch_limits(pool, tasks, own_pool, nworkers, cores),
+            inherited_queue = inherited, on_failure = on_failure)
+        try:
+            for task, results, graph_profile in execution:
+                task_id = task.task_id
+                if monitor is not None:
+                    monitor.finish(task_id)
+                if self.staging is not None:
+                    self.staging.release(task_id)
+                if isinstance(results, SharedResults):
+                    results = unpack_results(results)
+                received = time()
+                graph_profile.transfer_time = received - graph_profile.finished
+                if journal is not None:
+                    journal.record(task_id, task.graph.name, results)
+                else:
+                    add_results(final_results, results)
+                graph_profile.write_time = time() - received
+                run_profile.add(graph_profile)
+        except BaseException:
+            if own_pool:
+                pool.terminate()
+            if journal is not None:
+                logger.fatal('Run failed, {} completed tasks are saved in {}: rerun with resume = True to skip them'.format(
+                    len(journal.completed), checkpoint_directory))
+            raise
+        finally:
+            # Releases the shared memory blocks not unpacked
+            execution.close()
+            if monitor is not None:
+                monitor.stop()
+            if manager is not None:
+                manager.shutdown()
+            if self.staging is not None:
+                self.staging.stop()
+        if own_pool:
+            # All the results are collected, no task is pending
+            pool.terminate()
+            pool.join()
         end = time()
         logger.info('Finished computations in {} seconds'.format(int(end - start)))
-        logger.info('Write {} results from {} graphs to file {}'.format(
-            len(final_results), len(self.graphs), output))
-        root_file = TFile(output, 'RECREATE')
-        for op in final_results:
-            op.Write()
-        root_file.Close()
-
-    def node_to_root(self, node, final_results = None, rcw = None):
+        partial_outputs = None
+        if journal is not None:
+            partial_outputs = journal.partial_outputs(planned_ids)
+        if partial_outputs:
+            logger.info('Merge {} partial outputs from {} graphs to file {}'.format(
+                len(partial_outputs), len(self.graphs), output))
+            merge_outputs(partial_outputs, output, max(1, nworkers),
+                compression = compression, hierarchical = hierarchical)
+            if self.composites:
+                # Composites need the sums of the components
+                final_results = self.composites.apply(read_results(output))
+                write_results(final_results, output, compression, hierarchical)
+            elif columnar is not None:
+                final_results = read_results(output)
+        else:
+            if self.composites:
+                final_results = self.composites.apply(final_results)
+            logger.info('Write {} results from {} graphs to file {}'.format(
+                len(final_results), len(self.graphs), output))
+            write_results(final_results, output, compression, hierarchical)
+        if columnar is not None:
+            write_columnar(final_results, columnar)
+        if self.skim_cache is not None:
+            self.skim_cache.evict()
+        run_profile.write_time = time() - end
+        run_profile.total_time = time() - start
+        if profile is not None:
+            run_profile.write_json(profile)
+            if flame:
+                run_profile.write_folded(
+                    '{}.folded'.format(os.path.splitext(profile)[0]))
+        if failures:
+            for task, reason in failures:
+                logger.fatal('Results of {} missing: {}'.format(task.graph.name, reason))
+            if journal is not None:
+                logger.fatal('Rerun with resume = True to process only the failed tasks')
+            raise RuntimeError('{} tasks failed, the results of the other tasks are written to {}'.format(
+                len(failures), output))
+
+    def node_to_root(self, node, final_results = None, rcw = None, path = ()):
         if final_results is None:
             final_results = list()
+        path = path + (node.name,)
         if node.kind == 'dataset':
             logger.debug('%%%%%%%%%% node_to_root, converting to ROOT language the following dataset node\n{}'.format(
                 node))
-            result = self.__rdf_from_dataset(
-                node.unit_block)
-            if result not in self.rcws:
+            if node.unit_block in self.frame_cache:
+                result = self.frame_cache[node.unit_block]
+            else:
+                result = self.__rdf_from_dataset(
+                    node.unit_block)
+                self.frame_cache[node.unit_block] = result
                 self.rcws.append(result)
         elif node.kind == 'selection':
             if len(node.children) > 1:
                 logger.debug('%%%%%%%%%% node_to_root, converting to ROOT language the following crossroad node\n{}'.format(
                     node))
+            joined = isinstance(node.unit_block, JoinedSelection) and \
+                    not self.cut_report and not self.__has_cutflow(node)
             result = self.__cuts_and_weights_from_selection(
-                rcw, node.unit_block)
+                rcw, node.unit_block, path, joined)
         elif node.kind == 'action':
             logger.debug('%%%%%%%%%% node_to_root, converting to ROOT language the following action node\n{}'.format(
                 node))
@@ -123,11 +1041,23 @@ class RunManager:
             elif isinstance(node.unit_block, Histogram):
                 result = self.__histo1d_from_histo(
                     rcw, node.unit_block)
+            elif isinstance(node.unit_block, Cutflow):
+                result = self.__cutflow_from_cutflow(
+                    rcw, node.unit_block)
+            elif isinstance(node.unit_block, FineHistogram):
+                result = self.__histo1d_from_histo(
+                    rcw, node.unit_block)
+            self.actions.append((path, rcw.last_filter))
         if node.children:
             for child in node.children:
-                self.node_to_root(child, final_results, result)
+                self.node_to_root(child, final_results, result, path)
+        elif isinstance(node.unit_block, FineHistogram):
+            # Histograms derived from the fine one
+            for histogram in node.unit_block.histograms:
+                final_results.append((histogram.name, RebinnedResult(
+                    result, histogram.name, histogram.edges)))
         else:
-            final_results.append(result)
+            final_results.append((node.name, result))
         return final_results
 
     def __rdf_from_dataset(self, dataset):
@@ -138,40 +1068,112 @@ class RunManager:
         else:
             raise NameError(
                 'Impossible to create RDataFrame with different tree names')
+        # Local copies of the files if staged
+        local_path = self.staging.local_path if self.staging is not None \
+                else lambda path: path
         chain = TChain()
         ftag_fchain = {}
         for ntuple in dataset.ntuples:
             chain.Add('{}/{}'.format(
-                ntuple.path, ntuple.directory))
+                local_path(ntuple.path), ntuple.directory))
             for friend in ntuple.friends:
                 if friend.tag not in ftag_fchain.keys():
                     ftag_fchain[friend.tag] = TChain()
                 ftag_fchain[friend.tag].Add('{}/{}'.format(
-                    friend.path, friend.directory))
+                    local_path(friend.path), friend.directory))
+        if self.staging is not None and self.staging.cache_size is not None:
+            chain.SetCacheSize(self.staging.cache_size)
         for ch in ftag_fchain.values():
             chain.AddFriend(ch)
             # Keep friend chains alive
             self.friend_tchains.append(ch)
-        if self.nthreads != 1:
-            EnableImplicitMT(self.nthreads)
         # Keep main chain alive
         self.tchains.append(chain)
         rdf = RDataFrame(chain)
-        rcw = RDataFrameCutWeight(rdf)
+        rcw = RDataFrameCutWeight(rdf, dataset = dataset)
         return rcw
 
-    def __cuts_and_weights_from_selection(self, rcw, selection):
+    def __has_cutflow(self, node):
+        # Cutflows need a frame after each of the cuts
+        return any([isinstance(child.unit_block, Cutflow) or self.__has_cutflow(child) \
+                for child in node.children])
+
+    def __cuts_and_weights_from_selection(self, rcw, selection, path,
+            joined = False):
         l_cuts = [cut for cut in rcw.cuts]
         l_weights = [weight for weight in rcw.weights]
+        frame = rcw.frame
+        last_filter = rcw.last_filter
+        if joined and len(selection.cuts) > 1:
+            # A single filter, named after the selection, for all the cuts
+            l_cuts.extend(selection.cuts)
+            key = (rcw.dataset, tuple(l_cuts))
+            if key not in self.filter_cache:
+                frame = frame.Filter(' && '.join(['(' + cut.expression + ')' \
+                        for cut in selection.cuts]), selection.name)
+                self.filters.append((path, selection.name))
+                self.filter_cache[key] = (frame, len(self.filters) - 1)
+            frame, last_filter = self.filter_cache[key]
+            return RDataFrameCutWeight(frame, l_cuts,
+                l_weights + list(selection.weights), last_filter, rcw.dataset)
+        # Named filters are shared by all the children of the node
+        # and show up in the cut-flow report
         for cut in selection.cuts:
             l_cuts.append(cut)
+            key = (rcw.dataset, tuple(l_cuts))
+            if key not in self.filter_cache:
+                frame = frame.Filter(cut.expression, cut.name)
+                self.filters.append((path, cut.name))
+                self.filter_cache[key] = (frame, len(self.filters) - 1)
+            frame, last_filter = self.filter_cache[key]
         for weight in selection.weights:
             l_weights.append(weight)
-        l_rcw = RDataFrameCutWeight(rcw.frame, l_cuts, l_weights)
+        l_rcw = RDataFrameCutWeight(frame, l_cuts, l_weights, last_filter,
+            rcw.dataset)
         return l_rcw
 
-    def __sum_from_count(self, rdf, count):
-        return rdf.Sum(count.variable)
+    def __sum_from_count(self, rcw, count):
+        return rcw.frame.Sum(count.variable)
+
+    def __weight_column(self, frame, dataset, cuts, weight_expression, name):
+        # Actions with the same cuts and weights share the column
+        key = (dataset, tuple(cuts), weight_expression)
+        if key not in self.weight_cache:
+            weight_name = name.replace('#', '_')
+            weight_name = weight_name.replace('-', '_')
+            self.weight_cache[key] = (
+                frame.Define(weight_name, weight_expression), weight_name)
+        return self.weight_cache[key]
+
+    def __cutflow_from_cutflow(self, rcw, cutflow):
+        # Frames before the cuts and after each of them, created
+        # by the selection nodes leading to this action
+        frames = [self.frame_cache[rcw.dataset].frame]
+        for i in range(len(rcw.cuts)):
+            frames.append(self.filter_cache[
+                (rcw.dataset, tuple(rcw.cuts[:i + 1]))][0])
+        weight_expression = '*'.join(['(' + weight.expression + ')' for weight in rcw.weights])
+        weighted = list()
+        unweighted = list()
+        for i, frame in enumerate(frames):
+            unweighted.append(frame.Count())
+            if weight_expression:
+                frame, weight_name = self.__weight_column(
+                    frame, rcw.dataset, rcw.cuts[:i], weight_expression,
+                    '{}_{}'.format(cutflow.name, i))
+                weighted.append(frame.Sum(weight_name))
+            else:
+                weighted.append(unweighted[-1])
+        labels = ['all'] + [cut.name for cut in rcw.cuts]
+        nbins = 2 * len(labels)
+        histogram = TH1D(cutflow.name, cutflow.name, nbins, 0., nbins)
+        histogram.SetDirectory(0)
+        for i, label in enumerate(labels):
+            histogram.GetXaxis().SetBinLabel(i + 1, 'weighted:{}'.format(label))
+            histogram.GetXaxis().SetBinLabel(len(labels) + i + 1,
+                'unweighted:{}'.format(label))
+        logger.debug('%%%%%%%%%% Attaching cutflow called {}'.format(cutflow.name))
+        return CutflowResult(histogram, weighted, unweighted)
 
     def __histo1d_from_histo(self, rcw, histogram):
         name = histogram.name
@@ -183,11 +1185,8 @@ class RunManager:
         # (saved earlier as rdf columns)
         weight_expression = '*'.join(['(' + weight.expression + ')' for weight in rcw.weights])
 
-        # Create macro cut string from sub-cuts applied
-        # (saved earlier as rdf columns)
-        cut_expression = ' && '.join(['(' + cut.expression + ')' for cut in rcw.cuts])
-        if cut_expression:
-            rcw.frame = rcw.frame.Filter(cut_expression)
+        # Cuts are already applied as filters by the selection nodes
+        frame = rcw.frame
 
         # Create std::vector with the histogram edges
         l_edges = vector['double']()
@@ -196,15 +1195,14 @@ class RunManager:
 
         if not weight_expression:
             logger.debug('%%%%%%%%%% Attaching histogram called {}'.format(name))
-            histo = rcw.frame.Histo1D((
+            histo = frame.Histo1D((
                     name, name, nbins, l_edges.data()),
                     var)
         else:
-            weight_name = name.replace('#', '_')
-            weight_name = weight_name.replace('-', '_')
-            rcw.frame = rcw.frame.Define(weight_name, weight_expression)
+            frame, weight_name = self.__weight_column(
+                frame, rcw.dataset, rcw.cuts, weight_expression, name)
             logger.debug('%%%%%%%%%% Attaching histogram called {}'.format(name))
-            histo = rcw.frame.Histo1D((
+            histo = frame.Histo1D((
                 name, name, nbins, l_edges.data()),
                 var, weight_name)
 
@@ -0,0 +1,317 @@
+import os
+import json
+import zlib
+import hashlib
+
+from .booking import UnitManager
+from .merging import CompositeSums
+from .optimization import GraphManager
+from .utils import Ntuple
+from .utils import Dataset
+from .utils import Cut
+from .utils import Weight
+from .utils import Selection
+from .utils import JoinedSelection
+from .utils import Count
+from .utils import Cutflow
+from .utils import Histogram
+from .utils import FineHistogram
+from .utils import Node
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+# Version of the format, increased at every incompatible change
+FORMAT_VERSION = 3
+
+
+class _Encoder:
+    """Encode graphs into flat tables: every string is stored once
+    and referenced by its index, every dataset, selection and action
+    once per object, and the nodes by integer ids.
+    """
+    def __init__(self):
+        self.strings = list()
+        self.string_ids = dict()
+        self.blocks = list()
+        self.block_ids = dict()
+        # Encoded objects, kept alive so that their ids are not reused
+        self.encoded_objects = list()
+        self.nodes = list()
+
+    def string(self, string):
+        if string is None:
+            return -1
+        if string not in self.string_ids:
+            self.string_ids[string] = len(self.strings)
+            self.strings.append(string)
+        return self.string_ids[string]
+
+    def ntuple(self, ntuple):
+        friends = getattr(ntuple, 'friends', None)
+        return [self.string(ntuple.path), self.string(ntuple.directory),
+                self.string(ntuple.tag),
+                None if friends is None else [self.ntuple(friend) for friend in friends]]
+
+    def block(self, block):
+        if id(block) in self.block_ids:
+            return self.block_ids[id(block)]
+        if isinstance(block, Dataset):
+            encoded = ['dataset', self.string(block.name),
+                    [self.ntuple(ntuple) for ntuple in block.ntuples]]
+        elif isinstance(block, Selection):
+            encoded = ['joinedselection' if isinstance(block, JoinedSelection) \
+                        else 'selection', self.string(block.name),
+                    [[self.string(cut.expression), self.string(cut.name)] \
+                            for cut in block.cuts],
+                    [[self.string(weight.expression), self.string(weight.name)] \
+                            for weight in block.weights]]
+        elif isinstance(block, Histogram):
+            encoded = ['histogram', self.string(block.name),
+                    self.string(block.variable), list(block.edges)]
+        elif isinstance(block, Count):
+            encoded = ['count', self.string(block.name), self.string(block.variable)]
+        elif isinstance(block, Cutflow):
+            encoded = ['cutflow', self.string(block.name)]
+        elif isinstance(block, FineHistogram):
+            encoded = ['finehistogram', self.string(block.name),
+                    self.string(block.variable), list(block.edges),
+                    [self.block(histogram) for histogram in block.histograms]]
+        else:
+            raise TypeError('can not serialize {}'.format(type(block)))
+        self.block_ids[id(block)] = len(self.blocks)
+        self.blocks.append(encoded)
+        self.encoded_objects.append(block)
+        return self.block_ids[id(block)]
+
+    def node(self, node):
+        children = [self.node(child) for child in node.children]
+        self.nodes.append([self.string(node.name), self.block(node.unit_block), children])
+        return len(self.nodes) - 1
+
+
+class _Decoder:
+    def __init__(self, body):
+        self.strings = body['strings']
+        self.encoded_blocks = body['blocks']
+        self.blocks = dict()
+        self.encoded_nodes = body['nodes']
+
+    def string(self, index):
+        return None if index < 0 else self.strings[index]
+
+    def ntuple(self, encoded):
+        path, directory, tag, friends = encoded
+        return Ntuple(self.string(path), self.string(directory),
+                None if friends is None else [self.ntuple(friend) for friend in friends],
+                self.string(tag))
+
+    def block(self, index):
+        if index not in self.blocks:
+            encoded = self.encoded_blocks[index]
+            kind = encoded[0]
+            if kind == 'dataset':
+                block = Dataset(self.string(encoded[1]),
+                        [self.ntuple(ntuple) for ntuple in encoded[2]])
+            elif kind in ('selection', 'joinedselection'):
+                selection_class = JoinedSelection if kind == 'joinedselection' \
+                        else Selection
+                block = selection_class(self.string(encoded[1]),
+                        [Cut(self.string(expression), self.string(name)) \
+                                for expression, name in encoded[2]],
+                        [Weight(self.string(expression), self.string(name)) \
+                                for expression, name in encoded[3]])
+            elif kind == 'histogram':
+                block = Histogram(self.string(encoded[1]),
+                        self.string(encoded[2]), encoded[3])
+            elif kind == 'count':
+                block = Count(self.string(encoded[1]), self.string(encoded[2]))
+            elif kind == 'cutflow':
+                block = Cutflow(self.string(encoded[1]))
+            elif kind == 'finehistogram':
+                block = FineHistogram(self.string(encoded[1]),
+                        self.string(encoded[2]), encoded[3],
+                        [self.block(histogram) for histogram in encoded[4]])
+            else:
+                raise ValueError('unknown block {}'.format(kind))
+            self.blocks[index] = block
+        return self.blocks[index]
+
+    def node(self, index):
+        name, block, children = self.encoded_nodes[index]
+        block = self.block(block)
+        kind = 'dataset' if isinstance(block, Dataset) else \
+                'selection' if isinstance(block, Selection) else 'action'
+        return Node(self.string(name), kind, block,
+                *[self.node(child) for child in children])
+
+
+def _canonical(body):
+    return json.dumps(body, sort_keys = True, separators = (',', ':'))
+
+
+def _encode(graphs):
+    encoder = _Encoder()
+    roots = [encoder.node(graph) for graph in graphs]
+    return {
+        'strings': encoder.strings,
+        'blocks': encoder.blocks,
+        'nodes': encoder.nodes,
+        'roots': roots}
+
+
+def graphs_key(graphs):
+    """Content hash of graphs: names, ntuples and friends, cuts,
+    weights and binnings, together with the version of the format.
+    """
+    return hashlib.sha1('{}:{}'.format(FORMAT_VERSION,
+        _canonical(_encode(graphs))).encode()).hexdigest()
+
+
+def dump_graphs(graphs, composites = None):
+    """Serialize optimized graphs in a compact, versioned format.
+
+    Args:
+        graphs (list): List of Graph (or Node) objects
+        composites (CompositeSums): Sums giving the results of the
+            composite datasets, stored with the graphs if given
+
+    Returns:
+        data (bytes): zlib-compressed JSON document
+    """
+    body = _encode(graphs)
+    if composites is not None:
+        body['composites'] = {
+            'sums': {name: [list(component) for component in components] \
+                for name, components in composites.sums.items()},
+            'auxiliary': sorted(composites.auxiliary)}
+    canonical = _canonical(body)
+    return zlib.compress(json.dumps({
+        'version': FORMAT_VERSION,
+        'hash': hashlib.sha1(canonical.encode()).hexdigest(),
+        'body': body}, separators = (',', ':')).encode())
+
+
+def load_graphs(data, return_composites = False):
+    """Rebuild the graphs serialized by dump_graphs, checking the
+    version of the format and the content hash.
+
+    Args:
+        data (bytes): Output of dump_graphs
+        return_composites (bool): Return also the sums of the
+            composite datasets stored with the graphs
+
+    Returns:
+        graphs (list): List of Node objects of kind 'dataset'
+        composites (CompositeSums): Sums of the composite datasets,
+            empty if none were stored, only if return_composites is True
+    """
+    document = json.loads(zlib.decompress(data).decode())
+    if document.get('version') != FORMAT_VERSION:
+        logger.fatal('Unsupported version {} of the serialized graphs, expected {}'.format(
+            document.get('version'), FORMAT_VERSION))
+        raise ValueError
+    body = document['body']
+    if hashlib.sha1(_canonical(body).encode()).hexdigest() != document['hash']:
+        logger.fatal('Corrupted serialized graphs, the content hash does not match')
+        raise ValueError
+    decoder = _Decoder(body)
+    graphs = [decoder.node(root) for root in body['roots']]
+    if not return_composites:
+        return graphs
+    composites = CompositeSums()
+    stored = body.get('composites', {'sums': {}, 'auxiliary': []})
+    for name, components in stored['sums'].items():
+        for component_name, scale_factor in components:
+            composites.add(name, component_name, scale_factor)
+    composites.auxiliary.update(stored['auxiliary'])
+    return graphs, composites
+
+
+def _describe(obj):
+    """Plain description of a configuration object, used to compute
+    the key of the plan cache.
+    """
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    if isinstance(obj, (list, tuple)):
+        return [_describe(element) for element in obj]
+    if isinstance(obj, dict):
+        return {str(key): _describe(value) for key, value in sorted(obj.items())}
+    if hasattr(obj, '__dict__'):
+        attributes = vars(obj)
+    else:
+        # Objects with __slots__, the cached hashes are skipped
+        attributes = {name: getattr(obj, name) for cls in type(obj).__mro__ \
+                for name in getattr(cls, '__slots__', ()) \
+                if not name.startswith('_') and hasattr(obj, name)}
+    return [type(obj).__name__, {key: _describe(value) \
+            for key, value in sorted(attributes.items())}]
+
+
+def configuration_key(units, variations = None, level = 2, split_selections = False):
+    """Content hash of a booking configuration: units, variations
+    and optimization options, together with the version of the format.
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps([FORMAT_VERSION, _describe(units), _describe(variations),
+        level, split_selections], separators = (',', ':')).encode())
+    return digest.hexdigest()
+
+
+def optimized_graphs(units, variations = None, level = 2,
+        split_selections = False, cache_directory = None,
+        return_composites = False):
+    """Book the units, apply the variations and optimize the graphs,
+    or load the optimized graphs of the same configuration saved in
+    cache_directory by a previous call, together with the sums of the
+    composite datasets booked.
+
+    Args:
+        units (list): List of Unit objects
+        variations (list): List of Variation objects
+        level (int): Optimization level passed to GraphManager.optimize
+        split_selections (bool, str): Split the selections into minimal
+            units, or 'adaptive' (see GraphManager)
+        cache_directory (str): Directory of the cached plans,
+            no caching if None
+        return_composites (bool): Return also the sums of the
+            composite datasets
+
+    Returns:
+        graphs (list): Optimized graphs, to be passed to RunManager
+        composites (CompositeSums): Sums of the composite datasets,
+            to be passed to RunManager, only if return_composites is True
+    """
+    path = None
+    if cache_directory is not None:
+        # Computed before booking: variations can modify the units
+        key = configuration_key(units, variations, level, split_selections)
+        path = os.path.join(cache_directory, '{}.plan'.format(key))
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as plan_file:
+                    graphs, composites = load_graphs(plan_file.read(),
+                        return_composites = True)
+                logger.info('Loaded optimized plan of {} graphs from {}'.format(
+                    len(graphs), path))
+                return (graphs, composites) if return_composites else graphs
+            except (ValueError, OSError, zlib.error) as error:
+                logger.warning('Can not load cached plan {} ({}), book again'.format(
+                    path, error))
+    unit_manager = UnitManager()
+    unit_manager.book(units, variations)
+    graph_manager = GraphManager(unit_manager.booked_units, split_selections)
+    graph_manager.optimize(level)
+    graphs = graph_manager.graphs
+    if path is not None:
+        os.makedirs(cache_directory, exist_ok = True)
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as plan_file:
+            plan_file.write(dump_graphs(graphs, unit_manager.composites))
+        os.replace(temp_path, path)
+        logger.info('Saved optimized plan of {} graphs to {}'.format(
+            len(graphs), path))
+    return (graphs, unit_manager.composites) if return_composites else graphs
@@ -0,0 +1,191 @@
+from multiprocessing import Pool
+from multiprocessing import current_process
+from multiprocessing.managers import BaseManager
+from multiprocessing.managers import PoolProxy
+from multiprocessing.managers import IteratorProxy
+import os
+import socket
+import argparse
+
+from .run import declare_helpers
+
+from ROOT import gROOT
+gROOT.SetBatch(True)
+from ROOT import gInterpreter
+from ROOT import RDataFrame
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+DEFAULT_ADDRESS = os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR', '/tmp'),
+    'ntuple_processor-{}.sock'.format(os.getuid()))
+
+
+def default_authkey():
+    authkey = os.environ.get('NTUPLE_PROCESSOR_AUTHKEY')
+    return None if authkey is None else authkey.encode()
+
+
+def warm_up(declarations = ()):
+    """Pay once per process the start-up costs of ROOT: declare the
+    helpers of ntuple_processor and the user declarations, and run a
+    tiny event loop so that the RDataFrame machinery used by the
+    graphs is compiled before the first real task arrives.
+
+    Args:
+        declarations (tuple): C++ code passed to gInterpreter.Declare,
+            e.g. headers or functions used in cuts and weights
+    """
+    declare_helpers()
+    for declaration in declarations:
+        if not gInterpreter.Declare(declaration):
+            raise RuntimeError('failed to declare {}'.format(declaration))
+    frame = RDataFrame(1).Define('x', '0.5').Define('w', '1.')
+    frame = frame.Filter('x > 0', 'warm_up')
+    histo = frame.Histo1D(('warm_up', 'warm_up', 1, 0., 1.), 'x', 'w')
+    total = frame.Sum('x')
+    count = frame.Count()
+    histo.GetValue()
+    total.GetValue()
+    count.GetValue()
+
+
+def create_warm_pool(nworkers, declarations = ()):
+    """Create a multiprocessing.Pool whose workers are forked from a
+    process where ROOT is already initialized, to be reused with
+    RunManager.run_locally(pool = ...) across several runs.
+
+    Args:
+        nworkers (int): Number of workers
+        declarations (tuple): C++ code declared in every worker
+
+    Returns:
+        pool (Pool): The pool, to be closed by the caller
+    """
+    if not isinstance(nworkers, int):
+        raise TypeError('wrong type for nworkers')
+    if nworkers < 1:
+        raise ValueError('nworkers has to be larger zero')
+    declarations = tuple(declarations)
+    # Warm up this process first: the forked workers inherit the
+    # interpreter state, the initializer only completes it
+    warm_up(declarations)
+    logger.info('Start warm pool of {} workers'.format(nworkers))
+    return Pool(nworkers, initializer = warm_up, initargs = (declarations,))
+
+
+class WorkerService(BaseManager):
+    """Manager serving a warm pool of workers on a local socket,
+    shared by all the driver processes of the machine.
+
+    Start it with
+        python -m ntuple_processor.service --nworkers 16
+    and use it from the drivers with
+        pool = connect_to_service()
+        RunManager(graphs).run_locally(output, pool = pool)
+    """
+    pass
+
+
+_pool = None
+
+
+def _get_pool():
+    return _pool
+
+
+WorkerService.register('get_pool', callable = _get_pool, proxytype = PoolProxy)
+# Types returned by the methods of PoolProxy
+WorkerService.register('Iterator', proxytype = IteratorProxy, create_method = False)
+WorkerService.register('AsyncResult', create_method = False)
+
+
+def serve(nworkers, address = DEFAULT_ADDRESS, authkey = None, declarations = ()):
+    """Start the service and block until it is killed.
+
+    Args:
+        nworkers (int): Number of workers of the pool
+        address (str): Path of the unix socket, a stale socket file
+            is replaced but a running service is never taken over
+        authkey (bytes): Key required to connect to the service
+        declarations (tuple): C++ code declared in every worker
+
+    Raises:
+        RuntimeError: A service is already listening on address
+    """
+    global _pool
+    if authkey is None:
+        authkey = default_authkey()
+    if authkey is None:
+        logger.fatal('Set NTUPLE_PROCESSOR_AUTHKEY to the key shared with the drivers')
+        raise RuntimeError
+    # Inherited by the workers, which then can connect back to the
+    # managers of the drivers (e.g. the queue of the progress reports)
+    current_process().authkey = authkey
+    if os.path.exists(address):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(address)
+        except OSError:
+            # Left by a service that did not stop cleanly
+            os.remove(address)
+        else:
+            logger.fatal('A worker service is already listening on {}'.format(address))
+            raise RuntimeError
+        finally:
+            probe.close()
+    _pool = create_warm_pool(nworkers, declarations)
+    manager = WorkerService(address = address, authkey = authkey)
+    server = manager.get_server()
+    logger.info('Worker service listening on {}'.format(address))
+    try:
+        server.serve_forever()
+    finally:
+        _pool.terminate()
+        if os.path.exists(address):
+            os.remove(address)
+
+
+def connect_to_service(address = DEFAULT_ADDRESS, authkey = None):
+    """Connect to a running WorkerService.
+
+    Args:
+        address (str): Path of the unix socket
+        authkey (bytes): Key of the service, by default taken from
+            the environment variable NTUPLE_PROCESSOR_AUTHKEY
+
+    Returns:
+        pool (PoolProxy): Proxy to the warm pool of the service,
+            accepted by RunManager.run_locally(pool = ...)
+    """
+    if authkey is None:
+        authkey = default_authkey()
+    manager = WorkerService(address = address, authkey = authkey)
+    manager.connect()
+    logger.info('Connected to worker service on {}'.format(address))
+    return manager.get_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Serve a warm pool of ntuple_processor workers on a local socket.')
+    parser.add_argument('-j', '--nworkers', type = int, default = os.cpu_count(),
+        help = 'number of workers')
+    parser.add_argument('--address', default = DEFAULT_ADDRESS,
+        help = 'path of the unix socket')
+    parser.add_argument('--declare', nargs = '*', default = [],
+        help = 'C++ files declared in every worker, e.g. headers with helper functions')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO)
+    declarations = list()
+    for path in args.declare:
+        with open(path) as declaration:
+            declarations.append(declaration.read())
+    serve(args.nworkers, args.address, declarations = declarations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+from .booking import UnitManager
+from .optimization import GraphManager
+from .run import RunManager
+from .run import set_threads
+from .run import declare_helpers
+from .output import write_results
+from .columnar import write_columnar
+from .merging import CompositeSums
+
+import ROOT
+from ROOT import gROOT
+gROOT.SetBatch(True)
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class Session(RunManager):
+    """Long-lived RunManager for interactive work, e.g. in notebooks.
+
+    The RDataFrames of the datasets, the filters of the selections and
+    the columns of the weights created for the units booked so far are
+    kept alive, so that booking new units only adds the operations that
+    are still missing, and running the session only executes the actions
+    booked since the last run, all of them in the same event loops.
+
+        session = Session(nthreads = 4)
+        session.book([unit], [variation])
+        session.run()
+        histogram = session.get('dataset#selection#Nominal#histogram')
+        session.book([other_unit])
+        session.run()
+
+    Args:
+        nthreads (int): Number of threads of the event loops
+        level (int): Optimization level applied to the booked graphs
+        split_selections (bool, str): Split the selections into minimal
+            units, or 'adaptive' (see GraphManager)
+
+    Attributes:
+        results (dict): Dictionary {name: result} of the executed actions
+        pending (list): List of tuples (name, pointer) of the actions
+            booked and not yet executed
+        pointers (list): Pointers of the executed actions, owning the
+            objects in results and kept alive with the session
+        composites (CompositeSums): Sums giving the results of the
+            composite datasets booked, added to results as soon as
+            the results of all their components are available
+    """
+    def __init__(self, nthreads = 1, level = 2, split_selections = False):
+        RunManager.__init__(self, list())
+        self.nthreads = nthreads
+        self.level = level
+        self.split_selections = split_selections
+        self.results = dict()
+        self.pending = list()
+        self.pointers = list()
+        self.composites = CompositeSums()
+        set_threads(nthreads)
+        declare_helpers()
+
+    def __str__(self):
+        return 'Session-{}results-{}pending'.format(
+            len(self.results), len(self.pending))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def book(self, units, variations = None):
+        """Book new units, with the variations applied, converting to
+        RDataFrame operations only the nodes not created yet.
+
+        Args:
+            units (list): List of Unit objects
+            variations (list): List of Variation objects
+        """
+        unit_manager = UnitManager()
+        unit_manager.book(units, variations)
+        booked = set(self.results.keys()).union(
+            [name for name, _ in self.pending])
+        for unit in unit_manager.booked_units:
+            for action in unit.actions:
+                if action.name in booked:
+                    logger.fatal('Action {} already booked in the session'.format(
+                        action.name))
+                    raise NameError
+        self.composites.update(unit_manager.composites)
+        graph_manager = GraphManager(
+            unit_manager.booked_units, self.split_selections)
+        graph_manager.optimize(self.level)
+        for graph in graph_manager.graphs:
+            self.graphs.append(graph)
+            self.pending.extend(self.node_to_root(graph))
+        logger.info('Booked {} new actions, {} pending'.format(
+            sum([len(unit.actions) for unit in unit_manager.booked_units]),
+            len(self.pending)))
+
+    def run(self):
+        """Execute the pending actions, running the event loops of all
+        the datasets concurrently if supported by ROOT.
+
+        Returns:
+            results (dict): Dictionary {name: result} of the new results
+        """
+        if not self.pending:
+            return dict()
+        pointers = list()
+        seen = set()
+        for _, pointer in self.pending:
+            # Results assembled from several pointers, e.g. cutflows,
+            # or sharing a pointer, e.g. rebinned histograms
+            for result_pointer in getattr(pointer, 'pointers', [pointer]):
+                if id(result_pointer) not in seen:
+                    seen.add(id(result_pointer))
+                    pointers.append(result_pointer)
+        if hasattr(ROOT.RDF, 'RunGraphs'):
+            ROOT.RDF.RunGraphs(pointers)
+        new_results = dict()
+        for name, pointer in self.pending:
+            new_results[name] = pointer.GetValue()
+        self.results.update(new_results)
+        for name in self.composites.sums:
+            if name not in self.results and all([component_name in self.results \
+                    for component_name, _ in self.composites.sums[name]]):
+                new_results[name] = self.composites.combine(name, self.results)
+                self.results[name] = new_results[name]
+        self.pointers.extend(pointers)
+        self.pending = list()
+        logger.info('Executed {} actions'.format(len(new_results)))
+        return new_results
+
+    def get(self, name):
+        """Result of the action called name, running the pending
+        actions first if it is not executed yet.
+        """
+        if name not in self.results:
+            if name not in [pending_name for pending_name, _ in self.pending] and \
+                    name not in self.composites.sums:
+                logger.fatal('Action {} not booked in the session'.format(name))
+                raise NameError
+            self.run()
+        return self.results[name]
+
+    def write(self, output, compression = None, columnar = None,
+            hierarchical = False):
+        """Run the pending actions and write all the results to output,
+        and to the .npz file columnar if given (see RunManager.run_locally).
+        """
+        self.run()
+        write_results(self.results, output, compression, hierarchical)
+        if columnar is not None:
+            write_columnar(self.results, columnar)
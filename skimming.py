@@ -0,0 +1,318 @@
+import os
+import json
+import hashlib
+from time import time
+
+from .validation import SchemaCache
+from .validation import referenced_identifiers
+from .utils import Ntuple
+from .utils import Dataset
+from .utils import Selection
+from .utils import Cutflow
+from .utils import Node
+
+import ROOT
+from ROOT import gROOT
+gROOT.SetBatch(True)
+from ROOT.std import vector
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class SkimCache:
+    """Local cache of skims: the events passing a selection node
+    placed directly below a dataset, with only the columns needed by
+    the nodes below it.
+
+    A skim is written by a lazy Snapshot booked in the same event loop
+    as the actions, the first time a selection is processed. In the
+    following runs, the selection is redirected to the skims covering
+    all the ntuples of its dataset: the cuts are dropped, the weights
+    are kept. Skims are identified by the cuts, the columns and the
+    ntuples (path, size and modification time of the local files) they
+    were made from, so that a change of the inputs makes them stale.
+
+    Every skim is a .root file with a .json file describing it, written
+    by the worker that made it, so that workers never share a file.
+
+    Args:
+        directory (str): Directory of the skims, created if it
+            does not exist
+        selections (list): Names of the selection nodes to skim, all
+            the selection nodes with cuts directly below a dataset if None
+        max_size (int): Maximum size in bytes of the skims kept, the
+            least recently used ones are removed first
+        max_age (float): Maximum age in seconds of the skims kept
+
+    Attributes:
+        schema_cache (SchemaCache): Branches of the input trees, used
+            to select the columns written to the skims
+    """
+    tree_name = 'ntuple'
+
+    def __init__(self, directory, selections = None,
+            max_size = None, max_age = None):
+        self.directory = directory
+        self.selections = selections
+        self.max_size = max_size
+        self.max_age = max_age
+        self.schema_cache = SchemaCache(os.path.join(directory, 'schemas.json'))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __str__(self):
+        return 'SkimCache-{}'.format(self.directory)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __stamp(self, path):
+        try:
+            stat = os.stat(path)
+            return [stat.st_mtime, stat.st_size]
+        except OSError:
+            return None
+
+    def _input_key(self, ntuple):
+        """Identifier of an ntuple with its friends and their state."""
+        return json.dumps([[ntuple.path, ntuple.directory, self.__stamp(ntuple.path)]] + \
+            [[friend.path, friend.directory, self.__stamp(friend.path)] \
+                for friend in ntuple.friends])
+
+    def _selection_key(self, selection):
+        return hashlib.sha1(json.dumps(
+            [cut.expression for cut in selection.cuts]).encode()).hexdigest()
+
+    def _columns(self, dataset, node):
+        """Columns of the dataset used by the weights of the node and
+        by the nodes below it.
+        """
+        ntuple = dataset.ntuples[0]
+        branches = self.schema_cache.branches(ntuple)
+        for friend in ntuple.friends:
+            branches |= self.schema_cache.branches(friend)
+        identifiers = set()
+        for weight in node.unit_block.weights:
+            identifiers |= referenced_identifiers(weight.expression)
+        stack = list(node.children)
+        while stack:
+            child = stack.pop()
+            if child.kind == 'selection':
+                for operation in child.unit_block.cuts + child.unit_block.weights:
+                    identifiers |= referenced_identifiers(operation.expression)
+            elif child.unit_block.variable is not None:
+                identifiers.add(child.unit_block.variable)
+            stack.extend(child.children)
+        return sorted(identifiers & branches)
+
+    def skimmable(self, node):
+        """The selection node, directly below a dataset, has cuts, is
+        selected for skimming and no cutflow below it needs the
+        events it rejects.
+        """
+        if node.kind != 'selection' or not node.unit_block.cuts:
+            return False
+        if self.selections is not None and node.name not in self.selections:
+            return False
+        stack = list(node.children)
+        while stack:
+            child = stack.pop()
+            if isinstance(child.unit_block, Cutflow):
+                return False
+            stack.extend(child.children)
+        return True
+
+    def entries(self):
+        """Descriptions of the complete skims of the directory."""
+        entries = list()
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith('.json') or file_name == 'schemas.json':
+                continue
+            path = os.path.join(self.directory, file_name)
+            try:
+                with open(path) as entry_file:
+                    entry = json.load(entry_file)
+                entry['meta'] = path
+                entry['path'] = os.path.join(self.directory, entry['file'])
+                entry['used'] = os.stat(path).st_mtime
+            except (OSError, ValueError, KeyError):
+                continue
+            if os.path.exists(entry['path']):
+                entries.append(entry)
+        return entries
+
+    def _find(self, dataset, node, entries):
+        """Skims covering exactly the ntuples of the dataset with the
+        cuts of the node and at least the columns needed, None if
+        some ntuples are not covered.
+        """
+        selection_key = self._selection_key(node.unit_block)
+        columns = set(self._columns(dataset, node))
+        inputs = set([self._input_key(ntuple) for ntuple in dataset.ntuples])
+        candidates = [entry for entry in entries \
+                if entry['selection'] == selection_key and \
+                columns.issubset(entry['columns']) and \
+                inputs.issuperset(entry['inputs'])]
+        # Most recent skims first
+        candidates.sort(key = lambda entry: entry['created'], reverse = True)
+        chosen = list()
+        covered = set()
+        for entry in candidates:
+            if covered.isdisjoint(entry['inputs']):
+                chosen.append(entry)
+                covered.update(entry['inputs'])
+        if covered != inputs:
+            return None
+        return chosen
+
+    def redirect(self, graphs):
+        """Redirect the selection nodes of the graphs with complete
+        skims to them.
+
+        Args:
+            graphs (list): List of Graph objects
+
+        Returns:
+            graphs (list): List of Node objects of kind 'dataset',
+                with a new dataset for every redirected selection
+        """
+        entries = self.entries()
+        new_graphs = list()
+        nredirected = 0
+        for graph in graphs:
+            dataset = graph.unit_block
+            children = list()
+            for node in graph.children:
+                chosen = None
+                if self.skimmable(node):
+                    try:
+                        chosen = self._find(dataset, node, entries)
+                    except FileNotFoundError as error:
+                        logger.warning('Can not skim {} of {} ({})'.format(
+                            node.name, dataset.name, error))
+                if chosen is None:
+                    children.append(node)
+                    continue
+                for entry in chosen:
+                    # Mark as recently used
+                    os.utime(entry['meta'])
+                selection = Selection(node.unit_block.name, [],
+                    list(node.unit_block.weights))
+                new_graphs.append(Node('{}>{}'.format(graph.name, node.name),
+                    'dataset', Dataset(dataset.name,
+                        [Ntuple(entry['path'], self.tree_name) for entry in chosen]),
+                    Node(node.name, 'selection', selection, *node.children)))
+                nredirected += 1
+            if len(children) == len(graph.children):
+                new_graphs.append(graph)
+            elif children:
+                new_graphs.append(Node(graph.name, 'dataset', dataset, *children))
+        logger.info('Redirected {} selections to the skims of {}'.format(
+            nredirected, self.directory))
+        self.schema_cache.save()
+        return new_graphs
+
+    def book(self, graph, filter_cache):
+        """Book in a worker the lazy snapshots of the skimmable
+        selections of graph.
+
+        Args:
+            graph (Node): Graph converted to RDataFrame operations
+            filter_cache (dict): Dictionary {(dataset, cuts): (frame,
+                filter index)} of RunManager
+
+        Returns:
+            snapshots (list): Pending skims, to be passed to commit
+                after the event loop
+        """
+        dataset = graph.unit_block
+        snapshots = list()
+        for node in graph.children:
+            if not self.skimmable(node):
+                continue
+            try:
+                columns = self._columns(dataset, node)
+            except FileNotFoundError as error:
+                logger.warning('Can not skim {} of {} ({})'.format(
+                    node.name, dataset.name, error))
+                continue
+            inputs = [self._input_key(ntuple) for ntuple in dataset.ntuples]
+            entry = {
+                'selection': self._selection_key(node.unit_block),
+                'columns': columns,
+                'inputs': inputs,
+                'dataset': dataset.name,
+                'node': node.name}
+            file_name = '{}.root'.format(hashlib.sha1(json.dumps(
+                [entry['selection'], columns, inputs]).encode()).hexdigest())
+            entry['file'] = file_name
+            temp_path = os.path.join(self.directory, '.{}.{}.tmp'.format(
+                file_name, os.getpid()))
+            frame = filter_cache[(dataset, tuple(node.unit_block.cuts))][0]
+            options = ROOT.RDF.RSnapshotOptions()
+            options.fLazy = True
+            branches = vector['string']()
+            for column in columns:
+                branches.push_back(column)
+            snapshot = frame.Snapshot(self.tree_name, temp_path, branches, options)
+            snapshots.append((entry, temp_path, snapshot))
+            logger.debug('%%%%%%%%%% Booked skim of {} from {} with {} columns'.format(
+                node.name, dataset.name, len(columns)))
+        return snapshots
+
+    def commit(self, snapshots):
+        """Move the skims written by the event loop to the cache."""
+        for entry, temp_path, snapshot in snapshots:
+            if not os.path.exists(temp_path):
+                logger.warning('Skim of {} from {} not written'.format(
+                    entry['node'], entry['dataset']))
+                continue
+            path = os.path.join(self.directory, entry['file'])
+            os.replace(temp_path, path)
+            entry['size'] = os.path.getsize(path)
+            entry['created'] = time()
+            meta = '{}.json'.format(os.path.splitext(path)[0])
+            temp_meta = '{}.{}.tmp'.format(meta, os.getpid())
+            with open(temp_meta, 'w') as meta_file:
+                json.dump(entry, meta_file)
+            os.replace(temp_meta, meta)
+
+    def __remove(self, entry):
+        for path in (entry['meta'], entry['path']):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def evict(self):
+        """Remove the stale skims, whose local inputs changed, the
+        skims older than max_age, leftovers of interrupted snapshots
+        and the least recently used skims beyond max_size.
+        """
+        now = time()
+        for file_name in os.listdir(self.directory):
+            path = os.path.join(self.directory, file_name)
+            # Temporary files of interrupted workers
+            if file_name.endswith('.tmp') and now - os.path.getmtime(path) > 24 * 3600:
+                os.remove(path)
+        kept = list()
+        for entry in self.entries():
+            stale = False
+            for key in entry['inputs']:
+                for path, directory, stamp in json.loads(key):
+                    if stamp is not None and self.__stamp(path) != stamp:
+                        stale = True
+            if stale or (self.max_age is not None and \
+                    now - entry['created'] > self.max_age):
+                self.__remove(entry)
+            else:
+                kept.append(entry)
+        if self.max_size is not None:
+            kept.sort(key = lambda entry: entry['used'])
+            size = sum([entry['size'] for entry in kept])
+            while kept and size > self.max_size:
+                entry = kept.pop(0)
+                size -= entry['size']
+                self.__remove(entry)
+        logger.info('Kept {} skims ({:.1f} MB) in {}'.format(len(kept),
+            sum([entry['size'] for entry in kept]) / 1e6, self.directory))
@@ -0,0 +1,218 @@
+import os
+import shutil
+import hashlib
+from threading import Thread
+from threading import Condition
+from collections import deque
+from collections import Counter
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class StagingArea:
+    """Local copies of the input files, made in background threads
+    ahead of the event loops that read them.
+
+    The driver of a run calls start with the files of the upcoming
+    tasks, in the order in which they are processed, and release when
+    a task is completed; the workers only call local_path, which returns
+    the local copy of a file if it is complete and up to date and the
+    original path otherwise, so that a file not staged yet is read in
+    place. The copies are kept under a size budget, removing first the
+    least recently used files of the completed tasks, and are reused by
+    the following runs as long as the size and the modification time of
+    the original files do not change. Only files reachable through the
+    file system are staged, e.g. not root:// URLs.
+
+        staging = StagingArea('/tmp/staging', max_size = 50 * 1024**3)
+        RunManager(graphs, staging = staging).run_locally('shapes.root')
+
+    Args:
+        directory (str): Local directory of the copies, created if
+            it does not exist
+        max_size (int): Maximum size in bytes of the copies, no limit if None
+        nthreads (int): Number of files copied in parallel
+        cache_size (int): Size in bytes of the read cache of the
+            chains (TTree::SetCacheSize), default of ROOT if None
+    """
+    def __init__(self, directory, max_size = None, nthreads = 2,
+            cache_size = None):
+        self.directory = directory
+        self.max_size = max_size
+        self.nthreads = nthreads
+        self.cache_size = cache_size
+        self.__init_state()
+
+    def __init_state(self):
+        self.__condition = Condition()
+        # Dictionary {local path: size} of the copies, least recently
+        # used first, including the ones being copied
+        self.__files = OrderedDict()
+        self.__used_size = 0
+        self.__pins = Counter()
+        self.__groups = dict()
+        self.__queue = deque()
+        self.__threads = list()
+        self.__stopped = False
+
+    def __getstate__(self):
+        # Workers only need the configuration
+        return {'directory': self.directory, 'max_size': self.max_size,
+            'nthreads': self.nthreads, 'cache_size': self.cache_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__init_state()
+
+    def __str__(self):
+        return 'StagingArea-{}'.format(self.directory)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def staged_name(self, path):
+        """Path of the local copy of the file path."""
+        return os.path.join(self.directory, '{}_{}'.format(
+            hashlib.sha1(path.encode()).hexdigest()[:16], os.path.basename(path)))
+
+    def _is_staged(self, path, local):
+        try:
+            source = os.stat(path)
+            copy = os.stat(local)
+        except OSError:
+            return False
+        return source.st_size == copy.st_size and \
+            int(source.st_mtime) == int(copy.st_mtime)
+
+    def local_path(self, path):
+        """Local copy of path if it is complete and up to date,
+        path otherwise.
+        """
+        local = self.staged_name(path)
+        if self._is_staged(path, local):
+            logger.debug('%%%%%%%%%% Read staged copy of {}'.format(path))
+            return local
+        return path
+
+    def copy_file(self, source, destination):
+        """Copy the content and the modification time of a file."""
+        shutil.copyfile(source, destination)
+        shutil.copystat(source, destination)
+
+    def start(self, groups, skip = 0):
+        """Start copying in the background the files of the groups.
+
+        Args:
+            groups (list): List of tuples (key, paths), e.g. the task
+                identifiers with the files of their datasets and friends,
+                in the order in which they are processed
+            skip (int): Number of groups not staged, e.g. the tasks
+                starting immediately
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with self.__condition:
+            self.__stopped = False
+            known = set(self.__files.keys())
+            for file_name in sorted(os.listdir(self.directory)):
+                local = os.path.join(self.directory, file_name)
+                if file_name.endswith('.tmp'):
+                    if not self.__threads:
+                        # Leftover of an interrupted copy
+                        os.remove(local)
+                elif local not in known:
+                    size = os.path.getsize(local)
+                    self.__files[local] = size
+                    self.__used_size += size
+            for key, paths in groups[skip:]:
+                paths = [path for path in paths if os.path.isfile(path)]
+                self.__groups[key] = paths
+                for path in paths:
+                    self.__pins[self.staged_name(path)] += 1
+                    self.__queue.append(path)
+            self.__threads = [thread for thread in self.__threads if thread.is_alive()]
+            for i in range(self.nthreads - len(self.__threads)):
+                thread = Thread(target = self.__copy_loop, daemon = True)
+                thread.start()
+                self.__threads.append(thread)
+        logger.info('Staging files of {} groups to {}'.format(
+            len(groups) - skip, self.directory))
+
+    def release(self, key):
+        """Mark the files of a completed group as removable."""
+        with self.__condition:
+            for path in self.__groups.pop(key, list()):
+                self.__pins[self.staged_name(path)] -= 1
+            self.__condition.notify_all()
+
+    def __evict_one(self):
+        for local in self.__files:
+            if self.__pins[local] <= 0:
+                size = self.__files.pop(local)
+                self.__used_size -= size
+                if os.path.exists(local):
+                    os.remove(local)
+                logger.debug('%%%%%%%%%% Removed staged copy {}'.format(local))
+                return True
+        return False
+
+    def __copy_loop(self):
+        while True:
+            with self.__condition:
+                if self.__stopped or not self.__queue:
+                    return
+                path = self.__queue.popleft()
+                local = self.staged_name(path)
+                if self.__pins[local] <= 0:
+                    # Group already completed
+                    continue
+                if local in self.__files:
+                    self.__files.move_to_end(local)
+                    if self._is_staged(path, local) or \
+                            not os.path.exists(local):
+                        # Staged, or being copied by another thread
+                        continue
+                    # Stale copy of a modified file
+                    self.__used_size -= self.__files.pop(local)
+                size = os.path.getsize(path)
+                if self.max_size is not None:
+                    if size > self.max_size:
+                        logger.warning('File {} larger than the staging area, read in place'.format(
+                            path))
+                        continue
+                    while self.__used_size + size > self.max_size:
+                        if not self.__evict_one():
+                            self.__condition.wait()
+                            if self.__stopped:
+                                return
+                self.__files[local] = size
+                self.__used_size += size
+            temp_path = '{}.{}.tmp'.format(local, os.getpid())
+            try:
+                self.copy_file(path, temp_path)
+                os.replace(temp_path, local)
+                logger.debug('%%%%%%%%%% Staged {}'.format(path))
+            except OSError as error:
+                logger.warning('Can not stage {} ({}), read in place'.format(
+                    path, error))
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                with self.__condition:
+                    if self.__files.pop(local, None) is not None:
+                        self.__used_size -= size
+
+    def wait(self):
+        """Wait until all the files queued are copied or skipped."""
+        for thread in list(self.__threads):
+            thread.join()
+
+    def stop(self):
+        """Stop copying, the copies in progress are completed."""
+        with self.__condition:
+            self.__stopped = True
+            self.__queue.clear()
+            self.__condition.notify_all()
+        self.wait()
@@ -0,0 +1,48 @@
+import unittest
+
+from ntuple_processor.benchmarks.analysis import category_selections
+from ntuple_processor.benchmarks.analysis import variations
+from ntuple_processor.benchmarks.run_benchmarks import compare
+from ntuple_processor.benchmarks.run_benchmarks import count_nodes
+from ntuple_processor.utils import Node
+from ntuple_processor.variations import ChangeDataset
+from ntuple_processor.variations import ReplaceCut
+from ntuple_processor.variations import ReplaceWeight
+
+
+class TestBenchmarks(unittest.TestCase):
+    """ Test the synthetic analysis and the comparison
+    of the benchmark results
+    """
+    def test_analysis(self):
+        """
+        Categories have different cuts, variations mix all the types
+        """
+        categories = category_selections(6)
+        self.assertEqual(len(set(categories)), 6)
+        varied = variations(5)
+        self.assertEqual([type(variation) for variation in varied], [ChangeDataset,
+            ChangeDataset, ReplaceWeight, ReplaceCut, ReplaceWeight])
+        self.assertEqual(len(set([variation.name for variation in variations(100)])), 100)
+
+    def test_count_nodes(self):
+        """
+        All the nodes of the graphs are counted
+        """
+        graph = Node('ds', 'dataset', None, Node('sel', 'selection', None,
+            Node('count', 'action', None), Node('other_count', 'action', None)))
+        self.assertEqual(count_nodes([graph, Node('other_ds', 'dataset', None)]), 5)
+
+    def test_compare(self):
+        """
+        Timings slower than the reference beyond the tolerance
+        are regressions
+        """
+        reference = {'parameters': {}, 'timings': {'booking': 1., 'run': 10., 'fast': 0.001}}
+        results = {'parameters': {}, 'timings': {'booking': 1.05, 'run': 12., 'fast': 0.005,
+            'new': 1.}}
+        self.assertEqual(compare(results, reference, 0.1), ['run'])
+
+
+if __name__ == '__main__':
+    unittest.main()
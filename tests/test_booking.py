@@ -1,6 +1,15 @@
+import pickle
+import shutil
+import tempfile
 import unittest
 
 from ntuple_processor.booking import Ntuple, Dataset, Cut, Weight
+from ntuple_processor.booking import Selection, Unit, Cutflow
+from ntuple_processor.booking import Count, CompositeDataset, UnitManager
+from ntuple_processor.booking import Histogram, UnitProduct
+from ntuple_processor.variations import ChangeDataset
+from ntuple_processor.utils import Node
+from ntuple_processor.serialization import optimized_graphs
 
 
 class TestBookingMethods(unittest.TestCase):
@@ -54,6 +63,156 @@ class TestBookingMethods(unittest.TestCase):
         self.assertEqual(self.wh, same_wh)
         self.assertNotEqual(self.wh, other_wh)
 
+    def test_interned_operations(self):
+        """
+        Equal cuts and weights are the same object, also after
+        pickling, and can not be changed
+        """
+        self.assertIs(Cut(self.ct.expression, self.ct.name), self.ct)
+        self.assertIs(pickle.loads(pickle.dumps(self.ct)), self.ct)
+        self.assertIsNot(Weight(self.ct.expression, self.ct.name), self.ct)
+        with self.assertRaises(AttributeError):
+            self.ct.expression = 'other_cut_exp'
+
+    def test_selection_lists(self):
+        """
+        Cuts and weights of a selection are lists changed in place,
+        the hash follows the changes
+        """
+        selection = Selection('sel', [self.ct])
+        selection.cuts.append(Cut('other_cut_exp', 'other_cut_name'))
+        selection.add_weight(self.wh.expression, self.wh.name)
+        same = Selection('same_sel', [self.ct, Cut('other_cut_exp', 'other_cut_name')],
+            [self.wh])
+        self.assertEqual(selection, same)
+        self.assertEqual(hash(selection), hash(same))
+        selection.remove_cut('other_cut_name')
+        self.assertEqual(selection.cuts, [self.ct])
+        self.assertNotEqual(selection, same)
+
+    def test_node_hash(self):
+        """
+        Nodes equal if same name, kind and block, also after
+        changing the block in place
+        """
+        selection = Selection('sel', [self.ct])
+        node = Node('sel', 'selection', selection)
+        selection.add_cut('other_cut_exp', 'other_cut_name')
+        same = Node('sel', 'selection', Selection('sel', [self.ct,
+            Cut('other_cut_exp', 'other_cut_name')]))
+        self.assertEqual(node, same)
+        self.assertIn(same, {node})
+        dataset_node = Node('ds', 'dataset', self.ds)
+        self.ds.add_to_ntuples(self.nt_friend)
+        self.assertIn(Node('ds', 'dataset', Dataset('ds', [self.nt, self.nt_friend])),
+            {dataset_node})
+
+    def test_histograms(self):
+        """
+        Histograms equal if same name, variable and edges, and
+        never equal to other actions
+        """
+        histogram = Histogram('histogram', 'var', [0., 1., 2.])
+        self.assertEqual(histogram, Histogram('histogram', 'var', (0., 1., 2.)))
+        self.assertNotEqual(histogram, Histogram('histogram', 'var', [0., 2.]))
+        self.assertNotEqual(histogram, Count('histogram', 'var'))
+
+    def test_cutflow_name(self):
+        """
+        Cutflow actions are named after dataset, selections and variation
+        """
+        unit = Unit(self.ds, [Selection('sel', [self.ct])], [Cutflow('cutflow')])
+        self.assertIsInstance(unit.actions[0], Cutflow)
+        self.assertEqual(unit.actions[0].name, 'ds#sel#Nominal#cutflow')
+
+    def test_composite_dataset(self):
+        """
+        Composite datasets book the units of their components once
+        and sum their results with the scale factors
+        """
+        other_ds = Dataset('other_ds', [Ntuple('other_path', 'directory')])
+        composite = CompositeDataset('composite', [self.ds, other_ds], [1., 2.])
+        selection = Selection('sel', [self.ct])
+        manager = UnitManager()
+        manager.book([
+            Unit(self.ds, [selection], [Count('count', 'var')]),
+            Unit(composite, [selection], [Count('count', 'var')])])
+        self.assertEqual(len(manager.booked_units), 2)
+        self.assertEqual(manager.composites.auxiliary, {'other_ds#sel#Nominal#count'})
+        results = manager.composites.apply({
+            'ds#sel#Nominal#count': 1., 'other_ds#sel#Nominal#count': 3.})
+        self.assertEqual(results, {
+            'ds#sel#Nominal#count': 1., 'composite#sel#Nominal#count': 7.})
+
+    def test_composite_dataset_separate_bookings(self):
+        """
+        Components booked explicitly in another call of book
+        are kept, in whichever order the calls are made
+        """
+        other_ds = Dataset('other_ds', [Ntuple('other_path', 'directory')])
+        composite = CompositeDataset('composite', [self.ds, other_ds], [1., 2.])
+        selection = Selection('sel', [self.ct])
+        for first, second in [(self.ds, composite), (composite, self.ds)]:
+            manager = UnitManager()
+            manager.book([Unit(first, [selection], [Count('count', 'var')])])
+            manager.book([Unit(second, [selection], [Count('count', 'var')])])
+            self.assertEqual(len(manager.booked_units), 2)
+            self.assertEqual(manager.composites.auxiliary, {'other_ds#sel#Nominal#count'})
+            results = manager.composites.apply({
+                'ds#sel#Nominal#count': 1., 'other_ds#sel#Nominal#count': 3.})
+            self.assertEqual(results, {
+                'ds#sel#Nominal#count': 1., 'composite#sel#Nominal#count': 7.})
+
+    def test_composite_dataset_plan_cache(self):
+        """
+        Sums of the composites are stored with the cached plan
+        """
+        other_ds = Dataset('other_ds', [Ntuple('other_path', 'directory')])
+        composite = CompositeDataset('composite', [self.ds, other_ds], [1., 2.])
+        units = [Unit(composite, [Selection('sel', [self.ct])], [Count('count', 'var')])]
+        cache_directory = tempfile.mkdtemp()
+        try:
+            booked = optimized_graphs(units, cache_directory = cache_directory,
+                return_composites = True)[1]
+            loaded = optimized_graphs(units, cache_directory = cache_directory,
+                return_composites = True)[1]
+        finally:
+            shutil.rmtree(cache_directory)
+        self.assertEqual(loaded.sums, booked.sums)
+        self.assertEqual(loaded.auxiliary, booked.auxiliary)
+        self.assertEqual(len(loaded), 1)
+
+    def test_unit_product(self):
+        """
+        Every dataset is combined with one selection of each group,
+        each nominal unit followed by its variations, and filtered
+        by the include and exclude rules
+        """
+        ds = Dataset('ds', [Ntuple('path', 'mt_nominal/ntuple')])
+        data = Dataset('data', [Ntuple('data_path', 'mt_nominal/ntuple')])
+        first, second = Selection('first', [self.ct]), Selection('second', weights = [self.wh])
+        variation = ChangeDataset('shift', 'shift')
+        product = UnitProduct([ds, data], [[Selection('sel', [self.ct])], [first, second]],
+            [Count('count', 'var')], [variation])
+        self.assertEqual(len(product), 8)
+        units = list(product.units())
+        self.assertEqual([action.name for unit in units for action in unit.actions], [
+            'ds#sel-first#Nominal#count', 'ds#sel-first#shift#count',
+            'ds#sel-second#Nominal#count', 'ds#sel-second#shift#count',
+            'data#sel-first#Nominal#count', 'data#sel-first#shift#count',
+            'data#sel-second#Nominal#count', 'data#sel-second#shift#count'])
+        self.assertEqual(units[1].dataset.ntuples[0].directory, 'mt_shift/ntuple')
+        product = UnitProduct([ds, data], [[Selection('sel', [self.ct])], [first, second]],
+            [Count('count', 'var')], [variation],
+            include = [lambda unit, variation: unit.selections[1].name == 'first'],
+            exclude = [lambda unit, variation: \
+                unit.dataset.name == 'data' and variation is not None])
+        self.assertEqual([action.name for unit in product.units() for action in unit.actions], [
+            'ds#sel-first#Nominal#count', 'ds#sel-first#shift#count',
+            'data#sel-first#Nominal#count'])
+        with self.assertRaises(TypeError):
+            UnitProduct([ds], [first], [Count('count', 'var')])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,79 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from ntuple_processor.checkpoint import Journal
+
+
+def write_json(results, output):
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file)
+
+
+@mock.patch('ntuple_processor.checkpoint.write_results', write_json)
+class TestJournal(unittest.TestCase):
+    """ Test the journal of the completed tasks
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record(self):
+        """
+        Recorded tasks are completed, also when resuming,
+        with their results on disk
+        """
+        journal = Journal(self.directory)
+        journal.record('task', 'graph', {'count': 1.})
+        self.assertTrue(journal.is_completed('task'))
+        resumed = Journal(self.directory, resume = True)
+        self.assertEqual(list(resumed.completed), ['task'])
+        with open(resumed.completed['task']) as partial_output:
+            self.assertEqual(json.load(partial_output), {'count': 1.})
+
+    def test_truncated_journal(self):
+        """
+        A truncated last line of the journal is skipped
+        """
+        journal = Journal(self.directory)
+        journal.record('task', 'graph', {'count': 1.})
+        with open(journal.path, 'a') as journal_file:
+            journal_file.write('{"id": "other_task", "na')
+        self.assertEqual(list(Journal(self.directory, resume = True).completed), ['task'])
+
+    def test_clear(self):
+        """
+        Starting from scratch removes the journal and the partial
+        outputs, but not the other files of the directory
+        """
+        other_file = os.path.join(self.directory, 'other.txt')
+        open(other_file, 'w').close()
+        journal = Journal(self.directory)
+        journal.record('task', 'graph', {'count': 1.})
+        partial_output = journal.completed['task']
+        journal = Journal(self.directory)
+        self.assertEqual(journal.completed, {})
+        self.assertFalse(os.path.exists(journal.path))
+        self.assertFalse(os.path.exists(partial_output))
+        self.assertTrue(os.path.exists(other_file))
+
+    def test_partial_outputs(self):
+        """
+        Only the partial outputs of the tasks planned are merged
+        """
+        journal = Journal(self.directory)
+        journal.record('task', 'graph', {'count': 1.})
+        journal.record('stale_task', 'graph', {'count': 2.})
+        self.assertEqual(len(journal.partial_outputs()), 2)
+        with self.assertLogs('ntuple_processor.checkpoint', 'WARNING'):
+            partial_outputs = journal.partial_outputs(['task', 'missing_task'])
+        self.assertEqual(partial_outputs, [journal.completed['task']])
+
+
+if __name__ == '__main__':
+    unittest.main()
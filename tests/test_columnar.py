@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from ntuple_processor.columnar import write_columnar
+from ntuple_processor.columnar import ColumnarResults
+
+
+class Bins:
+    def __init__(self, edges):
+        self.edges = numpy.array(edges, dtype = numpy.float64)
+
+    def GetSize(self):
+        return len(self.edges)
+
+    def GetArray(self):
+        return self.edges
+
+
+class Axis:
+    def __init__(self, edges, variable):
+        self.edges = edges
+        self.variable = variable
+
+    def GetNbins(self):
+        return len(self.edges) - 1
+
+    def GetXbins(self):
+        return Bins(self.edges if self.variable else [])
+
+    def GetXmin(self):
+        return self.edges[0]
+
+    def GetXmax(self):
+        return self.edges[-1]
+
+
+class Histogram:
+    """Minimal one-dimensional histogram with the methods used
+    to write the columnar output
+    """
+    def __init__(self, edges, contents, sumw2 = None, variable = True):
+        self.axis = Axis(edges, variable)
+        self.contents = numpy.array(contents, dtype = numpy.float64)
+        self.sumw2 = None if sumw2 is None else Bins(sumw2)
+
+    def GetNbinsX(self):
+        return self.axis.GetNbins()
+
+    def GetNcells(self):
+        return len(self.contents)
+
+    def GetXaxis(self):
+        return self.axis
+
+    def GetArray(self):
+        return self.contents
+
+    def GetSumw2N(self):
+        return 0 if self.sumw2 is None else self.sumw2.GetSize()
+
+    def GetSumw2(self):
+        return self.sumw2
+
+    def GetEntries(self):
+        return float(sum(self.contents))
+
+
+class TestColumnar(unittest.TestCase):
+    """ Test the columnar output and its name index
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.results = {
+            'ds#sel#Nominal#weighted': Histogram([0., 1., 3.], [1., 2., 3., 4.],
+                [1., 4., 9., 16.]),
+            'ds#sel#Nominal#uniform': Histogram([0., 1., 2., 3.], [0., 1., 1., 1., 0.],
+                variable = False),
+            'ds#sel#Nominal#count': 5.}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check(self, results):
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results.names(), ['ds#sel#Nominal#weighted',
+            'ds#sel#Nominal#uniform', 'ds#sel#Nominal#count'])
+        self.assertEqual(results['ds#sel#Nominal#count'], 5.)
+        edges, contents, sumw2 = results['ds#sel#Nominal#weighted']
+        self.assertEqual(edges.tolist(), [0., 1., 3.])
+        self.assertEqual(contents.tolist(), [1., 2., 3., 4.])
+        self.assertEqual(sumw2.tolist(), [1., 4., 9., 16.])
+        edges, contents, sumw2 = results['ds#sel#Nominal#uniform']
+        self.assertEqual(edges.tolist(), [0., 1., 2., 3.])
+        self.assertEqual(sumw2.tolist(), contents.tolist())
+        self.assertNotIn('ds#sel#Nominal#other', results)
+
+    def test_round_trip(self):
+        """
+        Histograms and counts are read back by name, the
+        uncompressed arrays are memory-mapped
+        """
+        path = os.path.join(self.directory, 'results.npz')
+        write_columnar(self.results, path)
+        results = ColumnarResults(path)
+        self.check(results)
+        self.assertIsInstance(results.contents, numpy.memmap)
+
+    def test_compressed(self):
+        """
+        Compressed archives are read entirely
+        """
+        path = os.path.join(self.directory, 'results.npz')
+        write_columnar(self.results, path, compress = True)
+        self.check(ColumnarResults(path))
+
+    def test_not_columnar(self):
+        """
+        Archives without the arrays of a columnar output are rejected
+        """
+        path = os.path.join(self.directory, 'other.npz')
+        numpy.savez(path, names = numpy.array(['name']))
+        with self.assertRaises(ValueError):
+            ColumnarResults(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+import os
+import signal
+import shutil
+import tempfile
+import unittest
+from threading import Thread
+from concurrent.futures import wait
+from multiprocessing import Pool
+from multiprocessing import Manager
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
+
+from ntuple_processor.run import RunManager
+from ntuple_processor.serialization import load_graphs
+from ntuple_processor.utils import Node
+from ntuple_processor.utils import Dataset
+from ntuple_processor.utils import Ntuple
+from ntuple_processor.utils import Task
+from ntuple_processor.utils import Count
+from ntuple_processor.utils import GraphProfile
+
+
+class CrashingRunManager(RunManager):
+    """Run manager whose tasks kill their own worker the first time
+    they run, after sending their start message (graphs named
+    crash_*), before it (graphs named early_*) or after creating
+    the shared memory block of their results (graphs named leak_*),
+    and return the number of threads as result otherwise.
+    """
+    poll_interval = 0.05
+    start_timeout = 0.5
+
+    def __init__(self, graphs, flags):
+        RunManager.__init__(self, graphs)
+        self.flags = flags
+
+    def _crash_once(self, name):
+        flag = os.path.join(self.flags, name)
+        if not os.path.exists(flag):
+            open(flag, 'w').close()
+            os.kill(os.getpid(), signal.SIGKILL)
+
+    def _run_task(self, task):
+        graph = task.graph
+        if graph is None:
+            graph = load_graphs(task.payload)[0]
+        if graph.name.startswith('early'):
+            self._crash_once(graph.name)
+        if graph.name.startswith('leak'):
+            block = shared_memory.SharedMemory(name = task.block, create = True, size = 8)
+            resource_tracker.unregister(block._name, 'shared_memory')
+            self._crash_once(graph.name)
+        return RunManager._run_task(self, task)
+
+    def _run_multiprocess(self, graph, task_id = None, progress_queue = None,
+            nthreads = 1):
+        if graph.name.startswith('crash'):
+            self._crash_once(graph.name)
+        return {graph.name: nthreads}, GraphProfile(graph.name)
+
+
+class TestExecute(unittest.TestCase):
+    """ Test the isolation of the tasks and the retries
+    of the tasks whose worker died
+    """
+    def setUp(self):
+        self.flags = tempfile.mkdtemp()
+        self.manager = Manager()
+        self.pool = Pool(2)
+
+    def tearDown(self):
+        self.pool.terminate()
+        self.manager.shutdown()
+        shutil.rmtree(self.flags)
+
+    def run_manager(self, names):
+        # One action per graph, named after it
+        graphs = [Node(name, 'dataset', Dataset(name, [Ntuple('path', 'directory')]),
+                    Node(name, 'action', Count(name, 'var'))) \
+                for name in names]
+        return CrashingRunManager(graphs, self.flags)
+
+    def execute(self, names, retries, on_failure = None, shared_memory = False):
+        run_manager = self.run_manager(names)
+        graphs = run_manager.graphs
+        tasks = [Task(run_manager._task_id(graph), graph, shared_memory = shared_memory) \
+                for graph in graphs]
+        failures = list()
+        results = dict()
+        for task, task_results, profile in run_manager._execute(self.pool, tasks,
+                retries, False, failures, self.manager.Queue(), nworkers = 2,
+                on_failure = on_failure):
+            results.update(task_results)
+        return results, failures
+
+    def assert_pool_joins(self):
+        self.pool.close()
+        join = Thread(target = self.pool.join, daemon = True)
+        join.start()
+        join.join(10)
+        self.assertFalse(join.is_alive())
+
+    def test_retry_dead_worker(self):
+        """
+        Tasks killing their worker, before or after their start
+        message, are retried, the other tasks are not affected
+        """
+        results, failures = self.execute(['ok', 'crash', 'early'], 1)
+        self.assertEqual(failures, [])
+        self.assertEqual(sorted(results), ['crash', 'early', 'ok'])
+        self.assert_pool_joins()
+
+    def test_failure_callback(self):
+        """
+        Failed tasks are reported with the tasks retrying them
+        """
+        reported = list()
+        self.execute(['ok', 'crash'], 1, lambda task, retried: reported.append(
+            (task.graph.name, [retry.graph.name for retry in retried])))
+        self.assertEqual(reported, [('crash', ['crash'])])
+        reported = list()
+        self.execute(['crash_again'], 0, lambda task, retried: reported.append(
+            (task.graph.name, retried)))
+        self.assertEqual(reported, [('crash_again', [])])
+
+    def test_release_blocks(self):
+        """
+        Shared memory blocks created by the tasks lost with their
+        worker are released
+        """
+        blocks = list()
+        results, failures = self.execute(['leak'], 0,
+            lambda task, retried: blocks.append(task.block), shared_memory = True)
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(len(blocks), 1)
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name = blocks[0])
+
+    def test_dead_worker_without_retries(self):
+        """
+        Tasks killing their worker fail without retries, and the
+        pool can still be joined
+        """
+        results, failures = self.execute(['ok', 'crash'], 0)
+        self.assertEqual(list(results), ['ok'])
+        self.assertEqual([task.graph.name for task, reason in failures], ['crash'])
+        self.assert_pool_joins()
+
+    def test_own_pool_dead_worker(self):
+        """
+        Workers of a pool created by the run send the start messages
+        through an inherited queue, without a manager
+        """
+        run_manager = self.run_manager(['ok', 'crash', 'early'])
+        tasks = [Task(run_manager._task_id(graph), graph, shared_memory = False) \
+                for graph in run_manager.graphs]
+        pool, manager, start_queue, inherited = run_manager._start_pool(None, 2)
+        self.assertIsNone(manager)
+        failures = list()
+        try:
+            results = [task.graph.name for task, _, _ in run_manager._execute(pool, tasks,
+                    1, False, failures, start_queue, 2, inherited_queue = inherited)]
+        finally:
+            pool.terminate()
+        self.assertEqual(failures, [])
+        self.assertEqual(sorted(results), ['crash', 'early', 'ok'])
+
+    def test_submit_dead_worker(self):
+        """
+        Futures of the tasks killing their worker are resolved
+        by the retries, or fail without retries
+        """
+        futures = self.run_manager(['ok', 'crash', 'early']).submit(2,
+            shared_memory = False, retries = 1)
+        self.assertEqual(len(wait(futures.values(), 30).not_done), 0)
+        self.assertEqual({name: future.result() for name, future in futures.items()},
+            {'ok': 1, 'crash': 1, 'early': 1})
+        futures = self.run_manager(['ok', 'crash_again']).submit(2,
+            shared_memory = False)
+        self.assertEqual(len(wait(futures.values(), 30).not_done), 0)
+        self.assertEqual(futures['ok'].result(), 1)
+        self.assertIsInstance(futures['crash_again'].exception(), RuntimeError)
+
+
+if __name__ == '__main__':
+    unittest.main()
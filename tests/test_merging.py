@@ -0,0 +1,117 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from ntuple_processor.merging import add_results
+from ntuple_processor.merging import check_binning
+from ntuple_processor.merging import merge_outputs
+
+
+class Axis:
+    def __init__(self, edges):
+        self.edges = edges
+
+    def GetNbins(self):
+        return len(self.edges) - 1
+
+    def GetBinLowEdge(self, i):
+        return self.edges[i - 1]
+
+
+class Histogram:
+    """Minimal one-dimensional histogram with the methods used
+    to check and sum the binnings
+    """
+    def __init__(self, edges, contents):
+        self.edges = edges
+        self.contents = list(contents)
+
+    def GetName(self):
+        return 'histogram'
+
+    def GetDimension(self):
+        return 1
+
+    def GetXaxis(self):
+        return Axis(self.edges)
+
+    def GetYaxis(self):
+        return Axis([0., 1.])
+
+    def GetZaxis(self):
+        return Axis([0., 1.])
+
+    def Add(self, other):
+        self.contents = [a + b for a, b in zip(self.contents, other.contents)]
+
+
+def read_json(path):
+    with open(path) as input_file:
+        return json.load(input_file)
+
+
+def write_json(results, output, compression = None, hierarchical = False):
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file)
+
+
+class TestMerging(unittest.TestCase):
+    """ Test the sums of the results of the partial outputs
+    """
+    def test_add_results(self):
+        """
+        Results are summed by name, new names are added
+        """
+        results = {'count': 1., 'histogram': Histogram([0., 1., 2.], [1., 2.])}
+        add_results(results, {'count': 2., 'other_count': 3.,
+            'histogram': Histogram([0., 1., 2.], [3., 4.])})
+        self.assertEqual(results['count'], 3.)
+        self.assertEqual(results['other_count'], 3.)
+        self.assertEqual(results['histogram'].contents, [4., 6.])
+
+    def test_check_binning(self):
+        """
+        Histograms with different edges can not be summed
+        """
+        check_binning(Histogram([0., 1., 2.], [0., 0.]), Histogram([0., 1., 2.], [0., 0.]))
+        with self.assertRaises(ValueError):
+            check_binning(Histogram([0., 1., 2.], [0., 0.]), Histogram([0., 1.5, 2.], [0., 0.]))
+
+    def test_arguments(self):
+        """
+        Invalid arguments are rejected before merging
+        """
+        with self.assertRaises(ValueError):
+            merge_outputs([], 'output.root')
+        with self.assertRaises(TypeError):
+            merge_outputs(['input.root'], 'output.root', nworkers = '2')
+        with self.assertRaises(ValueError):
+            merge_outputs(['input.root'], 'output.root', fan_in = 1)
+
+    @mock.patch('ntuple_processor.merging.write_results', write_json)
+    @mock.patch('ntuple_processor.merging.read_results', read_json)
+    def test_tree_reduction(self):
+        """
+        Many inputs are merged in several steps in parallel, the
+        temporary files are removed
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            inputs = list()
+            for i in range(10):
+                inputs.append(os.path.join(directory, 'input{}.root'.format(i)))
+                write_json({'count': float(i), 'count_{}'.format(i % 2): 1.}, inputs[-1])
+            output = os.path.join(directory, 'output.root')
+            merge_outputs(inputs, output, nworkers = 2, fan_in = 3)
+            self.assertEqual(read_json(output), {'count': 45., 'count_0': 5., 'count_1': 5.})
+            self.assertEqual(sorted(os.listdir(directory)),
+                sorted([os.path.basename(path) for path in inputs + [output]]))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
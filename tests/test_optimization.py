@@ -0,0 +1,129 @@
+import unittest
+
+from ntuple_processor.booking import Ntuple, Dataset, Selection, Cut
+from ntuple_processor.booking import Unit, Histogram, Count
+from ntuple_processor.booking import UnitProduct, CompositeDataset
+from ntuple_processor.optimization import GraphManager
+from ntuple_processor.utils import FineHistogram
+
+
+def actions(node):
+    if node.kind == 'action':
+        yield node.unit_block
+    for child in node.children:
+        for action in actions(child):
+            yield action
+
+
+class TestGraphManager(unittest.TestCase):
+    """ Test the optimizations of the graphs
+    """
+    def setUp(self):
+        self.ds = Dataset('ds', [Ntuple('path', 'directory')])
+        self.sel = Selection('sel', [Cut('cut_exp', 'cut_name')])
+
+    def optimized(self, histograms):
+        graph_manager = GraphManager([Unit(self.ds, [self.sel], histograms)])
+        graph_manager.optimize(3)
+        return list(actions(graph_manager.graphs[0]))
+
+    def test_merge_binnings(self):
+        """
+        Histograms of the same variable and range are filled once
+        with the union of their edges
+        """
+        merged = self.optimized([Histogram('coarse', 'var', [0., 2., 4.]),
+            Histogram('fine', 'var', [0., 1., 2., 3., 4.]),
+            Histogram('other_var', 'other_var', [0., 4.])])
+        self.assertEqual(len(merged), 2)
+        fine = [action for action in merged if isinstance(action, FineHistogram)][0]
+        self.assertEqual(fine.edges, (0., 1., 2., 3., 4.))
+        self.assertEqual([histogram.name for histogram in fine.histograms],
+            ['ds#sel#Nominal#coarse', 'ds#sel#Nominal#fine'])
+
+    def test_merge_binnings_ranges(self):
+        """
+        Histograms with different ranges are not merged
+        """
+        merged = self.optimized([Histogram('low', 'var', [0., 1., 2.]),
+            Histogram('high', 'var', [5., 6.])])
+        self.assertEqual([type(action) for action in merged], [Histogram, Histogram])
+
+    def test_fine_names(self):
+        """
+        Fine histograms never take the name of another action
+        """
+        merged = self.optimized([Histogram('h', 'var', [0., 2.]),
+            Histogram('h_fine', 'var', [0., 1., 2.]),
+            Histogram('h_fine2', 'other_var', [0., 2.]),
+            Histogram('other', 'other_var', [0., 1., 2.])])
+        self.assertEqual(sorted([action.name for action in merged]),
+            ['ds#sel#Nominal#h_fine2_fine', 'ds#sel#Nominal#h_fine3'])
+
+    def test_merge_ntuples(self):
+        """
+        Datasets reading the same ntuples with the same friends are
+        processed in a single graph, keeping the names of the actions
+        """
+        def ntuples(friend_path):
+            return [Ntuple('path', 'directory', [Ntuple(friend_path, 'directory', tag = 'friend')])]
+
+        units = [Unit(Dataset(name, ntuples(friend_path)), [self.sel], [Count('count', 'var')]) \
+                for name, friend_path in [('ztt', 'friend_path'), ('zl', 'friend_path'),
+                    ('zj', 'other_friend_path')]]
+        units.append(Unit(Dataset('other', [Ntuple('other_path', 'directory')]), [self.sel],
+            [Count('count', 'var')]))
+        graph_manager = GraphManager(units)
+        graph_manager.optimize(3)
+        self.assertEqual(sorted([graph.name for graph in graph_manager.graphs]),
+            ['other', 'zj', 'ztt+zl'])
+        merged = [graph for graph in graph_manager.graphs if graph.name == 'ztt+zl'][0]
+        self.assertEqual(merged.unit_block.ntuples, ntuples('friend_path'))
+        self.assertEqual(sorted([action.name for action in actions(merged)]),
+            ['zl#sel#Nominal#count', 'ztt#sel#Nominal#count'])
+
+    def test_add_units(self):
+        """
+        Units added one by one give the same graphs as optimize(2)
+        """
+        other = Dataset('other', [Ntuple('other_path', 'directory')])
+        product = UnitProduct([self.ds, other],
+            [[self.sel], [Selection(name, [Cut('{} > 0'.format(name), name)]) \
+                    for name in ['a', 'b']]],
+            [Count('count', 'var'), Histogram('m_vis', 'm_vis', [0., 50., 100.])])
+        for split_selections in [False, True]:
+            graph_manager = GraphManager(list(product.units()), split_selections)
+            graph_manager.optimize(2)
+            added = GraphManager([], split_selections)
+            self.assertEqual(added.add_units(product.units()), 4)
+            self.assertEqual(added.get_summary(100), graph_manager.get_summary(100))
+
+    def test_add_units_names(self):
+        """
+        Actions added with the name of an action already in the
+        graphs are rejected, composite datasets are not supported
+        """
+        graph_manager = GraphManager([Unit(self.ds, [self.sel], [Count('count', 'var')])])
+        with self.assertRaises(NameError):
+            graph_manager.add_units([Unit(self.ds, [self.sel], [Count('count', 'other_var')])])
+        composite = CompositeDataset('composite', [self.ds], [1.])
+        with self.assertRaises(TypeError):
+            graph_manager.add_units([Unit(composite, [self.sel], [Count('count', 'var')])])
+
+    def test_add_units_adaptive(self):
+        """
+        With adaptive splitting, the selections are collapsed
+        by optimize once all the units are added
+        """
+        common = Selection('common', [Cut('a > 0', 'a'), Cut('b > 0', 'b')])
+        units = [Unit(self.ds, [common, Selection(name, [Cut('{} > 0'.format(name), name)])],
+                [Count(name, 'var')]) for name in ['c', 'd']]
+        graph_manager = GraphManager([], 'adaptive')
+        graph_manager.add_units(units)
+        self.assertEqual(graph_manager.graphs[0].children[0].name, 'a-common')
+        graph_manager.optimize(2)
+        self.assertEqual(graph_manager.graphs[0].children[0].name, 'a-common-b-common')
+
+
+if __name__ == '__main__':
+    unittest.main()
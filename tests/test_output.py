@@ -0,0 +1,99 @@
+import unittest
+from unittest import mock
+
+from ntuple_processor import output
+from ntuple_processor.output import result_path
+from ntuple_processor.output import write_results
+
+
+class Recorder:
+    """Fake ROOT file, directories and objects recording the
+    directories changed and the objects written
+    """
+    def __init__(self):
+        self.log = list()
+
+    def TFile(self, path, mode, title = '', compression = None):
+        return Directory(self.log, '')
+
+    def TParameter(self, kind):
+        return lambda key, value: Result(self.log, (key, value))
+
+    def TObjString(self, text):
+        return Result(self.log, text.split('\n'))
+
+
+class Directory:
+    def __init__(self, log, path):
+        self.log = log
+        self.path = path
+
+    def mkdir(self, path, title, return_existing):
+        self.log.append(('mkdir', path))
+        return Directory(self.log, path)
+
+    def cd(self):
+        self.log.append(('cd', self.path))
+
+    def Close(self):
+        self.log.append(('close',))
+
+
+class Result:
+    def __init__(self, log, value = None):
+        self.log = log
+        self.value = value
+
+    def Write(self, key = None):
+        self.log.append(('write', key, self.value))
+
+
+class TestOutput(unittest.TestCase):
+    """ Test the layouts of the output files
+    """
+    def test_result_path(self):
+        """
+        Names dataset#selections#variation#action become paths,
+        the other names are kept
+        """
+        self.assertEqual(result_path('ds#sel-cat#Nominal#m_vis'), 'ds/sel-cat/Nominal/m_vis')
+        self.assertEqual(result_path('ds#sel#m_vis'), 'ds#sel#m_vis')
+        self.assertEqual(result_path('ds##Nominal#m_vis'), 'ds##Nominal#m_vis')
+        self.assertEqual(result_path('ds#sel#Nominal#m/vis'), 'ds#sel#Nominal#m/vis')
+
+    def write(self, results, hierarchical, recorder = None):
+        if recorder is None:
+            recorder = Recorder()
+        with mock.patch.object(output, 'TFile', recorder.TFile), \
+                mock.patch.object(output, 'TParameter', recorder.TParameter), \
+                mock.patch.object(output, 'TObjString', recorder.TObjString):
+            write_results(results, 'output.root', hierarchical = hierarchical)
+        return recorder.log
+
+    def test_flat(self):
+        """
+        All the results are written in the top directory
+        """
+        log = self.write({'ds#sel#Nominal#count': 2, 'other': 3.}, False)
+        self.assertEqual(log, [('cd', ''), ('write', None, ('ds#sel#Nominal#count', 2)),
+            ('cd', ''), ('write', None, ('other', 3.)), ('close',)])
+
+    def test_hierarchical(self):
+        """
+        Results are written in their directories, created once,
+        followed by the index of the names
+        """
+        recorder = Recorder()
+        results = {'ds#sel#Nominal#count': 2,
+            'ds#sel#Nominal#m_vis': Result(recorder.log, 'histogram'), 'other': 3.}
+        self.assertEqual(self.write(results, True, recorder), [
+            ('mkdir', 'ds/sel/Nominal'),
+            ('cd', 'ds/sel/Nominal'), ('write', None, ('count', 2)),
+            ('cd', 'ds/sel/Nominal'), ('write', 'm_vis', 'histogram'),
+            ('cd', ''), ('write', None, ('other', 3.)),
+            ('cd', ''), ('write', '__index__', list(results)),
+            ('close',)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from ntuple_processor.utils import GraphProfile
+from ntuple_processor.utils import RunProfile
+
+
+def graph_profile(name, entries, jit_time, loop_time, actions = ()):
+    profile = GraphProfile(name)
+    profile.entries = entries
+    profile.jit_time = jit_time
+    profile.loop_time = loop_time
+    profile.actions = list(actions)
+    return profile
+
+
+class TestProfiling(unittest.TestCase):
+    """ Test the profiles of the graphs and of the runs
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.run_profile = RunProfile()
+        self.run_profile.total_time = 10.
+        self.run_profile.add(graph_profile('fast', 100, 1., 1.,
+            [(('fast', 'sel', 'fast#sel#Nominal#count'), 50)]))
+        self.run_profile.add(graph_profile('slow', 300, 1., 5.,
+            [(('slow', 'sel;1', 'slow#sel#Nominal#count'), 300)]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_events_per_second(self):
+        """
+        Throughput includes the compilation, and is zero
+        for graphs not processed
+        """
+        self.assertEqual(graph_profile('graph', 100, 1., 4.).events_per_second, 20.)
+        self.assertEqual(GraphProfile('graph').events_per_second, 0.)
+
+    def test_json(self):
+        """
+        Graphs are sorted from the slowest, with the totals of the run
+        """
+        path = os.path.join(self.directory, 'profile.json')
+        self.run_profile.write_json(path)
+        with open(path) as profile_file:
+            profile = json.load(profile_file)
+        self.assertEqual(profile['entries'], 400)
+        self.assertEqual(profile['events_per_second'], 40.)
+        self.assertEqual([graph['name'] for graph in profile['graphs']], ['slow', 'fast'])
+        self.assertEqual(profile['graphs'][1]['actions'],
+            [{'path': ['fast', 'sel', 'fast#sel#Nominal#count'], 'entries': 50}])
+
+    def test_folded(self):
+        """
+        One line per action with the entries reaching it, without
+        separators in the names
+        """
+        path = os.path.join(self.directory, 'profile.folded')
+        self.run_profile.write_folded(path)
+        with open(path) as folded_file:
+            self.assertEqual(folded_file.read().splitlines(), [
+                'fast;sel;fast#sel#Nominal#count 50',
+                'slow;sel_1;slow#sel#Nominal#count 300'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from queue import Queue
+
+from ntuple_processor.utils._progress import ProgressMonitor
+
+
+class TestProgressMonitor(unittest.TestCase):
+    """ Test the accounting of the tasks by the progress monitor
+    """
+    def setUp(self):
+        self.queue = Queue()
+        self.monitor = ProgressMonitor(self.queue, 2)
+
+    def start(self, task_id, entries):
+        self.queue.put(('start', task_id, task_id, 1, 100, 0.))
+        self.queue.put(('progress', task_id, entries, 1.))
+
+    def test_finish(self):
+        """
+        Finished tasks count all their entries
+        """
+        self.start('task', 50)
+        self.monitor.finish('task')
+        self.assertEqual(self.monitor.running, {})
+        self.assertEqual(self.monitor.done_entries, 100)
+        self.assertEqual(self.monitor.done_tasks, 1)
+
+    def test_fail(self):
+        """
+        Failed tasks are no longer running, and are replaced
+        in the total by their retries
+        """
+        self.start('retried', 50)
+        self.monitor.fail('retried', 2)
+        self.assertEqual(self.monitor.running, {})
+        self.assertEqual(self.monitor.ntasks, 3)
+        self.start('failed', 50)
+        self.monitor.fail('failed')
+        self.assertEqual(self.monitor.running, {})
+        self.assertEqual(self.monitor.ntasks, 2)
+        self.assertEqual(self.monitor.done_entries, 0)
+        self.assertEqual(self.monitor.done_tasks, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import json
+import unittest
+
+from ntuple_processor.utils import Node
+from ntuple_processor.utils import Selection
+from ntuple_processor.utils import Cut
+from ntuple_processor.utils import Weight
+from ntuple_processor.utils import Count
+from ntuple_processor.utils import render_text
+from ntuple_processor.utils import render_dot
+from ntuple_processor.utils import render_json
+
+
+class TestRendering(unittest.TestCase):
+    """ Test the representations of the graphs
+    """
+    def setUp(self):
+        selection = Selection('sel', [Cut('pt_1 > 30', 'pt')], [Weight('weight', 'weight')])
+        actions = [Node(name, 'action', Count(name, 'var')) for name in ['a', 'b', 'c', 'd']]
+        self.graphs = [Node('ds', 'dataset', None,
+            Node('sel', 'selection', selection, *actions),
+            Node('other_sel', 'selection', Selection('other_sel'), actions[0]))]
+
+    def test_text(self):
+        """
+        Tree with the children beyond max_children summarized
+        """
+        self.assertEqual(render_text(self.graphs, max_children = 2).split('\n'), [
+            'ds',
+            '├── sel',
+            '│   ├── a',
+            '│   ├── b',
+            '│   └── ... 2 more children (2 action)',
+            '└── other_sel',
+            '    └── a'])
+
+    def test_dot(self):
+        """
+        One node per line and one edge per parent
+        """
+        lines = render_dot(self.graphs).split('\n')
+        self.assertEqual(lines[:4], ['digraph plan {', '    rankdir=LR;',
+            '    n0 [label="ds", shape=box3d];', '    n1 [label="sel", shape=box];'])
+        self.assertEqual(len([line for line in lines if '->' in line]), 7)
+        self.assertEqual(lines[-1], '}')
+
+    def test_json(self):
+        """
+        Flat list of the nodes, parents first, with the cuts,
+        the weights and the variables
+        """
+        nodes = json.loads(render_json(self.graphs))['nodes']
+        self.assertEqual([(node['id'], node['parent'], node['name']) for node in nodes], [
+            (0, None, 'ds'), (1, 0, 'sel'), (2, 1, 'a'), (3, 1, 'b'), (4, 1, 'c'),
+            (5, 1, 'd'), (6, 0, 'other_sel'), (7, 6, 'a')])
+        self.assertEqual((nodes[1]['cuts'], nodes[1]['weights']), (['pt_1 > 30'], ['weight']))
+        self.assertEqual(nodes[2]['variable'], 'var')
+
+
+if __name__ == '__main__':
+    unittest.main()
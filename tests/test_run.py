@@ -0,0 +1,148 @@
+import unittest
+from multiprocessing import Pool
+
+import numpy
+
+from ntuple_processor.run import RunManager
+from ntuple_processor.utils import Node
+from ntuple_processor.utils import Dataset
+from ntuple_processor.utils import Ntuple
+from ntuple_processor.utils import Cut
+from ntuple_processor.utils import Weight
+from ntuple_processor.utils import Selection
+from ntuple_processor.utils import Histogram
+from ntuple_processor.utils import Task
+from ntuple_processor.utils import Count
+from ntuple_processor.utils import Cutflow
+from ntuple_processor.utils import RDataFrameCutWeight
+from ntuple_processor.utils._run import rebin_cells
+from ntuple_processor.booking import Unit
+from ntuple_processor.optimization import GraphManager
+from ntuple_processor.serialization import dump_graphs
+from ntuple_processor.serialization import load_graphs
+
+
+def make_graph(cut = 'pt_1 > 30', weight = 'weight', edges = (0., 50., 100.),
+        friend = 'friend_path'):
+    ntuple = Ntuple('path', 'directory', [Ntuple(friend, 'directory')])
+    return Node('ds', 'dataset', Dataset('ds', [ntuple]),
+        Node('sel', 'selection', Selection('sel', [Cut(cut, 'cut')], [Weight(weight, 'weight')]),
+            Node('ds#sel#Nominal#m_vis', 'action',
+                Histogram('ds#sel#Nominal#m_vis', 'm_vis', list(edges)))))
+
+
+class RecordingFrame:
+    """Frame recording the filters created from it
+    """
+    def __init__(self, filters):
+        self.filters = filters
+
+    def Filter(self, expression, name):
+        self.filters.append((expression, name))
+        return RecordingFrame(self.filters)
+
+    def Count(self):
+        return None
+
+    def Sum(self, variable):
+        return None
+
+
+def fill_cells(edges, values, weights):
+    # Contents and sums of the squares of the weights of the cells,
+    # with under- and overflow
+    cell_edges = [-numpy.inf] + list(edges) + [numpy.inf]
+    return numpy.histogram(values, cell_edges, weights = weights)[0], \
+            numpy.histogram(values, cell_edges, weights = weights ** 2)[0]
+
+
+def count_filters(graphs, cut_report = False):
+    run_manager = RunManager(graphs)
+    run_manager.cut_report = cut_report
+    filters = list()
+    for graph in graphs:
+        run_manager.frame_cache[graph.unit_block] = RDataFrameCutWeight(
+            RecordingFrame(filters), dataset = graph.unit_block)
+        run_manager.node_to_root(graph)
+    return filters
+
+
+class TestRunManager(unittest.TestCase):
+    """ Test the conversion of the graphs into tasks
+    """
+    def test_task_id(self):
+        """
+        Task identifiers depend on the content of the graph,
+        not only on the names
+        """
+        run_manager = RunManager([])
+        task_id = run_manager._task_id(make_graph())
+        self.assertEqual(task_id, run_manager._task_id(make_graph()))
+        for changed in [make_graph(cut = 'pt_1 > 40'), make_graph(weight = '2 * weight'),
+                make_graph(edges = (0., 100.)), make_graph(friend = 'other_friend_path')]:
+            self.assertNotEqual(task_id, run_manager._task_id(changed))
+
+    def test_dispatch_limits(self):
+        """
+        Tasks sent to an external pool share the cores equally and
+        are limited by the size of the pool, if known
+        """
+        run_manager = RunManager([])
+        tasks = [Task('task', make_graph(), nthreads = 8)]
+        self.assertEqual(run_manager._dispatch_limits(None, tasks, True, 2, 8), (2, 8))
+        self.assertEqual(tasks[0].nthreads, 8)
+        pool = Pool(2)
+        try:
+            self.assertEqual(run_manager._dispatch_limits(pool, tasks, False, 2, 8), (2, None))
+        finally:
+            pool.terminate()
+        self.assertEqual(tasks[0].nthreads, 4)
+        self.assertEqual(run_manager._dispatch_limits(object(), tasks, False, 2, None),
+            (None, None))
+
+    def test_collapsed_filters(self):
+        """
+        Collapsed selections apply their cuts with a single filter,
+        unless every cut is reported or a cutflow needs them
+        """
+        dataset = Dataset('ds', [Ntuple('path', 'directory')])
+        common = Selection('common', [Cut('a > 0', 'a'), Cut('b > 0', 'b')])
+
+        def graphs(action):
+            units = [Unit(dataset, [common, Selection(name, [Cut('{} > 0'.format(name), name)])],
+                    [action(name)]) for name in ['c', 'd']]
+            graph_manager = GraphManager(units, 'adaptive')
+            graph_manager.optimize(2)
+            return graph_manager.graphs
+
+        filters = count_filters(graphs(lambda name: Count(name, 'var')))
+        self.assertEqual(filters, [('(a > 0) && (b > 0)', 'a-common-b-common'),
+            ('c > 0', 'c'), ('d > 0', 'd')])
+        # Also after a round trip through a cached plan
+        self.assertEqual(count_filters(load_graphs(dump_graphs(
+            graphs(lambda name: Count(name, 'var'))))), filters)
+        filters = count_filters(graphs(lambda name: Count(name, 'var')), cut_report = True)
+        self.assertEqual([name for _, name in filters], ['a', 'b', 'c', 'd'])
+        filters = count_filters(graphs(Cutflow))
+        self.assertEqual([name for _, name in filters], ['a', 'b', 'c', 'd'])
+
+    def test_rebin_cells(self):
+        """
+        Histograms derived from a fine histogram have the contents
+        and the errors of the histograms filled directly
+        """
+        generator = numpy.random.default_rng(1)
+        values = generator.uniform(-1., 5., 1000)
+        weights = generator.uniform(0.5, 2., 1000)
+        fine_edges = [0., 0.5, 1., 2., 3., 4.]
+        fine_contents, fine_sumw2 = fill_cells(fine_edges, values, weights)
+        for edges in [[0., 1., 2., 4.], [0., 0.5, 1., 3., 4.], [0., 4.]]:
+            contents, sumw2 = fill_cells(edges, values, weights)
+            self.assertTrue(numpy.allclose(
+                rebin_cells(fine_edges, edges, fine_contents), contents))
+            self.assertTrue(numpy.allclose(
+                rebin_cells(fine_edges, edges, fine_sumw2), sumw2))
+
+
+if __name__ == '__main__':
+    unittest.main()
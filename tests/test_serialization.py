@@ -0,0 +1,95 @@
+import json
+import zlib
+import unittest
+
+from ntuple_processor.booking import Ntuple, Dataset, Cut, Weight, Selection
+from ntuple_processor.booking import Unit, Count, Histogram, Cutflow
+from ntuple_processor.merging import CompositeSums
+from ntuple_processor.optimization import GraphManager
+from ntuple_processor.serialization import dump_graphs
+from ntuple_processor.serialization import load_graphs
+from ntuple_processor.serialization import configuration_key
+from ntuple_processor.variations import ReplaceCut
+
+
+def flatten(node):
+    return [node.name, node.kind, node.unit_block, [flatten(child) for child in node.children]]
+
+
+class TestSerialization(unittest.TestCase):
+    """ Test the serialized format of the graphs and
+    the keys of the cached plans
+    """
+    def setUp(self):
+        friend = Ntuple('friend_path', 'directory', tag = 'friend')
+        self.ds = Dataset('ds', [Ntuple('path', 'directory', [friend])])
+        self.sel = Selection('sel', [Cut('pt_1 > 30', 'pt')], [Weight('weight', 'weight')])
+        self.units = [Unit(self.ds, [self.sel], [Count('count', 'var'),
+            Histogram('m_vis', 'm_vis', [0., 50., 100.]), Cutflow('cutflow')])]
+
+    def graphs(self, level = 3):
+        graph_manager = GraphManager(self.units)
+        graph_manager.optimize(level)
+        return graph_manager.graphs
+
+    def test_round_trip(self):
+        """
+        Loaded graphs equal the dumped ones, with the friends
+        and the sums of the composites
+        """
+        graphs = self.graphs()
+        composites = CompositeSums()
+        composites.add('composite#sel#Nominal#count', 'ds#sel#Nominal#count', 2.)
+        loaded, loaded_composites = load_graphs(dump_graphs(graphs, composites),
+            return_composites = True)
+        self.assertEqual([flatten(graph) for graph in loaded],
+            [flatten(graph) for graph in graphs])
+        friend = loaded[0].unit_block.ntuples[0].friends[0]
+        self.assertEqual((friend.path, friend.tag), ('friend_path', 'friend'))
+        self.assertEqual(loaded_composites.sums, composites.sums)
+
+    def test_shared_blocks(self):
+        """
+        Equal blocks are stored once
+        """
+        other_units = [Unit(Dataset('other_ds', [Ntuple('other_path', 'directory')]),
+            [self.sel], [Count('count', 'var')])]
+        document = json.loads(zlib.decompress(dump_graphs(
+            GraphManager(self.units + other_units).graphs)))
+        kinds = [block[0] for block in document['body']['blocks']]
+        self.assertEqual(kinds.count('selection'), 1)
+
+    def test_corrupted(self):
+        """
+        Data with another version or modified are rejected
+        """
+        document = json.loads(zlib.decompress(dump_graphs(self.graphs())))
+        document['version'] -= 1
+        with self.assertRaises(ValueError):
+            load_graphs(zlib.compress(json.dumps(document).encode()))
+        document['version'] += 1
+        document['body']['strings'][0] += '_modified'
+        with self.assertRaises(ValueError):
+            load_graphs(zlib.compress(json.dumps(document).encode()))
+
+    def test_configuration_key(self):
+        """
+        Keys depend on the units, the variations and the options
+        """
+        key = configuration_key(self.units)
+        self.assertEqual(key, configuration_key([Unit(
+            Dataset('ds', [Ntuple('path', 'directory', [Ntuple('friend_path', 'directory',
+                tag = 'friend')])]),
+            [Selection('sel', [Cut('pt_1 > 30', 'pt')], [Weight('weight', 'weight')])],
+            [Count('count', 'var'), Histogram('m_vis', 'm_vis', [0., 50., 100.]),
+                Cutflow('cutflow')])]))
+        self.assertNotEqual(key, configuration_key(self.units, level = 3))
+        self.assertNotEqual(key, configuration_key(self.units, split_selections = True))
+        self.assertNotEqual(key, configuration_key(self.units,
+            [ReplaceCut('tight', 'pt', Cut('pt_1 > 40', 'pt'))]))
+        self.sel.add_cut('eta_1 < 2.1', 'eta')
+        self.assertNotEqual(key, configuration_key(self.units))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import socket
+import shutil
+import tempfile
+import unittest
+from multiprocessing import current_process
+
+from ntuple_processor.service import serve
+
+
+class TestService(unittest.TestCase):
+    """ Test the start of the worker service
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, 'service.sock')
+        self.authkey = current_process().authkey
+
+    def tearDown(self):
+        current_process().authkey = self.authkey
+        shutil.rmtree(self.directory)
+
+    def test_address_in_use(self):
+        """
+        The socket of a running service is not taken over
+        """
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.address)
+        listener.listen(1)
+        try:
+            with self.assertRaises(RuntimeError):
+                serve(1, self.address, authkey = b'key')
+            self.assertTrue(os.path.exists(self.address))
+        finally:
+            listener.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
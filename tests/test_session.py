@@ -0,0 +1,71 @@
+import unittest
+
+from ntuple_processor.booking import Ntuple, Dataset, Cut, Selection
+from ntuple_processor.booking import Unit, Count
+from ntuple_processor.session import Session
+from ntuple_processor.utils import RDataFrameCutWeight
+
+
+class Pointer:
+    def __init__(self, value):
+        self.value = value
+
+    def GetValue(self):
+        return self.value
+
+
+class RecordingFrame:
+    """Frame recording the filters created from it, whose sums
+    are the number of filters applied
+    """
+    def __init__(self, filters, depth = 0):
+        self.filters = filters
+        self.depth = depth
+
+    def Filter(self, expression, name):
+        self.filters.append(name)
+        return RecordingFrame(self.filters, self.depth + 1)
+
+    def Sum(self, variable):
+        return Pointer(self.depth)
+
+
+class TestSession(unittest.TestCase):
+    """ Test the reuse of the operations booked in a session
+    """
+    def setUp(self):
+        self.ds = Dataset('ds', [Ntuple('path', 'directory')])
+        self.sel = Selection('sel', [Cut('a > 0', 'a')])
+        self.filters = list()
+        self.session = Session()
+        self.session.frame_cache[self.ds] = RDataFrameCutWeight(
+            RecordingFrame(self.filters), dataset = self.ds)
+
+    def test_reuse_filters(self):
+        """
+        Filters booked by previous units are reused, only the
+        new actions are executed
+        """
+        self.session.book([Unit(self.ds, [self.sel], [Count('count', 'var')])])
+        self.assertEqual(self.session.run(), {'ds#sel#Nominal#count': 1})
+        other_sel = Selection('other_sel', [Cut('b > 0', 'b')])
+        self.session.book([Unit(self.ds, [self.sel, other_sel], [Count('count', 'var')])])
+        self.assertEqual(self.filters, ['a', 'b'])
+        self.assertEqual(self.session.get('ds#sel-other_sel#Nominal#count'), 2)
+        self.assertEqual(self.session.run(), {})
+        self.assertEqual(len(self.session.results), 2)
+
+    def test_booked_twice(self):
+        """
+        Actions can not be booked twice, unknown actions are not found
+        """
+        unit = Unit(self.ds, [self.sel], [Count('count', 'var')])
+        self.session.book([unit])
+        with self.assertRaises(NameError):
+            self.session.book([unit])
+        with self.assertRaises(NameError):
+            self.session.get('ds#sel#Nominal#other_count')
+
+
+if __name__ == '__main__':
+    unittest.main()
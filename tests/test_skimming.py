@@ -0,0 +1,134 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from ntuple_processor.skimming import SkimCache
+from ntuple_processor.utils import Node
+from ntuple_processor.utils import Dataset
+from ntuple_processor.utils import Ntuple
+from ntuple_processor.utils import Cut
+from ntuple_processor.utils import Weight
+from ntuple_processor.utils import Selection
+from ntuple_processor.utils import Count
+from ntuple_processor.utils import Cutflow
+
+
+class TestSkimCache(unittest.TestCase):
+    """ Test the choice of the skims and their eviction,
+    without the event loops writing them
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ntuple = Ntuple(os.path.join(self.directory, 'ntuple.root'), 'tree')
+        with open(self.ntuple.path, 'w') as ntuple_file:
+            ntuple_file.write('not a ROOT file')
+        stat = os.stat(self.ntuple.path)
+        with open(os.path.join(self.directory, 'schemas.json'), 'w') as schema_file:
+            json.dump({'{}:tree'.format(self.ntuple.path): {
+                'stamp': [stat.st_mtime, stat.st_size],
+                'branches': ['pt_1', 'eta_1', 'm_vis', 'weight', 'unused']}}, schema_file)
+        self.dataset = Dataset('ds', [self.ntuple])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def graph(self, action = None):
+        if action is None:
+            action = Count('count', 'm_vis')
+        return Node('ds', 'dataset', self.dataset,
+            Node('sel', 'selection', Selection('sel', [Cut('pt_1 > 30', 'pt')],
+                    [Weight('weight', 'weight')]),
+                Node('eta', 'selection', Selection('eta', [Cut('abs(eta_1) < 2.1', 'eta')]),
+                    Node(action.name, 'action', action))))
+
+    def write_skim(self, skim_cache, node):
+        # Skim as written by book and commit after the event loop
+        entry = {
+            'selection': skim_cache._selection_key(node.unit_block),
+            'columns': skim_cache._columns(self.dataset, node),
+            'inputs': [skim_cache._input_key(self.ntuple)],
+            'dataset': self.dataset.name,
+            'node': node.name,
+            'file': 'skim.root'}
+        temp_path = os.path.join(self.directory, '.skim.root.tmp')
+        open(temp_path, 'w').close()
+        skim_cache.commit([(entry, temp_path, None)])
+
+    def test_skimmable(self):
+        """
+        Only selections with cuts, chosen for skimming and without
+        a cutflow below them are skimmed
+        """
+        skim_cache = SkimCache(self.directory)
+        self.assertTrue(skim_cache.skimmable(self.graph().children[0]))
+        self.assertFalse(skim_cache.skimmable(self.graph(Cutflow('cutflow')).children[0]))
+        self.assertFalse(skim_cache.skimmable(Node('sel', 'selection',
+            Selection('sel', weights = [Weight('weight', 'weight')]))))
+        self.assertFalse(SkimCache(self.directory, ['other']).skimmable(
+            self.graph().children[0]))
+
+    def test_columns(self):
+        """
+        Skims keep only the branches used below the selection
+        """
+        skim_cache = SkimCache(self.directory)
+        self.assertEqual(skim_cache._columns(self.dataset, self.graph().children[0]),
+            ['eta_1', 'm_vis', 'weight'])
+
+    def test_redirect(self):
+        """
+        Selections with a complete skim read it without their cuts,
+        keeping their weights
+        """
+        skim_cache = SkimCache(self.directory)
+        self.assertEqual(skim_cache.redirect([self.graph()])[0].name, 'ds')
+        self.write_skim(skim_cache, self.graph().children[0])
+        graphs = skim_cache.redirect([self.graph()])
+        self.assertEqual([graph.name for graph in graphs], ['ds>sel'])
+        self.assertEqual(graphs[0].unit_block.ntuples,
+            [Ntuple(os.path.join(self.directory, 'skim.root'), 'ntuple')])
+        selection = graphs[0].children[0].unit_block
+        self.assertEqual((selection.cuts, [weight.expression for weight in selection.weights]),
+            ([], ['weight']))
+        self.assertEqual(graphs[0].children[0].children[0].name, 'eta')
+
+    def test_stale(self):
+        """
+        Skims of changed inputs are not used and are evicted
+        """
+        skim_cache = SkimCache(self.directory)
+        self.write_skim(skim_cache, self.graph().children[0])
+        self.assertEqual(len(skim_cache.entries()), 1)
+        with open(self.ntuple.path, 'a') as ntuple_file:
+            ntuple_file.write(' anymore')
+        stat = os.stat(self.ntuple.path)
+        skim_cache.schema_cache.schemas['{}:tree'.format(self.ntuple.path)]['stamp'] = \
+            [stat.st_mtime, stat.st_size]
+        self.assertEqual(skim_cache.redirect([self.graph()])[0].name, 'ds')
+        skim_cache.evict()
+        self.assertEqual(skim_cache.entries(), [])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'skim.root')))
+
+    def test_max_size(self):
+        """
+        Least recently used skims beyond max_size are evicted
+        """
+        skim_cache = SkimCache(self.directory, max_size = 0)
+        self.write_skim(skim_cache, self.graph().children[0])
+        # Empty skims fit
+        skim_cache.evict()
+        self.assertEqual(len(skim_cache.entries()), 1)
+        meta = skim_cache.entries()[0]['meta']
+        with open(meta) as meta_file:
+            entry = json.load(meta_file)
+        entry['size'] = 4
+        with open(meta, 'w') as meta_file:
+            json.dump(entry, meta_file)
+        skim_cache.evict()
+        self.assertEqual(skim_cache.entries(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+from time import sleep
+
+from ntuple_processor.staging import StagingArea
+
+
+class ThrottledStagingArea(StagingArea):
+    """Staging area reading from a slow file system."""
+    def copy_file(self, source, destination):
+        sleep(0.05)
+        StagingArea.copy_file(self, source, destination)
+
+
+class TestStaging(unittest.TestCase):
+    """ Test the staging of the input files
+    with a local directory as remote storage
+    """
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.remote = os.path.join(self.base, 'remote')
+        self.local = os.path.join(self.base, 'local')
+        os.makedirs(self.remote)
+        self.paths = list()
+        for i in range(3):
+            path = os.path.join(self.remote, 'ntuple_{}.root'.format(i))
+            with open(path, 'wb') as ntuple:
+                ntuple.write(os.urandom(1000))
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def test_prefetch(self):
+        """
+        Files of the upcoming groups are copied, the ones of the
+        skipped groups are read in place
+        """
+        staging = ThrottledStagingArea(self.local)
+        staging.start([(i, [path]) for i, path in enumerate(self.paths)], skip = 1)
+        staging.wait()
+        self.assertEqual(staging.local_path(self.paths[0]), self.paths[0])
+        for path in self.paths[1:]:
+            local = staging.local_path(path)
+            self.assertNotEqual(local, path)
+            with open(local, 'rb') as copy, open(path, 'rb') as source:
+                self.assertEqual(copy.read(), source.read())
+
+    def test_budget(self):
+        """
+        Least recently used copies of released groups make room
+        for the next files
+        """
+        staging = ThrottledStagingArea(self.local, max_size = 2500, nthreads = 1)
+        staging.start([(i, [path]) for i, path in enumerate(self.paths)])
+        sleep(0.3)
+        self.assertEqual(staging.local_path(self.paths[2]), self.paths[2])
+        staging.release(0)
+        staging.wait()
+        self.assertEqual(staging.local_path(self.paths[0]), self.paths[0])
+        self.assertNotEqual(staging.local_path(self.paths[2]), self.paths[2])
+
+    def test_modified_source(self):
+        """
+        Copies of modified files are not used
+        """
+        staging = StagingArea(self.local)
+        staging.start([(0, self.paths)])
+        staging.wait()
+        with open(self.paths[0], 'ab') as ntuple:
+            ntuple.write(b'more')
+        self.assertEqual(staging.local_path(self.paths[0]), self.paths[0])
+        self.assertNotEqual(staging.local_path(self.paths[1]), self.paths[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
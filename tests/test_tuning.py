@@ -0,0 +1,81 @@
+import heapq
+import random
+import unittest
+
+from ntuple_processor.utils import plan_workers_threads
+from ntuple_processor.utils import share_threads
+
+
+def simulate(durations, max_threads, nworkers, cores):
+    """Dispatch the tasks in order to nworkers workers as
+    RunManager._execute does, and return the threads of every task
+    with the largest number of threads used at the same time.
+    """
+    waiting = list(range(len(durations)))
+    running = list()
+    nthreads = dict()
+    now = 0.
+    peak = 0
+    while waiting or running:
+        while waiting and len(running) < nworkers:
+            task = waiting.pop(0)
+            nthreads[task] = share_threads(max_threads[task], cores,
+                sum([nthreads[other] for _, other in running]),
+                min(nworkers - len(running), len(waiting) + 1))
+            heapq.heappush(running, (now + durations[task], task))
+        peak = max(peak, sum([nthreads[task] for _, task in running]))
+        # Workers finishing at the same time are free at once
+        now, task = heapq.heappop(running)
+        while running and running[0][0] == now:
+            heapq.heappop(running)
+    return [nthreads[task] for task in range(len(durations))], peak
+
+
+class TestTuning(unittest.TestCase):
+    """ Test the choice of the number of workers and
+    threads of the tasks
+    """
+    def test_plan(self):
+        """
+        Workers limited by the tasks, the cores and the memory
+        """
+        self.assertEqual(plan_workers_threads([1.] * 4, cores = 8,
+            memory = 64 * 1024**3)[0], 4)
+        self.assertEqual(plan_workers_threads([1.] * 20, cores = 8,
+            memory = 64 * 1024**3)[0], 8)
+        self.assertEqual(plan_workers_threads([1.] * 20, cores = 8,
+            memory = 6 * 1024**3)[0], 3)
+        self.assertEqual(plan_workers_threads([1.] * 20, nthreads = 2,
+            cores = 8, memory = 64 * 1024**3), (4, [2] * 20))
+
+    def test_no_oversubscription(self):
+        """
+        Tasks running at the same time never use more threads
+        than the cores, whatever their durations
+        """
+        generator = random.Random(1)
+        for ntasks, nworkers, cores in [(4, 4, 8), (8, 8, 8), (8, 4, 8),
+                (13, 3, 16), (30, 5, 12)]:
+            for trial in range(50):
+                nworkers, max_threads = plan_workers_threads([1.] * ntasks,
+                    nworkers, cores = cores, memory = 64 * 1024**3)
+                durations = [generator.uniform(1., 10.) for i in range(ntasks)]
+                nthreads, peak = simulate(durations, max_threads, nworkers, cores)
+                self.assertLessEqual(peak, cores)
+                for task_nthreads, task_max_threads in zip(nthreads, max_threads):
+                    self.assertLessEqual(task_nthreads, task_max_threads)
+
+    def test_idle_cores(self):
+        """
+        The last task, started when most of the others are done,
+        uses the cores left idle
+        """
+        nworkers, max_threads = plan_workers_threads([1.] * 5, 4,
+            cores = 8, memory = 64 * 1024**3)
+        nthreads, peak = simulate([1., 1., 1., 5., 2.], max_threads, nworkers, 8)
+        self.assertEqual(nthreads, [2, 2, 2, 2, 6])
+        self.assertEqual(peak, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
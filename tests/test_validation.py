@@ -0,0 +1,101 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from ntuple_processor.utils import Ntuple
+from ntuple_processor.validation import referenced_identifiers
+from ntuple_processor.validation import SchemaCache
+
+
+class TestReferencedIdentifiers(unittest.TestCase):
+    """ Test the extraction of the columns used by the expressions
+    """
+    def test_functions(self):
+        """
+        Functions, also in namespaces, are not columns
+        """
+        self.assertEqual(referenced_identifiers('std::abs(eta_1) < 2.1'), {'eta_1'})
+        self.assertEqual(referenced_identifiers('ROOT::VecOps::Sum(jpt > 30) >= 2'), {'jpt'})
+        self.assertEqual(referenced_identifiers('sqrt (pt_1*pt_1)'), {'pt_1'})
+
+    def test_member_access(self):
+        """
+        Members are not columns, the objects are
+        """
+        self.assertEqual(referenced_identifiers('jets.size() > 2'), {'jets'})
+        self.assertEqual(referenced_identifiers('p4.Pt() > p4->M'), {'p4'})
+        self.assertEqual(referenced_identifiers('muon->pt > 20'), {'muon'})
+
+    def test_literals(self):
+        """
+        Numbers with suffixes or exponents, keywords and strings
+        are not columns
+        """
+        self.assertEqual(referenced_identifiers('x > 1e5 && y < 2.5f && z != 0x1F'),
+            {'x', 'y', 'z'})
+        self.assertEqual(referenced_identifiers('flag == true || njets > 10ULL'),
+            {'flag', 'njets'})
+        self.assertEqual(referenced_identifiers('name == "pt_1 > 30 \\" other"'), {'name'})
+
+    def test_ternary(self):
+        """
+        Both branches of a ternary operator are columns,
+        also without spaces
+        """
+        self.assertEqual(referenced_identifiers('q_1 > 0 ? pt_1 : pt_2'),
+            {'q_1', 'pt_1', 'pt_2'})
+        self.assertEqual(referenced_identifiers('q_1>0?pt_1:pt_2'),
+            {'q_1', 'pt_1', 'pt_2'})
+
+
+class TestSchemaCache(unittest.TestCase):
+    """ Test the cache of the branches of the trees
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'schemas.json')
+        self.ntuple = Ntuple(os.path.join(self.directory, 'ntuple.root'), 'tree')
+        with open(self.ntuple.path, 'w') as ntuple_file:
+            ntuple_file.write('not a ROOT file')
+        stat = os.stat(self.ntuple.path)
+        with open(self.path, 'w') as schema_file:
+            json.dump({'{}:tree'.format(self.ntuple.path): {
+                'stamp': [stat.st_mtime, stat.st_size],
+                'branches': ['pt_1', 'eta_1']}}, schema_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cached(self):
+        """
+        Branches of unchanged files are read from the cache
+        """
+        self.assertEqual(SchemaCache(self.path).branches(self.ntuple), {'pt_1', 'eta_1'})
+
+    def test_changed(self):
+        """
+        Changed files are read again
+        """
+        with open(self.ntuple.path, 'a') as ntuple_file:
+            ntuple_file.write(' anymore')
+        with self.assertRaises(FileNotFoundError):
+            SchemaCache(self.path).branches(self.ntuple)
+
+    def test_corrupted(self):
+        """
+        A corrupted cache is replaced by an empty one, saved
+        only if changed
+        """
+        with open(self.path, 'w') as schema_file:
+            schema_file.write('{')
+        schema_cache = SchemaCache(self.path)
+        self.assertEqual(schema_cache.schemas, {})
+        os.remove(self.path)
+        schema_cache.save()
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
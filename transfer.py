@@ -0,0 +1,167 @@
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
+import uuid
+
+import numpy
+
+from .utils import root_array
+
+from ROOT import gROOT
+gROOT.SetBatch(True)
+from ROOT import TH1D
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class SharedResults:
+    """Compact descriptor of the results of a task whose histograms
+    are stored in a shared memory block, sent back from a worker in
+    place of the pickled histograms.
+
+    The block contains, for every histogram, the bin contents
+    (including under- and overflow) followed by the sum of the
+    squares of the weights, if the histogram has them.
+
+    Attributes:
+        block (str): Name of the shared memory block
+        histograms (list): List of dictionaries describing every
+            histogram and its position in the block
+        objects (dict): Dictionary {name: result} of the results
+            not stored in the block, e.g. the values of Count actions
+    """
+    def __init__(self, block, histograms, objects):
+        self.block = block
+        self.histograms = histograms
+        self.objects = objects
+
+    def __len__(self):
+        return len(self.histograms) + len(self.objects)
+
+
+def new_block_name():
+    """Unique name of a shared memory block, chosen by the main process
+    so that it can release the blocks never unpacked (see release_blocks).
+    """
+    return 'ntp_{}'.format(uuid.uuid4().hex[:24])
+
+
+def release_blocks(names):
+    """Unlink the shared memory blocks still existing among names,
+    e.g. the ones created by tasks whose results were never unpacked
+    because the task was considered lost or the run failed.
+
+    Args:
+        names (iterable): Names of the shared memory blocks
+
+    Returns:
+        released (int): Number of blocks unlinked
+    """
+    released = 0
+    for name in names:
+        try:
+            block = shared_memory.SharedMemory(name = name)
+        except FileNotFoundError:
+            continue
+        block.close()
+        block.unlink()
+        released += 1
+    return released
+
+
+def pack_results(results, block_name = None):
+    """Move the TH1D objects in results to a new shared memory block.
+
+    Args:
+        results (dict): Dictionary {name: result} produced by a task
+        block_name (str): Name of the shared memory block, chosen
+            by the main process, a random name if None
+
+    Returns:
+        shared_results (SharedResults): Descriptor of the results
+    """
+    histograms = list()
+    objects = dict()
+    size = 0
+    for name, result in results.items():
+        if isinstance(result, TH1D):
+            ncells = result.GetNcells()
+            has_sumw2 = result.GetSumw2N() > 0
+            histograms.append((name, result, ncells, has_sumw2, size))
+            size += ncells * (2 if has_sumw2 else 1)
+        else:
+            objects[name] = result
+    if not histograms:
+        return SharedResults(None, list(), objects)
+    block = shared_memory.SharedMemory(name = block_name, create = True,
+        size = size * 8)
+    # The main process is in charge of releasing the block
+    resource_tracker.unregister(block._name, 'shared_memory')
+    buffer = numpy.ndarray((size,), dtype = numpy.float64, buffer = block.buf)
+    descriptors = list()
+    for name, histogram, ncells, has_sumw2, offset in histograms:
+        buffer[offset:offset + ncells] = root_array(histogram.GetArray(), ncells)
+        if has_sumw2:
+            buffer[offset + ncells:offset + 2 * ncells] = root_array(
+                histogram.GetSumw2().GetArray(), ncells)
+        axis = histogram.GetXaxis()
+        stats = numpy.zeros(4)
+        histogram.GetStats(stats)
+        descriptors.append({
+            'name': name,
+            'title': histogram.GetTitle(),
+            'edges': [axis.GetBinLowEdge(i) for i in range(1, axis.GetNbins() + 2)],
+            'offset': offset,
+            'ncells': ncells,
+            'sumw2': has_sumw2,
+            'entries': histogram.GetEntries(),
+            'stats': stats.tolist(),
+            # Bin labels, e.g. of the cutflows
+            'labels': [axis.GetBinLabel(i) for i in range(1, axis.GetNbins() + 1)] \
+                    if axis.GetLabels() else None})
+    del buffer
+    block.close()
+    return SharedResults(block.name, descriptors, objects)
+
+
+def unpack_results(shared_results):
+    """Rebuild the results from the descriptor produced by a worker
+    and release the shared memory block.
+
+    Args:
+        shared_results (SharedResults): Descriptor of the results
+
+    Returns:
+        results (dict): Dictionary {name: result}
+    """
+    results = dict(shared_results.objects)
+    if shared_results.block is None:
+        return results
+    block = shared_memory.SharedMemory(name = shared_results.block)
+    try:
+        buffer = numpy.ndarray((block.size // 8,), dtype = numpy.float64,
+            buffer = block.buf)
+        for descriptor in shared_results.histograms:
+            edges = numpy.array(descriptor['edges'], dtype = numpy.float64)
+            histogram = TH1D(descriptor['name'], descriptor['title'],
+                len(edges) - 1, edges)
+            histogram.SetDirectory(0)
+            if descriptor['labels'] is not None:
+                for i, label in enumerate(descriptor['labels']):
+                    histogram.GetXaxis().SetBinLabel(i + 1, label)
+            offset = descriptor['offset']
+            ncells = descriptor['ncells']
+            root_array(histogram.GetArray(), ncells)[:] = buffer[offset:offset + ncells]
+            if descriptor['sumw2']:
+                histogram.Sumw2()
+                root_array(histogram.GetSumw2().GetArray(), ncells)[:] = \
+                        buffer[offset + ncells:offset + 2 * ncells]
+            histogram.PutStats(numpy.array(descriptor['stats'], dtype = numpy.float64))
+            histogram.SetEntries(descriptor['entries'])
+            results[descriptor['name']] = histogram
+        del buffer
+    finally:
+        block.close()
+        block.unlink()
+    return results
@@ -1,17 +1,40 @@
 from ._booking import Ntuple
 from ._booking import Dataset
+from ._booking import CompositeDataset
 from ._booking import Cut
 from ._booking import Weight
 from ._booking import Selection
+from ._booking import JoinedSelection
 from ._booking import Action
 from ._booking import Count
+from ._booking import Cutflow
 from ._booking import Histogram
+from ._booking import FineHistogram
 
 from ._optimization import Node
 
 from ._run import RDataFrameCutWeight
+from ._run import Task
+from ._run import CutflowResult
+from ._run import RebinnedResult
+from ._run import root_array
+
+from ._profiling import GraphProfile
+from ._profiling import RunProfile
+
+from ._progress import ProgressMonitor
+from ._progress import ProgressReporter
+
+from ._tuning import estimate_cost
+from ._tuning import plan_workers_threads
+from ._tuning import share_threads
+from ._tuning import available_cores
 
 from ._printing import Node as PrintedNode
 from ._printing import drawTree2
 
+from ._rendering import render_text
+from ._rendering import render_dot
+from ._rendering import render_json
+
 from ._variations import Variation
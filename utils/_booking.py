@@ -1,16 +1,39 @@
+from weakref import WeakValueDictionary
+
 import logging
 logger = logging.getLogger(__name__)
 
 
 
-class Ntuple:
+class _Frozen:
+    """Base class of the objects whose attributes entering the
+    hash can be set only once, so that the hash can be cached.
+    """
+    __slots__ = ()
+    _frozen = ()
+
+    def __setattr__(self, name, value):
+        if name in self._frozen and hasattr(self, name):
+            raise AttributeError('{} of {} can not be changed'.format(
+                name, type(self).__name__))
+        object.__setattr__(self, name, value)
+
+
+class Ntuple(_Frozen):
+    """Path and directory of a TTree, with its friends. Path and
+    directory can not be changed, while the tag of a friend can be
+    set later since it does not enter the comparison.
+    """
+    __slots__ = ('path', 'directory', 'friends', 'tag', '_hash')
+    _frozen = ('path', 'directory')
+
     def __init__(self, path, directory,
             friends = None, tag = None):
         self.path = path
         self.directory = directory
-        if friends is not None:
-            self.friends = friends
+        self.friends = friends if friends is not None else list()
         self.tag = tag
+        self._hash = hash((path, directory))
 
     def __str__(self):
         if self.tag is None:
@@ -21,12 +44,12 @@ class Ntuple:
         return layout
 
     def __eq__(self, other):
-        return self.path == other.path and \
-            self.directory == other.directory
+        return self is other or (
+            self.path == other.path and \
+            self.directory == other.directory)
 
     def __hash__(self):
-        return hash((
-            self.path, self.directory))
+        return self._hash
 
 
 class Dataset:
@@ -53,22 +76,91 @@ class Dataset:
             self.name, tuple(self.ntuples)))
 
 
-class Operation:
+class CompositeDataset(Dataset):
+    """Sum of other datasets, e.g. a group of backgrounds. The units
+    booked with a composite dataset are replaced by units of its
+    components, processed as any other unit, and the results of the
+    composite are the sums of the results of the components, each one
+    multiplied by its scale factor.
+
+    Args:
+        name (str): Name of the composite dataset
+        components (list): List of Dataset (or CompositeDataset) objects
+        scale_factors (list): Scale factor of each component, 1 if None
+    """
+    def __init__(self, name, components, scale_factors = None):
+        Dataset.__init__(self, name, list())
+        if scale_factors is None:
+            scale_factors = [1.] * len(components)
+        if len(scale_factors) != len(components):
+            raise ValueError('one scale factor is needed for each component')
+        self.components = list(components)
+        self.scale_factors = list(scale_factors)
+
+    def __str__(self):
+        return 'CompositeDataset-{}'.format(self.name)
+
+    def __eq__(self, other):
+        return isinstance(other, CompositeDataset) and \
+            self.name == other.name and \
+            self.components == other.components and \
+            self.scale_factors == other.scale_factors
+
+    def __hash__(self):
+        return hash((self.name, tuple(self.components)))
+
+    def leaves(self, scale_factor = 1.):
+        """Pairs (dataset, scale factor) of the datasets summed,
+        expanding the nested composite datasets.
+        """
+        for component, component_factor in zip(self.components, self.scale_factors):
+            if isinstance(component, CompositeDataset):
+                for leaf in component.leaves(scale_factor * component_factor):
+                    yield leaf
+            else:
+                yield component, scale_factor * component_factor
+
+
+class Operation(_Frozen):
+    """Immutable expression with a name. Equal operations are
+    interned: creating the same cut or weight twice returns the
+    same object, shared by all the selections using it.
+    """
+    __slots__ = ('expression', 'name', '_hash', '__weakref__')
+    _frozen = ('expression', 'name', '_hash')
+    _interned = WeakValueDictionary()
+
+    def __new__(cls, expression, name):
+        key = (cls, expression, name)
+        operation = Operation._interned.get(key)
+        if operation is None:
+            operation = object.__new__(cls)
+            operation.expression = expression
+            operation.name = name
+            operation._hash = hash((expression, name))
+            Operation._interned[key] = operation
+        return operation
+
     def __init__(
             self, expression, name):
-        self.expression = expression
-        self.name = name
+        # Attributes set once by __new__
+        pass
+
+    def __reduce__(self):
+        return (type(self), (self.expression, self.name))
 
     def __eq__(self, other):
-        return self.expression == other.expression and \
-            self.name == other.name
+        return self is other or (
+            self.expression == other.expression and \
+            self.name == other.name)
 
     def __hash__(self):
-        return hash((
-            self.expression, self.name))
+        return self._hash
 
 
 class Cut(Operation):
+    __slots__ = ()
+
     def __str__(self):
         return 'Cut(' + self.name \
                 + ', ' + self.expression \
@@ -79,6 +171,8 @@ class Cut(Operation):
 
 
 class Weight(Operation):
+    __slots__ = ()
+
     def __str__(self):
         return 'Weight(' + self.name \
                 + ', ' + self.expression \
@@ -88,11 +182,18 @@ class Weight(Operation):
         return self.__str__()
 
     def square(self):
-        self.name = self.name + '^2'
-        self.expression = '({0:})*({0:})'.format(self.expression)
+        """New weight with the square of the expression."""
+        return Weight('({0:})*({0:})'.format(self.expression),
+            self.name + '^2')
 
 
 class Selection:
+    """Named set of cuts and weights, stored as lists which can be
+    changed in place: the hash is computed at every call from the
+    cuts and the weights, whose hashes are cached.
+    """
+    __slots__ = ('name', 'cuts', 'weights')
+
     def __init__(
             self, name = None,
             cuts = None, weights = None):
@@ -104,8 +205,9 @@ class Selection:
         return 'Selection-{}'.format(self.name)
 
     def __eq__(self, other):
-        return self.cuts == other.cuts and \
-            self.weights == other.weights
+        return self is other or (
+            self.cuts == other.cuts and \
+            self.weights == other.weights)
 
     def __hash__(self):
         return hash((tuple(self.cuts), tuple(self.weights)))
@@ -131,45 +233,58 @@ class Selection:
             weight_expression, weight_name))
 
     def remove_cut(self, cut_name):
-        for cut in self.cuts:
-            if cut.name is cut_name:
-                self.cuts.remove(cut)
+        self.cuts[:] = [cut for cut in self.cuts \
+                if cut.name != cut_name]
 
     def remove_weight(self, weight_name):
-        for weight in self.weights:
-            if weight.name is weight_name:
-                self.weights.remove(weight)
+        self.weights[:] = [weight for weight in self.weights \
+                if weight.name != weight_name]
 
     def set_cuts(self, cuts):
-        self.cuts = list()
+        l_cuts = list()
         if cuts is not None:
-            if isinstance(cuts, list):
+            if isinstance(cuts, (list, tuple)):
                 for cut in cuts:
                     if isinstance(cut, Cut):
-                        self.cuts.append(cut)
+                        l_cuts.append(cut)
                     elif isinstance(cut, tuple):
-                        self.cuts.append(Cut(*cut))
+                        l_cuts.append(Cut(*cut))
                     else:
                         raise TypeError('not a Cut object or tuple')
             else:
                 raise TypeError('a list is needed')
+        self.cuts = l_cuts
 
     def set_weights(self, weights):
-        self.weights = list()
+        l_weights = list()
         if weights is not None:
-            if isinstance(weights, list):
+            if isinstance(weights, (list, tuple)):
                 for weight in weights:
                     if isinstance(weight, Weight):
-                        self.weights.append(weight)
+                        l_weights.append(weight)
                     elif isinstance(weight, tuple):
-                        self.weights.append(Weight(*weight))
+                        l_weights.append(Weight(*weight))
                     else:
                         raise TypeError('not a Weight object or tuple')
             else:
                 raise TypeError('a list is needed')
+        self.weights = l_weights
+
+
+class JoinedSelection(Selection):
+    """Selection whose cuts are applied by a single filter, the
+    conjunction of all of them, instead of one filter per cut: used
+    for the chains of selection nodes collapsed by the optimization,
+    whose intermediate filters are not shared with other nodes. It is
+    equal to the Selection with the same cuts and weights.
+    """
+    __slots__ = ()
+
 
+class Action(_Frozen):
+    __slots__ = ('name', 'variable')
+    _frozen = ('name', 'variable')
 
-class Action:
     def __init__(self,
             name, variable):
         self.name = name
@@ -178,22 +293,86 @@ class Action:
     def __str__(self):
         return  self.name
 
+    def __eq__(self, other):
+        return self is other or (
+            type(self) is type(other) and \
+            self.name == other.name and \
+            self.variable == other.variable)
+
+    def __hash__(self):
+        return hash((type(self).__name__, self.name, self.variable))
+
 
 class Count(Action):
-    pass
+    __slots__ = ()
+
+
+class Cutflow(Action):
+    """Weighted and unweighted number of entries before the cuts
+    of the unit and after each of them, in the order in which they
+    are applied, stored as a single histogram with a labeled bin
+    per cut: the first half of the bins holds the weighted counts,
+    the second half the unweighted ones.
+    """
+    __slots__ = ()
+
+    def __init__(self, name):
+        Action.__init__(self, name, None)
+
+    def __eq__(self, other):
+        return isinstance(other, Cutflow) and \
+            self.name == other.name
+
+    def __hash__(self):
+        return hash((self.name, 'cutflow'))
 
 
 class Histogram(Action):
+    __slots__ = ('edges', '_hash')
+    _frozen = ('name', 'variable', 'edges', '_hash')
+
     def __init__(
             self, name,
             variable, edges):
         Action.__init__(self, name, variable)
-        self.edges = edges
+        self.edges = tuple(edges)
+        self._hash = hash((name, variable, self.edges))
 
     def __eq__(self, other):
-        return self.name == other.name and \
+        return self is other or (
+            isinstance(other, Histogram) and \
+            self.name == other.name and \
+            self.variable == other.variable and \
+            self.edges == other.edges)
+
+    def __hash__(self):
+        return self._hash
+
+
+class FineHistogram(Action):
+    """Histogram of a variable filled with the union of the bin edges
+    of several histograms booked with the same selection and weight;
+    each of them is derived from it by summing its bins, which is exact
+    since its edges are a subset of the fine ones.
+    """
+    __slots__ = ('edges', 'histograms', '_hash')
+    _frozen = ('name', 'variable', 'edges', 'histograms', '_hash')
+
+    def __init__(
+            self, name,
+            variable, edges, histograms):
+        Action.__init__(self, name, variable)
+        self.edges = tuple(edges)
+        self.histograms = tuple(histograms)
+        self._hash = hash((name, variable, self.edges, self.histograms))
+
+    def __eq__(self, other):
+        return self is other or (
+            isinstance(other, FineHistogram) and \
+            self.name == other.name and \
             self.variable == other.variable and \
-            self.edges == other.edges
+            self.edges == other.edges and \
+            self.histograms == other.histograms)
 
     def __hash__(self):
-        return hash((self.name, self.variable, tuple(self.edges)))
+        return self._hash
@@ -1,7 +1,18 @@
+from ._booking import _Frozen
+
 import logging
 logger = logging.getLogger(__name__)
 
-class Node:
+class Node(_Frozen):
+    """Node of a graph. Name, kind and block can not be replaced
+    after the creation, while the children can be modified by the
+    optimizations. The hash is computed at every call, since the
+    blocks can be changed in place (e.g. Dataset.add_to_ntuples or
+    Selection.add_cut).
+    """
+    __slots__ = ('name', 'kind', 'unit_block', 'children')
+    _frozen = ('name', 'kind', 'unit_block')
+
     def __init__(self,
             name, kind, unit_block, *children):
         self.name = name
@@ -18,11 +29,11 @@ class Node:
         return self.name
 
     def __eq__(self, other):
-        return self.name == other.name and \
+        return self is other or (
+            self.name == other.name and \
             self.kind == other.kind and \
-            self.unit_block == other.unit_block
+            self.unit_block == other.unit_block)
 
     def __hash__(self):
-        return hash((
-            self.name, self.kind, self.unit_block))
+        return hash((self.name, self.kind, self.unit_block))
 
@@ -130,11 +130,7 @@ def drawTree2(blnCompact):
             return lambda wsTree: go(wsTree)
 
         measuredTree = fmapTree(measured)(tree)
-        levelWidths = reduce(
-            lambda a, xs: a + [max(x[0] for x in xs)],
-            levels(measuredTree),
-            []
-        )
+        levelWidths = [max(x[0] for x in xs) for xs in levels(measuredTree)]
         treeLines = stringsFromLMR(
             foldr(lmrBuild)(None)(levelWidths)(
                 measuredTree
@@ -211,11 +207,17 @@ def intercalate(x):
     '''The concatenation of xs
        interspersed with copies of x.
     '''
-    return lambda xs: x.join(xs) if isinstance(x, str) else list(
-        chain.from_iterable(
-            reduce(lambda a, v: a + [x, v], xs[1:], [xs[0]])
-        )
-    ) if xs else []
+    def go(xs):
+        # Linear in the number of elements, unlike a reduce
+        # over list concatenations
+        interspersed = [xs[0]]
+        for v in xs[1:]:
+            interspersed.append(x)
+            interspersed.append(v)
+        return list(chain.from_iterable(interspersed))
+    return lambda xs: x.join(xs) if isinstance(x, str) else (
+        go(xs) if xs else []
+    )
 
 
 # iterate :: (a -> a) -> a -> Gen [a]
@@ -0,0 +1,127 @@
+import json
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class GraphProfile:
+    """Quantities measured while processing a graph (or a
+    shard of a graph) in a worker.
+
+    Attributes:
+        name (str): Name of the graph
+        pid (int): Process ID of the worker that processed the graph
+        booking_time (float): Seconds spent converting the graph
+            to RDataFrame operations
+        jit_time (float): Seconds between the start of the event
+            loop and the first processed entry, dominated by the
+            just-in-time compilation of the expressions
+        loop_time (float): Seconds spent in the event loop after
+            the first processed entry
+        entries (int): Number of entries processed
+        filters (list): List of dictionaries {path, name, all, pass}
+            with the entries seen and accepted by every named filter
+        actions (list): List of tuples (path, entries) with the
+            entries reaching every action of the graph
+        peak_rss (int): Peak resident set size of the worker, in kB
+        finished (float): Timestamp at which the worker finished
+        transfer_time (float): Seconds between the end of the
+            processing in the worker and the reception of the
+            results in the main process
+        write_time (float): Seconds spent writing the results
+    """
+    def __init__(self, name):
+        self.name = name
+        self.pid = None
+        self.booking_time = 0.
+        self.jit_time = 0.
+        self.loop_time = 0.
+        self.entries = 0
+        self.filters = list()
+        self.actions = list()
+        self.peak_rss = 0
+        self.finished = 0.
+        self.transfer_time = 0.
+        self.write_time = 0.
+
+    def __str__(self):
+        return 'GraphProfile-{}'.format(self.name)
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def events_per_second(self):
+        total_time = self.jit_time + self.loop_time
+        if total_time <= 0.:
+            return 0.
+        return self.entries / total_time
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'pid': self.pid,
+            'booking_time': self.booking_time,
+            'jit_time': self.jit_time,
+            'loop_time': self.loop_time,
+            'entries': self.entries,
+            'events_per_second': self.events_per_second,
+            'peak_rss_kb': self.peak_rss,
+            'transfer_time': self.transfer_time,
+            'write_time': self.write_time,
+            'filters': self.filters,
+            'actions': [{'path': list(path), 'entries': entries} \
+                    for path, entries in self.actions]}
+
+
+class RunProfile:
+    """Collection of the profiles of all the graphs processed
+    in a run, exported as JSON or as a flame-style summary.
+
+    Attributes:
+        graphs (list): List of GraphProfile objects
+        total_time (float): Wall-clock seconds of the whole run
+        write_time (float): Seconds spent writing the final output
+    """
+    def __init__(self):
+        self.graphs = list()
+        self.total_time = 0.
+        self.write_time = 0.
+
+    def add(self, graph_profile):
+        self.graphs.append(graph_profile)
+
+    def to_dict(self):
+        entries = sum([graph.entries for graph in self.graphs])
+        return {
+            'total_time': self.total_time,
+            'write_time': self.write_time,
+            'entries': entries,
+            'events_per_second': entries / self.total_time if self.total_time > 0. else 0.,
+            'graphs': [graph.to_dict() for graph in sorted(
+                self.graphs,
+                key = lambda graph: graph.jit_time + graph.loop_time,
+                reverse = True)]}
+
+    def write_json(self, path):
+        logger.info('Write profile of {} graphs to {}'.format(
+            len(self.graphs), path))
+        with open(path, 'w') as profile_file:
+            json.dump(self.to_dict(), profile_file, indent = 2)
+
+    def write_folded(self, path):
+        """Write the optimized graphs in the folded-stacks format
+        read by flame graph tools, one line per action:
+            dataset;selection;...;action entries
+        where entries is the number of entries reaching the action,
+        a proxy of the cost of the corresponding branch of the graph.
+        """
+        logger.info('Write flame-style summary of {} graphs to {}'.format(
+            len(self.graphs), path))
+        with open(path, 'w') as folded_file:
+            for graph in self.graphs:
+                for action_path, entries in graph.actions:
+                    folded_file.write('{} {}\n'.format(
+                        ';'.join([name.replace(';', '_') for name in action_path]),
+                        int(entries)))
@@ -0,0 +1,192 @@
+from threading import Thread
+from threading import Event
+from threading import Lock
+from queue import Empty
+from time import time
+import sys
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class TaskProgress:
+    def __init__(self, name, pid, total, started):
+        self.name = name
+        self.pid = pid
+        self.total = total
+        self.entries = 0
+        self.started = started
+        self.last_update = started
+        self.stalled = False
+
+
+class ProgressMonitor:
+    """Aggregate the progress reported by the workers through a
+    queue and periodically display the processed entries, the
+    throughput and the estimated time to completion.
+
+    The workers put on the queue tuples
+        ('start', task_id, name, pid, total_entries, timestamp)
+        ('progress', task_id, entries, timestamp)
+    while the end of every task is signaled by the main process
+    with the method finish, or with the method fail if the task
+    failed or its worker died.
+
+    Args:
+        queue (Queue): Queue shared with the workers
+        ntasks (int): Total number of tasks of the run
+        interval (float): Seconds between two updates of the display
+        stall_timeout (float): Seconds without any progress after
+            which a running task is reported as stalled
+
+    Attributes:
+        running (dict): Dictionary {task_id: TaskProgress} of the
+            tasks currently processed by the workers
+        done_entries (int): Entries processed by the finished tasks
+        done_tasks (int): Number of finished tasks
+    """
+    def __init__(self, queue, ntasks, interval = 5., stall_timeout = 600.):
+        self.queue = queue
+        self.ntasks = ntasks
+        self.interval = interval
+        self.stall_timeout = stall_timeout
+        self.running = dict()
+        self.done_entries = 0
+        self.done_tasks = 0
+        self.start_time = time()
+        self.__lock = Lock()
+        self.__stop = Event()
+        self.__thread = Thread(target = self.__loop, daemon = True)
+        self.__live = sys.stderr.isatty()
+
+    def start(self):
+        self.start_time = time()
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        self.__thread.join()
+        if self.__live:
+            sys.stderr.write('\n')
+
+    def finish(self, task_id):
+        with self.__lock:
+            self.__consume()
+            task = self.running.pop(task_id, None)
+            if task is not None:
+                self.done_entries += max(task.entries, task.total)
+            self.done_tasks += 1
+
+    def fail(self, task_id, retried = 0):
+        """Forget a failed task: its entries are no longer counted
+        and it is replaced in the total by the tasks retrying it.
+
+        Args:
+            task_id (str): Identifier of the failed task
+            retried (int): Number of tasks retrying it, 0 if it
+                is not retried
+        """
+        with self.__lock:
+            self.__consume()
+            self.running.pop(task_id, None)
+            self.ntasks += retried - 1
+
+    def __consume(self):
+        while True:
+            try:
+                message = self.queue.get_nowait()
+            except (Empty, EOFError, OSError):
+                return
+            if message[0] == 'start':
+                _, task_id, name, pid, total, timestamp = message
+                self.running[task_id] = TaskProgress(name, pid, total, timestamp)
+            elif message[0] == 'progress':
+                _, task_id, entries, timestamp = message
+                task = self.running.get(task_id)
+                if task is not None and entries > task.entries:
+                    task.entries = entries
+                    task.last_update = timestamp
+                    task.stalled = False
+
+    def __check_stalled(self, now):
+        for task in self.running.values():
+            if not task.stalled and now - task.last_update > self.stall_timeout:
+                task.stalled = True
+                logger.warning('Task {} (worker {}) made no progress in the last {:.0f} seconds, stuck at {}/{} entries'.format(
+                    task.name, task.pid, now - task.last_update, task.entries, task.total))
+
+    def status(self):
+        now = time()
+        processed = self.done_entries + sum(
+            [task.entries for task in self.running.values()])
+        elapsed = now - self.start_time
+        rate = processed / elapsed if elapsed > 0. else 0.
+        # Entries of the tasks not started yet are estimated from
+        # the average size of the known ones
+        known = self.done_tasks + len(self.running)
+        known_total = self.done_entries + sum(
+            [task.total for task in self.running.values()])
+        expected = known_total
+        if known:
+            expected += known_total / known * (self.ntasks - known)
+        eta = (expected - processed) / rate if rate > 0. else float('inf')
+        return processed, expected, rate, eta
+
+    def __display(self):
+        processed, expected, rate, eta = self.status()
+        line = '{}/{} tasks, {:.3g}/{:.3g} entries, {:.3g} events/s, ETA {}'.format(
+            self.done_tasks, self.ntasks, float(processed), float(expected), rate,
+            '{:.0f} s'.format(eta) if eta != float('inf') else 'unknown')
+        if self.__live:
+            sys.stderr.write('\r' + line)
+            sys.stderr.flush()
+        else:
+            logger.info(line)
+
+    def __loop(self):
+        while not self.__stop.wait(self.interval):
+            with self.__lock:
+                self.__consume()
+                self.__check_stalled(time())
+                self.__display()
+
+
+class ProgressReporter:
+    """Report from a worker the entries processed by the event
+    loops of a task, reading periodically the counters of the
+    LoopMonitor objects filled by the RDataFrame threads.
+
+    Args:
+        queue (Queue): Queue shared with the main process
+        task_id (str): Identifier of the task
+        name (str): Name of the task
+        pid (int): Process ID of the worker
+        monitors (list): LoopMonitor objects of the task
+        total (int): Total number of entries of the task
+        interval (float): Seconds between two reports
+    """
+    def __init__(self, queue, task_id, name, pid, monitors, total, interval = 2.):
+        self.queue = queue
+        self.task_id = task_id
+        self.monitors = monitors
+        self.interval = interval
+        self.__stop = Event()
+        self.__thread = Thread(target = self.__loop, daemon = True)
+        self.queue.put(('start', task_id, name, pid, total, time()))
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        self.__thread.join()
+        self.__report()
+
+    def __report(self):
+        entries = sum([monitor.GetEntries() for monitor in self.monitors])
+        self.queue.put(('progress', self.task_id, entries, time()))
+
+    def __loop(self):
+        while not self.__stop.wait(self.interval):
+            self.__report()
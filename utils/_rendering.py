@@ -0,0 +1,101 @@
+import json
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def render_text(graphs, max_children = 20):
+    """Indented text representation of the graphs, computed in
+    linear time in the number of nodes shown:
+        dataset
+        ├── selection
+        │   ├── action
+        │   └── ... 120 more children (120 action)
+        └── selection
+
+    Args:
+        graphs (list): List of Node objects
+        max_children (int): Maximum number of children shown for
+            every node, the others are summarized in a single line
+            with the number of nodes of each kind
+
+    Returns:
+        text (str): The rendered graphs
+    """
+    lines = list()
+    for graph in graphs:
+        lines.append(graph.name)
+        # Stack of (node, prefix, last child)
+        stack = [(child, '', i == len(graph.children) - 1) \
+                for i, child in reversed(list(enumerate(graph.children[:max_children])))]
+        if len(graph.children) > max_children:
+            stack.insert(0, (graph.children[max_children:], '', True))
+        while stack:
+            node, prefix, last = stack.pop()
+            branch = '└── ' if last else '├── '
+            if isinstance(node, list):
+                kinds = dict()
+                for hidden in node:
+                    kinds[hidden.kind] = kinds.get(hidden.kind, 0) + 1
+                lines.append('{}{}... {} more children ({})'.format(
+                    prefix, branch, len(node),
+                    ', '.join(['{} {}'.format(count, kind) for kind, count in kinds.items()])))
+                continue
+            lines.append(prefix + branch + node.name)
+            child_prefix = prefix + ('    ' if last else '│   ')
+            children = node.children[:max_children]
+            if len(node.children) > max_children:
+                stack.append((node.children[max_children:], child_prefix, True))
+            for i in reversed(range(len(children))):
+                stack.append((children[i], child_prefix,
+                    i == len(children) - 1 and len(node.children) <= max_children))
+    return '\n'.join(lines)
+
+
+def _walk(graphs):
+    """Pairs (node id, parent id) of all the nodes of the graphs,
+    parents first; the parent id of the roots is None.
+    """
+    next_id = 0
+    stack = [(graph, None) for graph in reversed(graphs)]
+    while stack:
+        node, parent = stack.pop()
+        node_id = next_id
+        next_id += 1
+        yield node, node_id, parent
+        for child in reversed(node.children):
+            stack.append((child, node_id))
+
+
+def render_dot(graphs):
+    """Graphviz DOT representation of the graphs, e.g. to be
+    rendered with 'dot -Tsvg plan.dot -o plan.svg'.
+    """
+    shapes = {'dataset': 'box3d', 'selection': 'box', 'action': 'ellipse'}
+    lines = ['digraph plan {', '    rankdir=LR;']
+    for node, node_id, parent in _walk(graphs):
+        lines.append('    n{} [label={}, shape={}];'.format(
+            node_id, json.dumps(node.name), shapes.get(node.kind, 'box')))
+        if parent is not None:
+            lines.append('    n{} -> n{};'.format(parent, node_id))
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def render_json(graphs):
+    """JSON representation of the graphs as a flat list of nodes
+    {id, parent, kind, name}, plus the cuts and weights of the
+    selections and the variables of the actions.
+    """
+    nodes = list()
+    for node, node_id, parent in _walk(graphs):
+        entry = {'id': node_id, 'parent': parent, 'kind': node.kind, 'name': node.name}
+        block = node.unit_block
+        if node.kind == 'selection':
+            entry['cuts'] = [cut.expression for cut in block.cuts]
+            entry['weights'] = [weight.expression for weight in block.weights]
+        elif node.kind == 'action':
+            entry['variable'] = getattr(block, 'variable', None)
+        nodes.append(entry)
+    return json.dumps({'nodes': nodes})
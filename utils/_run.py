@@ -1,12 +1,57 @@
+from array import array
+from bisect import bisect_right
+
+import numpy
+
+from ROOT import TH1D
+
 import logging
 logger = logging.getLogger(__name__)
 
+def root_array(low_level_view, size):
+    """NumPy view, without copy, of the size doubles of a ROOT buffer,
+    e.g. the array of the bin contents of a histogram.
+    """
+    low_level_view.reshape((size,))
+    return numpy.frombuffer(low_level_view, dtype = numpy.float64, count = size)
+
+
+def rebin_cells(fine_edges, edges, cells):
+    """Sum the cells (bins with under- and overflow) of a histogram with
+    bin edges fine_edges into the cells of a histogram with bin edges
+    edges, a subset of fine_edges with the same range, as if it was
+    filled directly.
+
+    Args:
+        fine_edges (list): Bin edges of the fine histogram
+        edges (list): Bin edges of the derived histogram
+        cells (list): Contents (or sums of the squares of the weights)
+            of the len(fine_edges) + 1 cells of the fine histogram
+
+    Returns:
+        summed (list): Contents of the len(edges) + 1 cells of
+            the derived histogram
+    """
+    # Cell of the derived histogram containing the lower edge of every
+    # fine bin, the overflow follows the last one
+    indices = [0] + [bisect_right(edges, edge) for edge in fine_edges[:-1]] + [len(edges)]
+    summed = [0.] * (len(edges) + 1)
+    for index, cell in zip(indices, cells):
+        summed[index] += cell
+    return summed
+
+
 class RDataFrameCutWeight:
     def __init__(self,
-            frame, cuts = [], weights = []):
+            frame, cuts = [], weights = [], last_filter = None,
+            dataset = None):
         self.frame = frame
         self.cuts = cuts
         self.weights = weights
+        # Index of the last named filter applied to the frame
+        self.last_filter = last_filter
+        # Dataset the frame was created from
+        self.dataset = dataset
 
     def __str__(self):
         return str((
@@ -24,3 +69,121 @@ class RDataFrameCutWeight:
     def __hash__(self):
         return hash((
             self.frame, self.cuts, self.weights))
+
+
+class CutflowResult:
+    """Result of a Cutflow action: fills the histogram with the
+    values of the counts booked for every cut when they are available.
+
+    Args:
+        histogram (TH1D): Empty histogram with 2 * len(weighted) bins
+        weighted (list): Pointers to the weighted counts
+        unweighted (list): Pointers to the unweighted counts
+    """
+    def __init__(self, histogram, weighted, unweighted):
+        self.histogram = histogram
+        self.weighted = weighted
+        self.unweighted = unweighted
+        self.pointers = weighted + unweighted
+
+    def GetValue(self):
+        for i, pointer in enumerate(self.pointers):
+            self.histogram.SetBinContent(i + 1, pointer.GetValue())
+        self.histogram.SetEntries(self.unweighted[0].GetValue())
+        return self.histogram
+
+
+class Task:
+    """Unit of work sent to a worker: a graph, or a shard of
+    a graph, together with the options used to process it.
+
+    Attributes:
+        task_id (str): Identifier of the task, stable across runs
+        graph (Graph): Graph to be processed
+        progress_queue (Queue): Queue where the worker reports the
+            processed entries, None to disable the reports
+        shared_memory (bool): Send back the histograms through a
+            shared memory block instead of pickling them
+        nthreads (int): Number of threads used by the event loop
+        payload (bytes): Serialized graph, sent to the worker in
+            place of the graph if set (see serialization.dump_graphs)
+        start_queue (Queue): Queue where the worker sends the task
+            identifier and its pid when it starts the task, used to
+            detect the tasks lost with a dead worker
+        attempt (int): Number of previous failed attempts
+        block (str): Name of the shared memory block of the results,
+            chosen by the main process for every attempt
+    """
+    def __init__(self,
+            task_id, graph, progress_queue = None,
+            shared_memory = True, nthreads = 1, payload = None,
+            start_queue = None, attempt = 0, block = None):
+        self.task_id = task_id
+        self.graph = graph
+        self.progress_queue = progress_queue
+        self.shared_memory = shared_memory
+        self.nthreads = nthreads
+        self.payload = payload
+        self.start_queue = start_queue
+        self.attempt = attempt
+        self.block = block
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.payload is not None:
+            state['graph'] = None
+        return state
+
+    def __str__(self):
+        return 'Task-{}'.format(self.graph.name)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class RebinnedResult:
+    """Result of a histogram derived from a FineHistogram: sums the
+    bins of the fine histogram falling in each of its bins when the
+    fine histogram is available. Since the ranges are the same, the
+    entries and the statistics (mean and RMS) are the ones of the
+    fine histogram, and the sums of the squares of the weights are
+    stored only if the fine histogram has them, as if the histogram
+    was filled directly.
+
+    Args:
+        pointer (RResultPtr): Pointer to the fine histogram
+        name (str): Name of the derived histogram
+        edges (tuple): Bin edges of the derived histogram, a subset
+            of the edges of the fine histogram with the same range
+    """
+    def __init__(self, pointer, name, edges):
+        self.pointer = pointer
+        self.name = name
+        self.edges = edges
+        self.pointers = [pointer]
+
+    def GetValue(self):
+        fine = self.pointer.GetValue()
+        histogram = TH1D(self.name, self.name, len(self.edges) - 1,
+            array('d', self.edges))
+        histogram.SetDirectory(0)
+        fine_axis = fine.GetXaxis()
+        fine_edges = [fine_axis.GetBinLowEdge(i) \
+                for i in range(1, fine_axis.GetNbins() + 2)]
+        ncells = fine_axis.GetNbins() + 2
+        contents = rebin_cells(fine_edges, self.edges,
+            [fine.GetBinContent(i) for i in range(ncells)])
+        for j, content in enumerate(contents):
+            histogram.SetBinContent(j, content)
+        if fine.GetSumw2N() > 0:
+            histogram.Sumw2()
+            sumw2 = rebin_cells(fine_edges, self.edges,
+                [fine.GetSumw2().At(i) for i in range(ncells)])
+            for j, cell in enumerate(sumw2):
+                histogram.GetSumw2().SetAt(cell, j)
+        # Set last, SetBinContent changes them
+        stats = numpy.zeros(4)
+        fine.GetStats(stats)
+        histogram.PutStats(stats)
+        histogram.SetEntries(fine.GetEntries())
+        return histogram
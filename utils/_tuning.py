@@ -0,0 +1,121 @@
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def available_cores():
+    """Number of cores the process is allowed to run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_memory():
+    """Memory available for new processes in bytes, None if
+    it can not be determined.
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def estimate_cost(graph):
+    """Relative cost of processing a graph: the size on disk of
+    the ntuples and friends read, scaled by the number of nodes
+    of the graph that are evaluated for every entry.
+    """
+    def count_nodes(node):
+        return 1 + sum([count_nodes(child) for child in node.children])
+
+    size = 0
+    for ntuple in graph.unit_block.ntuples:
+        for path in [ntuple.path] + [friend.path for friend in getattr(ntuple, 'friends', [])]:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                # Remote or missing file, count it as an average one
+                size += 1
+    return size * (1. + 0.05 * count_nodes(graph))
+
+
+def plan_workers_threads(
+        costs, nworkers = None, nthreads = None,
+        cores = None, memory = None,
+        memory_per_worker = 2 * 1024**3):
+    """Choose the number of workers and the number of threads
+    used for every task.
+
+    The tasks are meant to be dispatched in decreasing order of cost,
+    so that the largest ones start first. The number of workers is
+    limited by the number of tasks, by the cores and by the memory;
+    the cores are shared among the workers, and when the queue drains
+    (fewer tasks left than workers) the last tasks may use the cores
+    left idle by the workers that have nothing more to do. Since it
+    depends on which tasks are still running, the number of threads
+    planned here is only an upper bound: the threads of a task are
+    chosen when it starts with share_threads.
+
+    Args:
+        costs (list): Estimated costs of the tasks, in dispatch order
+        nworkers (int): Number of workers, chosen if None
+        nthreads (int): Number of threads of every task, chosen if None
+        cores (int): Cores available, detected if None
+        memory (int): Memory available in bytes, detected if None
+        memory_per_worker (int): Memory needed by every worker
+
+    Returns:
+        nworkers (int): Number of workers
+        nthreads (list): Maximum number of threads for every task
+    """
+    if cores is None:
+        cores = available_cores()
+    if memory is None:
+        memory = available_memory()
+    ntasks = len(costs)
+    if nworkers is None:
+        nworkers = max(1, min(ntasks, cores // (nthreads or 1)))
+        if memory is not None:
+            nworkers = max(1, min(nworkers, memory // memory_per_worker))
+    if nthreads is not None:
+        return nworkers, [nthreads] * ntasks
+    base = max(1, cores // nworkers)
+    nthreads = list()
+    for i in range(ntasks):
+        concurrent = max(1, min(nworkers, ntasks - i))
+        nthreads.append(max(base, cores // concurrent))
+    logger.info('Automatic tuning: {} cores, {} GB available, {} tasks -> {} workers, up to {} to {} threads per task'.format(
+        cores, 'unknown' if memory is None else '{:.1f}'.format(memory / 1024**3),
+        ntasks, nworkers, min(nthreads) if nthreads else base,
+        max(nthreads) if nthreads else base))
+    return nworkers, nthreads
+
+
+def share_threads(max_threads, cores, busy, starting):
+    """Number of threads of a task started now: the cores not used by
+    the tasks running, shared among the tasks starting at the same
+    time, so that the running tasks never use more threads than the
+    cores (unless there are fewer cores than tasks, every task having
+    at least one thread).
+
+    Args:
+        max_threads (int): Number of threads planned for the task
+        cores (int): Cores available
+        busy (int): Threads of the tasks running
+        starting (int): Tasks starting now, including this one, i.e.
+            the free workers if there are enough tasks waiting
+
+    Returns:
+        nthreads (int): Number of threads of the task
+    """
+    return max(1, min(max_threads, (cores - busy) // max(1, starting)))
@@ -0,0 +1,251 @@
+import os
+import re
+import json
+import hashlib
+
+from ROOT import gROOT
+gROOT.SetBatch(True)
+from ROOT import gInterpreter
+from ROOT import TFile
+from ROOT import TChain
+from ROOT import TClass
+from ROOT import RDataFrame
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+# Identifiers not preceded by a member access (. or ->), a scope
+# access or a digit (suffixes and exponents of numbers), nor followed
+# by a call or a scope access
+IDENTIFIER = re.compile(r'(?<![\w.])(?<!::)(?<!->)([A-Za-z_]\w*)(?!\s*(?:\(|::|\w))')
+STRING_LITERAL = re.compile(r'"(?:[^"\\]|\\.)*"')
+KEYWORDS = {
+    'and', 'or', 'not', 'true', 'false', 'nullptr', 'auto', 'const',
+    'bool', 'char', 'short', 'int', 'long', 'float', 'double', 'unsigned',
+    'signed', 'return', 'if', 'else', 'sizeof', 'static_cast'}
+
+# Results of the declarations made in the interpreter, shared by all
+# the validations of the process since the interpreter can not forget
+# a symbol: names known, and {expression key: compiles}. Unknown names
+# are not kept, since the user can declare them later.
+_declared = set()
+_compiled = dict()
+
+
+def referenced_identifiers(expression):
+    """Names used as variables in a C++ expression."""
+    expression = STRING_LITERAL.sub('""', expression)
+    return set(IDENTIFIER.findall(expression)) - KEYWORDS
+
+
+class SchemaCache:
+    """Names of the branches of the trees, read once and optionally
+    kept in a JSON file, invalidated when the modification time or
+    the size of a local file change.
+
+    Args:
+        path (str): JSON file where the schemas are stored, only
+            kept in memory if None
+
+    Attributes:
+        schemas (dict): Dictionary {path:directory: {stamp, branches}}
+    """
+    def __init__(self, path = None):
+        self.path = path
+        self.schemas = dict()
+        self.__modified = False
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as schema_file:
+                    self.schemas = json.load(schema_file)
+            except (OSError, ValueError) as error:
+                logger.warning('Can not read schema cache {} ({}), start a new one'.format(
+                    path, error))
+
+    def __stamp(self, path):
+        try:
+            stat = os.stat(path)
+            return [stat.st_mtime, stat.st_size]
+        except OSError:
+            # Remote file, assumed not to change
+            return None
+
+    def branches(self, ntuple):
+        """Set of the branches and aliases of the tree of ntuple.
+
+        Raises:
+            FileNotFoundError: The file or the tree can not be read
+        """
+        key = '{}:{}'.format(ntuple.path, ntuple.directory)
+        stamp = self.__stamp(ntuple.path)
+        entry = self.schemas.get(key)
+        if entry is None or entry['stamp'] != stamp:
+            root_file = TFile.Open(ntuple.path)
+            if not root_file or root_file.IsZombie():
+                raise FileNotFoundError('can not open {}'.format(ntuple.path))
+            tree = root_file.Get(ntuple.directory)
+            if not tree:
+                root_file.Close()
+                raise FileNotFoundError('no tree {} in {}'.format(
+                    ntuple.directory, ntuple.path))
+            branches = [branch.GetName() for branch in tree.GetListOfBranches()]
+            aliases = tree.GetListOfAliases()
+            if aliases:
+                branches.extend([alias.GetName() for alias in aliases])
+            root_file.Close()
+            entry = {'stamp': stamp, 'branches': branches}
+            self.schemas[key] = entry
+            self.__modified = True
+        return set(entry['branches'])
+
+    def save(self):
+        if self.path is None or not self.__modified:
+            return
+        temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp_path, 'w') as schema_file:
+            json.dump(self.schemas, schema_file)
+        os.replace(temp_path, self.path)
+        self.__modified = False
+
+
+class _Validator:
+    def __init__(self, schema_cache, compile_expressions):
+        self.schema_cache = schema_cache
+        self.compile_expressions = compile_expressions
+        self.errors = list()
+        self.checked = set()
+        # Names unknown during this validation
+        self.unknown = set()
+
+    def is_declared(self, name):
+        """The interpreter knows name, e.g. a function or a constant
+        declared by the user.
+        """
+        if name in _declared:
+            return True
+        if name in self.unknown:
+            return False
+        known = bool(gROOT.GetListOfGlobals().FindObject(name)) or \
+                bool(gROOT.GetListOfGlobalFunctions().FindObject(name)) or \
+                bool(gROOT.GetListOfTypes().FindObject(name)) or \
+                bool(TClass.GetClass(name, False, True))
+        if not known:
+            # Macros and variables in namespaces, e.g. M_PI, declared
+            # once since the alias can not be redefined
+            known = bool(gInterpreter.Declare(
+                'namespace ntuple_processor_preflight {{ using type_{0} = decltype({0}); }}'.format(
+                    name)))
+        if known:
+            _declared.add(name)
+        else:
+            self.unknown.add(name)
+        return known
+
+    def compile(self, frame, columns, expression):
+        arguments = ', '.join(['const {} &{}'.format(frame.GetColumnType(column), column) \
+                for column in sorted(columns)])
+        # Named after its content, so that the same expression with the
+        # same column types is declared once per process
+        key = hashlib.sha1('{}\n{}'.format(arguments, expression).encode()).hexdigest()[:16]
+        if key not in _compiled:
+            _compiled[key] = bool(gInterpreter.Declare('''
+#ifndef NTUPLE_PROCESSOR_PREFLIGHT_{0}
+#define NTUPLE_PROCESSOR_PREFLIGHT_{0}
+namespace ntuple_processor_preflight {{ auto expression_{0}({1}) {{ return ({2}); }} }}
+#endif
+'''.format(key, arguments, expression)))
+        return _compiled[key]
+
+    def dataset_schema(self, dataset):
+        ntuple = dataset.ntuples[0]
+        columns = self.schema_cache.branches(ntuple)
+        for friend in ntuple.friends:
+            columns |= self.schema_cache.branches(friend)
+        return ntuple, columns
+
+    def frame(self, ntuple):
+        chain = TChain()
+        chain.Add('{}/{}'.format(ntuple.path, ntuple.directory))
+        friends = list()
+        for friend in ntuple.friends:
+            friend_chain = TChain()
+            friend_chain.Add('{}/{}'.format(friend.path, friend.directory))
+            chain.AddFriend(friend_chain)
+            friends.append(friend_chain)
+        return chain, friends, RDataFrame(chain)
+
+    def validate(self, graph):
+        dataset = graph.unit_block
+        try:
+            ntuple, columns = self.dataset_schema(dataset)
+        except FileNotFoundError as error:
+            self.errors.append('Dataset {}: {}'.format(dataset.name, error))
+            return
+        schema_key = (ntuple.path, ntuple.directory) + tuple(
+            [(friend.path, friend.directory) for friend in ntuple.friends])
+        items = list()
+        stack = [graph]
+        while stack:
+            node = stack.pop()
+            if node.kind == 'selection':
+                items.extend([('cut', cut.name, cut.expression) \
+                        for cut in node.unit_block.cuts])
+                items.extend([('weight', weight.name, weight.expression) \
+                        for weight in node.unit_block.weights])
+            elif node.kind == 'action' and node.unit_block.variable is not None:
+                items.append(('variable', node.name, node.unit_block.variable))
+            stack.extend(node.children)
+        to_compile = list()
+        for kind, name, expression in items:
+            if (schema_key, kind, expression) in self.checked:
+                continue
+            self.checked.add((schema_key, kind, expression))
+            if kind == 'variable':
+                if expression not in columns:
+                    self.errors.append('Dataset {}: variable {} of action {} is not a column of {}'.format(
+                        dataset.name, expression, name, ntuple.directory))
+                continue
+            used = referenced_identifiers(expression)
+            unknown = [identifier for identifier in sorted(used - columns) \
+                    if not self.is_declared(identifier)]
+            if unknown:
+                self.errors.append('Dataset {}: {} {} ({}) uses unknown columns {}'.format(
+                    dataset.name, kind, name, expression, ', '.join(unknown)))
+            elif self.compile_expressions:
+                to_compile.append((kind, name, expression, used & columns))
+        if to_compile:
+            chain, friends, frame = self.frame(ntuple)
+            for kind, name, expression, used_columns in to_compile:
+                if not self.compile(frame, used_columns, expression):
+                    self.errors.append('Dataset {}: {} {} ({}) does not compile'.format(
+                        dataset.name, kind, name, expression))
+
+
+def validate_graphs(graphs, schema_cache = None, compile_expressions = True):
+    """Check, before running the event loops, that the columns used
+    by the cuts, the weights and the actions of the graphs exist in
+    the trees (or in their friends) of the datasets, and that every
+    expression compiles. Each expression is checked once for every
+    schema, which is read from the first ntuple of the dataset.
+
+    Args:
+        graphs (list): List of Graph objects
+        schema_cache (SchemaCache): Cache of the branches of the
+            trees, a new in-memory one if None
+        compile_expressions (bool): Compile the expressions with
+            the types of the columns they use
+
+    Returns:
+        errors (list): List of messages describing the problems found
+    """
+    if schema_cache is None:
+        schema_cache = SchemaCache()
+    validator = _Validator(schema_cache, compile_expressions)
+    for graph in graphs:
+        validator.validate(graph)
+    schema_cache.save()
+    logger.info('Pre-flight validation of {} graphs: {} expressions checked, {} errors'.format(
+        len(graphs), len(validator.checked), len(validator.errors)))
+    return validator.errors
@@ -1,8 +1,8 @@
-from copy import deepcopy
-
 from .booking import Unit
 from .booking import dataset_from_artusoutput
 from .utils import Selection
+from .utils import Dataset
+from .utils import Ntuple
 from .utils import Variation
 
 import logging
@@ -12,9 +12,9 @@ logger = logging.getLogger(__name__)
 
 class ChangeDataset(Variation):
     """
-    Variation that with the method create makes a deepcopy of
-    the dataset inside the unit passed as argument and substitutes
-    the directory attribute with folder_name.
+    Variation that with the method create makes a copy of
+    the dataset inside the unit passed as argument, with
+    folder_name substituted in the directory of the ntuples.
 
     Args:
         name (str): name used to identify the instance of
@@ -38,17 +38,16 @@ class ChangeDataset(Variation):
         self.folder_name = folder_name
 
     def create(self, unit):
-        # A perfect copy of the daatset is exactly what
-        # we need, thus using deepcopy is fine
-        def change_folder(ntuple):
+        # Ntuples are immutable, new ones are created
+        # with the new directory
+        def change_folder(ntuple, friends = None):
             folder, tree = ntuple.directory.split('/')
-            ntuple.directory = '{}_{}/{}'.format(
-                    folder.split('_')[0], self.folder_name, tree)
-        new_dataset = deepcopy(unit.dataset)
-        for ntuple in new_dataset.ntuples:
-            change_folder(ntuple)
-            for friend in ntuple.friends:
-                change_folder(friend)
+            return Ntuple(ntuple.path, '{}_{}/{}'.format(
+                    folder.split('_')[0], self.folder_name, tree),
+                friends, ntuple.tag)
+        new_dataset = Dataset(unit.dataset.name, [
+            change_folder(ntuple, [change_folder(friend) for friend in ntuple.friends]) \
+                    for ntuple in unit.dataset.ntuples])
         return Unit(new_dataset, unit.selections, unit.actions, self)
 
 
@@ -127,7 +126,8 @@ class RemoveCut(Variation):
                 if cut.name == self.removed_name]):
             logger.fatal('Cut {} not found in any selection of this Unit'.format(self.removed_name))
             raise NameError
-        new_selections = [selection for selection in unit.selections]
+        new_selections = [Selection(selection.name, selection.cuts, selection.weights) \
+                for selection in unit.selections]
         for new_selection in new_selections:
             new_selection.remove_cut(self.removed_name)
         return Unit(unit.dataset, new_selections, unit.actions, self)
@@ -145,7 +145,8 @@ class RemoveWeight(Variation):
                 if weight.name == self.removed_name]):
             logger.fatal('Weight {} not found in any selection of this Unit'.format(self.removed_name))
             raise NameError
-        new_selections = [selection for selection in unit.selections]
+        new_selections = [Selection(selection.name, selection.cuts, selection.weights) \
+                for selection in unit.selections]
         for new_selection in new_selections:
             new_selection.remove_weight(self.removed_name)
         return Unit(unit.dataset, new_selections, unit.actions, self)
@@ -190,11 +191,10 @@ class SquareWeight(Variation):
                 if weight.name == self.weight_name]):
             logger.fatal('Weight {} not found in any selection of this Unit'.format(self.weight_name))
             raise NameError
-        new_selections = [selection for selection in unit.selections]
-        for new_selection in new_selections:
-            for weight in new_selection.weights:
-                if weight.name == self.name:
-                    weight.square()
+        new_selections = [Selection(selection.name, selection.cuts,
+                    [weight.square() if weight.name == self.weight_name else weight \
+                            for weight in selection.weights]) \
+                for selection in unit.selections]
         return Unit(unit.dataset, new_selections, unit.actions, self)
 
 